@@ -0,0 +1,261 @@
+import knime.extension as knext
+
+import pandas as pd
+import logging
+
+from utils.port_objects import (
+    crn_definition_port_type,
+    CrnDefinitionSpec,
+    CrnDefinitionPortObject,
+)
+
+from utils.port_objects import (
+    simulation_data_port_type,
+    SimulationDataSpec,
+    SimulationDataPortObject,
+)
+
+from utils.port_objects import (
+    deep_abstraction_model_port_type,
+    DeepAbstractionModelSpec,
+    DeepAbstractionModelPortObject,
+)
+
+from utils.categories import deep_abstractions_category
+from utils.active_learning import run_active_learning
+from utils.mdn_manager import MdnManager
+from utils.simulation_manager import SimulationManager
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
+
+LOGGER = logging.getLogger(__name__)
+ZERO_PERTURB_RANGE = (0, 10)
+
+
+@knext.node(
+    name="Deep Abstraction Active Learner",
+    node_type=knext.NodeType.LEARNER,
+    icon_path="src/assets/icons/icon.png",
+    category=deep_abstractions_category,
+)
+@knext.input_port(
+    name="CRN Definition",
+    description="The CRN model to learn a deep abstract model for.",
+    port_type=crn_definition_port_type,
+)
+@knext.output_port(
+    name="Trained Deep Abstract Model",
+    description="The trained deep abstract model.",
+    port_type=deep_abstraction_model_port_type,
+)
+@knext.output_port(
+    name="Training simulation data",
+    description="Object containing all the training data generated during active learning.",
+    port_type=simulation_data_port_type,
+)
+@knext.output_table(
+    name="Iterations",
+    description="The size of the training data and the validation loss after every iteration.",
+)
+class DeepAbstractionActiveLearner:
+    """
+    Generates training data and trains a deep abstract model, spending the SSA budget where the model is worst.
+
+    The model is first trained on a small set of randomized initial conditions. Then, in every iteration, a large pool
+    of candidate initial conditions is scored by the uncertainty the model predicts for them, only the most uncertain
+    candidates are simulated with SSA, and the model is fine-tuned on the extended data. The loop stops as soon as
+    the validation loss reaches the target, or after the maximum number of iterations.
+    """
+
+    end_time = knext.DoubleParameter(
+        label="End time",
+        description="Time at which to stop the simulation.",
+        default_value=50.0,
+        min_value=0.1,
+    )
+
+    n_steps = knext.IntParameter(
+        label="Steps",
+        description="Number of steps to perform during the specified span of time.",
+        default_value=50,
+        min_value=1,
+    )
+
+    n_sims_per_init_condition = knext.IntParameter(
+        label="Simulations per initial condition",
+        description="Number of simulations to perform per initial condition.",
+        default_value=10,
+        min_value=1,
+    )
+
+    n_initial_conditions = knext.IntParameter(
+        label="Number of initial conditions",
+        description="The number of randomized initial conditions to train the initial model on.",
+        default_value=20,
+        min_value=2,
+    )
+
+    n_new_conditions = knext.IntParameter(
+        label="New initial conditions per iteration",
+        description="The number of the most uncertain candidate initial conditions to simulate in every iteration.",
+        default_value=10,
+        min_value=1,
+    )
+
+    n_candidates = knext.IntParameter(
+        label="Candidate initial conditions per iteration",
+        description="The number of candidate initial conditions to score in every iteration.",
+        default_value=500,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    max_iterations = knext.IntParameter(
+        label="Maximum number of iterations",
+        description="The maximum number of iterations, each of which simulates new initial conditions.",
+        default_value=5,
+        min_value=0,
+    )
+
+    target_loss = knext.DoubleParameter(
+        label="Target validation loss",
+        description="Active learning stops once the validation loss of the model is at most this value.",
+        default_value=-1.0,
+    )
+
+    n_epochs = knext.IntParameter(
+        label="Number of epochs",
+        description="The number of epochs to train the initial model for.",
+        default_value=20,
+        min_value=1,
+    )
+
+    n_fine_tune_epochs = knext.IntParameter(
+        label="Number of fine-tuning epochs",
+        description="The number of epochs to fine-tune the model for in every iteration.",
+        default_value=5,
+        min_value=1,
+    )
+
+    variance_range = knext.DoubleParameter(
+        label="Variance degree",
+        description="The degree of the random perturbation to apply to the initial conditions.",
+        default_value=0.1,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    zero_perturb_prob = knext.DoubleParameter(
+        label="Zero perturbation probability",
+        description="Probability of replacing a species with a zero initial concentration with a random value.",
+        default_value=0.9,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    batch_size = knext.IntParameter(
+        label="Batch size",
+        description="The number of training examples in one forward/backward pass.",
+        default_value=128,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def configure(
+        self, config_context: knext.ConfigurationContext, input_spec: CrnDefinitionSpec
+    ):
+        return (
+            DeepAbstractionModelSpec(dict()),
+            SimulationDataSpec(dict()),
+            knext.Schema(
+                ktypes=[knext.int64(), knext.int64(), knext.int64(), knext.double()],
+                names=[
+                    "iteration",
+                    "n_init_conditions",
+                    "n_trajectories",
+                    "validation_loss",
+                ],
+            ),
+        )
+
+    @profile_execute
+    def execute(
+        self,
+        exec_context: knext.ExecutionContext,
+        input_port_object: CrnDefinitionPortObject,
+    ):
+        ant_definition = input_port_object.data
+        sm = SimulationManager(ant_definition)
+        sm.set_model_parameters(
+            self.n_initial_conditions,
+            self.n_sims_per_init_condition,
+            0.0,
+            self.end_time,
+            self.n_steps,
+        )
+        parameter_values = sm.get_original_parameter_values()
+
+        mm = MdnManager(sm.get_num_species())
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
+        data, history = run_active_learning(
+            sm,
+            mm,
+            exec_context,
+            n_initial_conditions=self.n_initial_conditions,
+            n_new_conditions=self.n_new_conditions,
+            n_candidates=self.n_candidates,
+            max_iterations=self.max_iterations,
+            target_loss=self.target_loss,
+            n_epochs=self.n_epochs,
+            n_fine_tune_epochs=self.n_fine_tune_epochs,
+            batch_size=self.batch_size,
+            sampling_kwargs={
+                "range_percentage": self.variance_range,
+                "zero_perturb_prob": self.zero_perturb_prob,
+                "zero_perturb_range": ZERO_PERTURB_RANGE,
+            },
+        )
+
+        data_spec = {
+            "species": sm.get_species_names(),
+            "parameters": sm.get_parameter_names(),
+            "parameter_values": [float(v) for v in parameter_values],
+            "antimony_definition": ant_definition,
+            "simulation_configuration": {
+                "n_init_conditions": len(data) // self.n_sims_per_init_condition,
+                "n_sims_per_init_condition": self.n_sims_per_init_condition,
+                "start_time": 0.0,
+                "end_time": self.end_time,
+                "n_steps": self.n_steps,
+                "randomized_reaction_rates": False,
+            },
+        }
+
+        model_spec = dict(data_spec)
+        model_spec["simulation_configuration"] = {
+            "step_size": self.end_time / self.n_steps,
+        }
+        model_spec["model_configuration"] = mm.get_model_configuration()
+        model_spec["training_report"] = {
+            "validation_loss": history[-1]["validation_loss"],
+            "prediction_horizon": mm.prediction_horizon,
+        }
+        model_spec["training_envelope"] = mm.get_training_envelope()
+
+        return (
+            DeepAbstractionModelPortObject(
+                DeepAbstractionModelSpec(model_spec),
+                {"model_weights": mm.get_model_weights()},
+            ),
+            SimulationDataPortObject(SimulationDataSpec(data_spec), data),
+            knext.Table.from_pandas(pd.DataFrame(history)),
+        )
@@ -0,0 +1,217 @@
+import knime.extension as knext
+
+import numpy as np
+import pandas as pd
+import logging
+import time
+
+from utils.port_objects import (
+    deep_abstraction_model_port_type,
+    DeepAbstractionModelSpec,
+    DeepAbstractionModelPortObject,
+)
+
+from utils.categories import deep_abstractions_category
+from utils.metrics import compare_ensembles
+from utils.model_cache import get_mdn_manager
+from utils.simulation_manager import SimulationManager
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
+
+LOGGER = logging.getLogger(__name__)
+ZERO_PERTURB_RANGE = (0, 10)
+
+
+@knext.node(
+    name="Deep Abstraction Evaluator",
+    node_type=knext.NodeType.OTHER,
+    icon_path="src/assets/icons/icon.png",
+    category=deep_abstractions_category,
+)
+@knext.input_port(
+    name="Trained Deep Abstraction Model",
+    description="Object containing the trained deep abstract model to evaluate.",
+    port_type=deep_abstraction_model_port_type,
+)
+@knext.output_table(
+    name="Accuracy per time point",
+    description="Distances between the SSA and deep abstraction ensembles for every time point and species, averaged over the initial conditions.",
+)
+@knext.output_table(
+    name="Evaluation summary",
+    description="Overall accuracy metrics, and the wall time and speedup of the deep abstract model over SSA.",
+)
+class DeepAbstractionEvaluator:
+    """
+    Evaluates the statistical accuracy and the speedup of a deep abstract model against SSA.
+
+    For a set of randomized initial conditions, ensembles of trajectories are generated both with SSA and with the
+    deep abstract model, whose trajectories sample every next state from the predicted distribution. For every initial condition, time point and species, the two ensembles are compared using the
+    Wasserstein-1 distance, the Kolmogorov-Smirnov statistic, and the errors of their means and variances.
+    The speedup is the wall time of SSA divided by the wall time of the deep abstract model.
+    """
+
+    n_init_conditions = knext.IntParameter(
+        label="Number of initial conditions",
+        description="Number of randomized initial conditions to compare the ensembles for.",
+        default_value=10,
+        min_value=1,
+    )
+
+    n_sims_per_init_condition = knext.IntParameter(
+        label="Number of simulations per initial condition",
+        description="The size of the ensembles. Larger ensembles make the comparison more reliable.",
+        default_value=100,
+        min_value=2,
+    )
+
+    n_steps = knext.IntParameter(
+        label="Number of steps per simulation",
+        description="Number of steps of the model's step size to simulate.",
+        default_value=50,
+        min_value=1,
+    )
+
+    variance_range = knext.DoubleParameter(
+        label="Variance degree",
+        description="The degree of the random perturbation to apply to the initial conditions.",
+        default_value=0.1,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    zero_perturb_prob = knext.DoubleParameter(
+        label="Zero perturbation probability",
+        description="Probability of replacing a species with a zero initial concentration with a random value.",
+        default_value=0.9,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def configure(
+        self,
+        config_context: knext.ConfigurationContext,
+        input_spec: DeepAbstractionModelSpec,
+    ):
+        per_time_point_schema = knext.Schema(
+            ktypes=[knext.double(), knext.string()] + [knext.double()] * 4,
+            names=[
+                "time",
+                "species",
+                "wasserstein_1",
+                "ks_statistic",
+                "mean_error",
+                "variance_error",
+            ],
+        )
+        summary_schema = knext.Schema(
+            ktypes=[knext.string(), knext.double()], names=["metric", "value"]
+        )
+        return per_time_point_schema, summary_schema
+
+    @profile_execute
+    def execute(
+        self,
+        exec_context: knext.ExecutionContext,
+        input_port_object: DeepAbstractionModelPortObject,
+    ):
+        spec_data = input_port_object.spec.spec_data
+        species_names = spec_data["species"]
+        n_species = len(species_names)
+        time_step = spec_data["simulation_configuration"]["step_size"]
+        end_time = time_step * self.n_steps
+
+        sm = SimulationManager(spec_data["antimony_definition"])
+        sm.set_model_parameters(
+            self.n_init_conditions,
+            self.n_sims_per_init_condition,
+            0.0,
+            end_time,
+            self.n_steps,
+        )
+        init_conditions = sm.get_randomized_initial_conditions(
+            range_percentage=self.variance_range,
+            zero_perturb_prob=self.zero_perturb_prob,
+            zero_perturb_range=ZERO_PERTURB_RANGE,
+        )
+
+        exec_context.set_progress(0.0, "Simulating with SSA")
+        start = time.perf_counter()
+        ssa_data = sm.simulate(init_conditions, exec_context)
+        ssa_seconds = time.perf_counter() - start
+
+        model_configuration = input_port_object.spec.model_configuration
+        mm = get_mdn_manager(model_configuration, input_port_object.data["model_weights"])
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
+        da_init_conditions = sm.add_time_column(init_conditions)
+        if mm.n_parameters > 0:
+            parameter_values = sm.get_original_parameter_values()
+            da_init_conditions = np.hstack(
+                (
+                    da_init_conditions,
+                    np.tile(parameter_values, (len(da_init_conditions), 1)),
+                )
+            )
+
+        exec_context.set_progress(0.0, "Simulating with the deep abstract model")
+        start = time.perf_counter()
+        da_data = mm.simulate(
+            da_init_conditions,
+            exec_context,
+            time_step,
+            self.n_steps,
+            self.n_sims_per_init_condition,
+            # the distributional metrics require a stochastic ensemble, not the repeated mean trajectory
+            sample=True,
+        )
+        da_seconds = time.perf_counter() - start
+
+        # shape (n_init_conditions, n_sims_per_init_condition, n_steps + 1, n_species)
+        ensemble_shape = (
+            self.n_init_conditions,
+            self.n_sims_per_init_condition,
+            self.n_steps + 1,
+            n_species,
+        )
+        metrics = compare_ensembles(
+            ssa_data[..., 1 : n_species + 1].reshape(ensemble_shape),
+            da_data[..., 1 : n_species + 1].reshape(ensemble_shape),
+        )
+
+        # average over the initial conditions, one row per time point and species
+        times = ssa_data[0, :, 0]
+        per_time_point = pd.DataFrame(
+            {
+                "time": np.repeat(times, n_species),
+                "species": np.tile(species_names, len(times)),
+                **{
+                    name: values.mean(axis=0).reshape(-1)
+                    for name, values in metrics.items()
+                },
+            }
+        )
+
+        summary_rows = [
+            (f"{name} (mean)", float(values.mean())) for name, values in metrics.items()
+        ]
+        summary_rows += [
+            ("ks_statistic (max)", float(metrics["ks_statistic"].max())),
+            ("ssa_seconds", ssa_seconds),
+            ("da_seconds", da_seconds),
+            ("speedup", ssa_seconds / da_seconds if da_seconds > 0 else float("inf")),
+        ]
+        summary = pd.DataFrame(summary_rows, columns=["metric", "value"])
+
+        return (
+            knext.Table.from_pandas(per_time_point),
+            knext.Table.from_pandas(summary),
+        )
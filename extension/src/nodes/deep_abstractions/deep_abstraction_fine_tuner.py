@@ -0,0 +1,238 @@
+import knime.extension as knext
+
+import numpy as np
+import logging
+
+from utils.port_objects import (
+    simulation_data_port_type,
+    SimulationDataSpec,
+    SimulationDataPortObject,
+)
+
+from utils.port_objects import (
+    deep_abstraction_model_port_type,
+    DeepAbstractionModelSpec,
+    DeepAbstractionModelPortObject,
+)
+
+from utils.categories import deep_abstractions_category
+from utils.mdn_manager import MdnManager
+from utils.simulation_manager import SimulationManager
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+def check_species_layout(data_spec: dict, model_spec: dict):
+    """
+    Raises a ValueError if the training data and the existing model do not describe the same species,
+    in the same order. Empty specs (i.e. before the upstream nodes were executed) are not checked.
+    """
+    if "species" not in data_spec or "species" not in model_spec:
+        return
+
+    if list(data_spec["species"]) != list(model_spec["species"]):
+        raise ValueError(
+            f"The species of the training data {data_spec['species']} do not match the species of the model {model_spec['species']}."
+        )
+
+
+@knext.node(
+    name="Deep Abstraction Fine-Tuner",
+    node_type=knext.NodeType.LEARNER,
+    icon_path="src/assets/icons/icon.png",
+    category=deep_abstractions_category,
+)
+@knext.input_port(
+    name="Training data",
+    description="New CRN simulation data generated using SSA and used for fine-tuning.",
+    port_type=simulation_data_port_type,
+)
+@knext.input_port(
+    name="Trained Deep Abstract Model",
+    description="The existing deep abstract model to initialise the training from.",
+    port_type=deep_abstraction_model_port_type,
+)
+@knext.output_port(
+    name="Fine-tuned Deep Abstract Model",
+    description="The fine-tuned deep abstract model.",
+    port_type=deep_abstraction_model_port_type,
+)
+class DeepAbstractionFineTuner:
+    """
+    Fine-tunes an existing deep abstract model on new CRN simulation data.
+
+    Instead of training a freshly initialised model, the training starts from the weights of the provided model,
+    which must have been trained for the same CRN. This is useful when additional training data has been generated,
+    or the perturbation ranges have changed, since only the new data needs to be trained on.
+
+    If the provided model was trained with a replay sample (see the Deep Abstraction Learner node), a part of it can be
+    mixed into the new training data to prevent the model from forgetting the original dynamics.
+    """
+
+    n_epochs = knext.IntParameter(
+        label="Number of epochs",
+        description="""
+        The number of epochs to fine-tune the deep abstract model for.
+
+        Fine-tuning usually requires fewer epochs than training from scratch.""",
+        default_value=10,
+        min_value=1,
+    )
+
+    learning_rate = knext.DoubleParameter(
+        label="Learning rate",
+        description="""
+        The learning rate used during fine-tuning.
+
+        A learning rate lower than the one used for the original training helps to retain what the model already learned.""",
+        default_value=1e-4,
+        min_value=1e-8,
+    )
+
+    replay_fraction = knext.DoubleParameter(
+        label="Replay fraction",
+        description="""
+        The fraction of the model's stored replay sample to mix into the training set.
+
+        Has no effect if the model was trained without a replay sample.""",
+        default_value=1.0,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    patience = knext.IntParameter(
+        label="Training patience",
+        description="""
+        The number of epochs to wait before early stopping.
+
+        Early stopping is a form of regularisation used to avoid overfitting.""",
+        default_value=5,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    batch_size = knext.IntParameter(
+        label="Batch size",
+        description="""
+        The number of training examples in one forward/backward pass.
+
+        The higher the batch size, the more available memory is required.""",
+        default_value=128,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def configure(
+        self,
+        config_context: knext.ConfigurationContext,
+        data_spec: SimulationDataSpec,
+        model_spec: DeepAbstractionModelSpec,
+    ):
+        check_species_layout(data_spec.spec_data, model_spec.spec_data)
+        return DeepAbstractionModelSpec(dict())
+
+    @profile_execute
+    def execute(
+        self,
+        exec_context: knext.ExecutionContext,
+        data_port_object: SimulationDataPortObject,
+        model_port_object: DeepAbstractionModelPortObject,
+    ):
+        data_spec = data_port_object.spec.spec_data
+        model_spec = model_port_object.spec.spec_data
+        check_species_layout(data_spec, model_spec)
+        if "chunk_store" in data_spec:
+            raise ValueError(
+                "The training data is stored in a chunk store, which is only supported by the Deep Abstraction Learner."
+            )
+
+        # the new data may be recorded at a finer resolution than the model's step size
+        sim_config = data_spec["simulation_configuration"]
+        base_step_size = sim_config["end_time"] / sim_config["n_steps"]
+        step_size = model_spec["simulation_configuration"]["step_size"]
+        step_stride = int(round(step_size / base_step_size))
+        if step_stride < 1 or not np.isclose(base_step_size * step_stride, step_size):
+            raise ValueError(
+                f"The step size of the model ({step_size}) is not a multiple of the step size of the training data ({base_step_size})."
+            )
+
+        training_data = SimulationManager.get_strided_dataset(
+            data_port_object.data, step_stride
+        )
+        mm = MdnManager.from_configuration(model_port_object.spec.model_configuration)
+        mm.set_model_weights(model_port_object.data["model_weights"])
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
+        mm.load_data(training_data)
+
+        replay_data = model_port_object.data.get("replay_data")
+        replay_sample = None
+        if replay_data is not None and self.replay_fraction > 0:
+            n_replay = int(len(replay_data) * self.replay_fraction)
+            indices = np.random.choice(len(replay_data), n_replay, replace=False)
+            replay_sample = replay_data[np.sort(indices)]
+            LOGGER.info(f"Replaying {n_replay} trajectories of the original data.")
+
+        mm.prepare_data_loaders(
+            batch_size=self.batch_size,
+            replay_data=replay_sample,
+            base_step_size=step_size,
+        )
+        mm.train(
+            exec_context=exec_context,
+            n_epochs=self.n_epochs,
+            patience=self.patience,
+            learning_rate=self.learning_rate,
+        )
+
+        data = {
+            "model_weights": mm.get_model_weights(),
+        }
+        if replay_data is not None:
+            # refresh the replay sample with the new data, keeping its size constant
+            if replay_data.shape[1:] == training_data.shape[1:]:
+                n_new = min(len(replay_data) // 2, len(training_data))
+                keep = np.random.choice(
+                    len(replay_data), len(replay_data) - n_new, replace=False
+                )
+                data["replay_data"] = np.concatenate(
+                    [replay_data[np.sort(keep)], mm.get_replay_sample(n_new)], axis=0
+                )
+            else:
+                data["replay_data"] = mm.get_replay_sample(len(replay_data))
+
+        spec_data = dict(model_spec)
+        spec_data["simulation_configuration"] = {
+            "step_size": step_size,
+            "base_step_size": base_step_size,
+            "step_stride": step_stride,
+        }
+        spec_data["training_report"] = {
+            "validation_loss": mm.validate(),
+            "prediction_horizon": mm.prediction_horizon,
+        }
+        # the model is now trained on the union of the original and the new data
+        envelope = mm.get_training_envelope()
+        if "training_envelope" in model_spec:
+            previous = model_spec["training_envelope"]
+            envelope = {
+                "species_min": np.minimum(
+                    envelope["species_min"], previous["species_min"]
+                ).tolist(),
+                "species_max": np.maximum(
+                    envelope["species_max"], previous["species_max"]
+                ).tolist(),
+            }
+        spec_data["training_envelope"] = envelope
+
+        return DeepAbstractionModelPortObject(DeepAbstractionModelSpec(spec_data), data)
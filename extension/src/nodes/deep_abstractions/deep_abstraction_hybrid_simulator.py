@@ -0,0 +1,221 @@
+import knime.extension as knext
+
+import numpy as np
+import pandas as pd
+import logging
+
+from utils.port_objects import (
+    deep_abstraction_model_port_type,
+    DeepAbstractionModelSpec,
+    DeepAbstractionModelPortObject,
+)
+
+from utils.categories import deep_abstractions_category
+from utils.hybrid_simulation import run_hybrid_simulation
+from utils.model_cache import get_mdn_manager
+from utils.simulation_manager import SimulationManager
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
+
+LOGGER = logging.getLogger(__name__)
+ZERO_PERTURB_RANGE = (0, 10)
+
+
+@knext.node(
+    name="Deep Abstraction Hybrid Simulator",
+    node_type=knext.NodeType.PREDICTOR,
+    icon_path="src/assets/icons/icon.png",
+    category=deep_abstractions_category,
+)
+@knext.input_port(
+    name="Trained Deep Abstraction Model",
+    description="Object containing a trained deep abstract model.",
+    port_type=deep_abstraction_model_port_type,
+)
+@knext.output_table(
+    name="Simulation traces",
+    description="Trajectories generated by the hybrid simulation, with the engine that simulated every step.",
+)
+@knext.output_table(
+    name="Engine summary",
+    description="The number and fraction of steps simulated by the deep abstract model and by SSA.",
+)
+class DeepAbstractionHybridSimulator:
+    """
+    Simulates trajectories with a deep abstract model, falling back to SSA outside of its training data.
+
+    Every trajectory is advanced with the deep abstract model as long as its state stays inside the training envelope,
+    i.e. the range of every species in the training data, which is recorded by the Learner. Trajectories that leave the
+    envelope are simulated with SSA for a segment of steps, after which they are handed back to the model if they have
+    returned to the envelope. This avoids silent extrapolation of the model, at close to the speed of the model for
+    trajectories that mostly stay inside the envelope.
+    """
+
+    n_init_conditions = knext.IntParameter(
+        label="Number of initial conditions",
+        description="Number of randomized initial conditions to simulate.",
+        default_value=10,
+        min_value=1,
+    )
+
+    n_sims_per_init_condition = knext.IntParameter(
+        label="Number of simulations per initial condition",
+        description="Number of simulations to perform for each initial condition.",
+        default_value=10,
+        min_value=1,
+    )
+
+    n_steps = knext.IntParameter(
+        label="Number of steps per simulation",
+        description="Number of steps of the model's step size to simulate.",
+        default_value=50,
+        min_value=1,
+    )
+
+    variance_range = knext.DoubleParameter(
+        label="Variance degree",
+        description="The degree of the random perturbation to apply to the initial conditions.",
+        default_value=0.1,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    zero_perturb_prob = knext.DoubleParameter(
+        label="Zero perturbation probability",
+        description="Probability of replacing a species with a zero initial concentration with a random value.",
+        default_value=0.9,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    envelope_margin = knext.DoubleParameter(
+        label="Envelope margin",
+        description="""
+        How far states may lie outside of the training envelope and still be simulated with the deep abstract model,
+        relative to the range of every species in the training data.""",
+        default_value=0.0,
+        min_value=0.0,
+        is_advanced=True,
+    )
+
+    ssa_segment_steps = knext.IntParameter(
+        label="SSA segment steps",
+        description="""
+        The number of steps a trajectory that left the training envelope is simulated with SSA before
+        the envelope is checked again.""",
+        default_value=10,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def configure(
+        self,
+        config_context: knext.ConfigurationContext,
+        input_spec: DeepAbstractionModelSpec,
+    ):
+        if "training_envelope" not in input_spec.spec_data:
+            raise knext.InvalidParametersError(
+                "The model does not record its training envelope, retrain it to use the hybrid simulation."
+            )
+
+        species_names = input_spec.spec_data["species"]
+        traces_schema = knext.Schema(
+            ktypes=[knext.double()] * (len(species_names) + 1) + [knext.string()],
+            names=["time"] + species_names + ["engine"],
+        )
+        summary_schema = knext.Schema(
+            ktypes=[knext.string(), knext.int64(), knext.double()],
+            names=["engine", "n_steps", "fraction"],
+        )
+        return traces_schema, summary_schema
+
+    @profile_execute
+    def execute(
+        self,
+        exec_context: knext.ExecutionContext,
+        input_port_object: DeepAbstractionModelPortObject,
+    ):
+        spec_data = input_port_object.spec.spec_data
+        species_names = spec_data["species"]
+        time_step = spec_data["simulation_configuration"]["step_size"]
+
+        sm = SimulationManager(spec_data["antimony_definition"])
+        sm.set_model_parameters(
+            self.n_init_conditions,
+            self.n_sims_per_init_condition,
+            0.0,
+            time_step * self.n_steps,
+            self.n_steps,
+        )
+        init_conditions = sm.add_time_column(
+            sm.get_randomized_initial_conditions(
+                range_percentage=self.variance_range,
+                zero_perturb_prob=self.zero_perturb_prob,
+                zero_perturb_range=ZERO_PERTURB_RANGE,
+            )
+        )
+
+        mm = get_mdn_manager(
+            input_port_object.spec.model_configuration,
+            input_port_object.data["model_weights"],
+        )
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
+        if mm.n_parameters > 0:
+            parameter_values = spec_data.get(
+                "parameter_values", sm.get_original_parameter_values()
+            )
+            init_conditions = np.hstack(
+                (init_conditions, np.tile(parameter_values, (len(init_conditions), 1)))
+            )
+        states = np.repeat(init_conditions, self.n_sims_per_init_condition, axis=0)
+
+        def report_progress(step):
+            exec_context.set_progress(step / self.n_steps)
+            return not exec_context.is_canceled()
+
+        trajectories, ssa_steps = run_hybrid_simulation(
+            mm,
+            sm,
+            states,
+            time_step,
+            self.n_steps,
+            spec_data["training_envelope"],
+            margin=self.envelope_margin,
+            ssa_segment_steps=self.ssa_segment_steps,
+            callback=report_progress,
+        )
+
+        n_ssa_steps = int(ssa_steps.sum())
+        n_da_steps = ssa_steps.size - n_ssa_steps
+        n_total = max(ssa_steps.size, 1)
+        LOGGER.info(
+            f"Simulated {n_da_steps} steps with the deep abstract model and {n_ssa_steps} steps with SSA."
+        )
+        summary = pd.DataFrame(
+            [
+                ("deep_abstraction", n_da_steps, n_da_steps / n_total),
+                ("ssa", n_ssa_steps, n_ssa_steps / n_total),
+            ],
+            columns=["engine", "n_steps", "fraction"],
+        )
+
+        # the engine that simulated the step leading to every time point
+        engines = np.where(ssa_steps, "ssa", "deep_abstraction")
+        engines = np.hstack(
+            (np.full((len(engines), 1), "initial", dtype=engines.dtype), engines)
+        )
+
+        col_names = ["time"] + species_names
+        df = pd.DataFrame(trajectories.reshape(-1, len(col_names)), columns=col_names)
+        df["engine"] = engines.reshape(-1)
+
+        return knext.Table.from_pandas(df), knext.Table.from_pandas(summary)
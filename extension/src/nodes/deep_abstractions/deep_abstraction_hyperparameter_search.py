@@ -0,0 +1,242 @@
+import knime.extension as knext
+
+import pandas as pd
+import logging
+
+from utils.port_objects import (
+    simulation_data_port_type,
+    SimulationDataSpec,
+    SimulationDataPortObject,
+)
+
+from utils.port_objects import (
+    deep_abstraction_model_port_type,
+    DeepAbstractionModelSpec,
+    DeepAbstractionModelPortObject,
+)
+
+from utils.categories import deep_abstractions_category
+from utils.hyperparameter_search import sample_trials, run_search
+from utils.mdn_manager import get_training_envelope, ARCHITECTURES
+from utils.profiling import profiling_parameter, profile_execute
+
+LOGGER = logging.getLogger(__name__)
+
+TRIAL_COLUMNS = [
+    ("trial", knext.int64()),
+    ("architecture", knext.string()),
+    ("hidden_size", knext.int64()),
+    ("num_layers", knext.int64()),
+    ("batch_size", knext.int64()),
+    ("learning_rate", knext.double()),
+    ("validation_loss", knext.double()),
+    ("n_epochs", knext.int64()),
+    ("pruned", knext.bool_()),
+    ("seconds", knext.double()),
+]
+
+
+def parse_values(values: str, value_type):
+    return [value_type(value.strip()) for value in values.split(",") if value.strip()]
+
+
+@knext.node(
+    name="Deep Abstraction Hyperparameter Search",
+    node_type=knext.NodeType.LEARNER,
+    icon_path="src/assets/icons/icon.png",
+    category=deep_abstractions_category,
+)
+@knext.input_port(
+    name="Training data",
+    description="CRN simulation data generated using SSA and used for training.",
+    port_type=simulation_data_port_type,
+)
+@knext.output_port(
+    name="Best Deep Abstract Model",
+    description="The deep abstract model of the trial with the lowest validation loss.",
+    port_type=deep_abstraction_model_port_type,
+)
+@knext.output_table(
+    name="Trials",
+    description="The hyperparameters, validation loss and duration of every trial.",
+)
+class DeepAbstractionHyperparameterSearch:
+    """
+    Searches for the hyperparameters of a deep abstract model that achieve the lowest validation loss.
+
+    Candidate configurations are sampled from the grid spanned by the comma-separated values of every hyperparameter,
+    and are trained concurrently in a pool of worker processes. After every epoch, a trial whose validation loss is
+    worse than the median of the other trials at the same epoch is pruned, so that the computational budget is spent
+    on the promising configurations.
+    """
+
+    architectures = knext.StringParameter(
+        label="Architectures",
+        description="Comma-separated model architectures to try, out of `lstm`, `gru` and `mlp`.",
+        default_value="lstm, gru, mlp",
+    )
+
+    hidden_sizes = knext.StringParameter(
+        label="Hidden sizes",
+        description="Comma-separated numbers of units in every hidden layer to try.",
+        default_value="32, 50, 64",
+    )
+
+    num_layers = knext.StringParameter(
+        label="Numbers of layers",
+        description="Comma-separated numbers of encoder layers to try.",
+        default_value="1, 2",
+    )
+
+    batch_sizes = knext.StringParameter(
+        label="Batch sizes",
+        description="Comma-separated batch sizes to try.",
+        default_value="64, 128",
+    )
+
+    learning_rates = knext.StringParameter(
+        label="Learning rates",
+        description="Comma-separated learning rates to try.",
+        default_value="0.001, 0.0003",
+    )
+
+    n_trials = knext.IntParameter(
+        label="Number of trials",
+        description="The maximum number of configurations to train.",
+        default_value=12,
+        min_value=1,
+    )
+
+    n_epochs = knext.IntParameter(
+        label="Number of epochs",
+        description="The maximum number of epochs to train every configuration for.",
+        default_value=20,
+        min_value=1,
+    )
+
+    patience = knext.IntParameter(
+        label="Training patience",
+        description="The number of epochs to wait before early stopping a trial.",
+        default_value=5,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    n_workers = knext.IntParameter(
+        label="Number of workers",
+        description="The number of trials to train concurrently, each in its own process.",
+        default_value=2,
+        min_value=1,
+    )
+
+    n_threads_per_worker = knext.IntParameter(
+        label="Threads per worker",
+        description="""
+        The number of threads every worker uses for training.
+
+        The number of workers times the threads per worker should not exceed the number of CPU cores.""",
+        default_value=1,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    def get_search_space(self):
+        return {
+            "architecture": parse_values(self.architectures, str.lower),
+            "hidden_size": parse_values(self.hidden_sizes, int),
+            "num_layers": parse_values(self.num_layers, int),
+            "batch_size": parse_values(self.batch_sizes, int),
+            "learning_rate": parse_values(self.learning_rates, float),
+        }
+
+    def configure(
+        self, config_context: knext.ConfigurationContext, input_spec: SimulationDataSpec
+    ):
+        search_space = self.get_search_space()
+        for name, values in search_space.items():
+            if not values:
+                raise knext.InvalidParametersError(
+                    f"At least one value is required for {name}."
+                )
+        unknown = [
+            name for name in search_space["architecture"] if name not in ARCHITECTURES
+        ]
+        if unknown:
+            raise knext.InvalidParametersError(
+                f"Unknown architectures {unknown}, expected any of {list(ARCHITECTURES)}."
+            )
+
+        return (
+            DeepAbstractionModelSpec(dict()),
+            knext.Schema(
+                ktypes=[ktype for _, ktype in TRIAL_COLUMNS],
+                names=[name for name, _ in TRIAL_COLUMNS],
+            ),
+        )
+
+    @profile_execute
+    def execute(
+        self,
+        exec_context: knext.ExecutionContext,
+        input_port_object: SimulationDataPortObject,
+    ):
+        training_data = input_port_object.data
+        if "chunk_store" in input_port_object.spec.spec_data:
+            raise ValueError(
+                "The training data is stored in a chunk store, which is only supported by the Deep Abstraction Learner."
+            )
+        spec_data = dict(input_port_object.spec.spec_data)
+        sim_config = spec_data["simulation_configuration"]
+
+        n_parameters = 0
+        if sim_config.get("randomized_reaction_rates", False):
+            n_parameters = len(spec_data["parameters"])
+        model_configuration = {
+            "n_species": len(spec_data["species"]),
+            "n_parameters": n_parameters,
+        }
+
+        trials = sample_trials(self.get_search_space(), self.n_trials)
+        LOGGER.info(f"Running {len(trials)} trials on {self.n_workers} workers.")
+
+        results = run_search(
+            training_data,
+            model_configuration,
+            trials,
+            exec_context,
+            n_epochs=self.n_epochs,
+            patience=self.patience,
+            n_workers=self.n_workers,
+            n_threads_per_worker=self.n_threads_per_worker,
+        )
+        if not results:
+            raise RuntimeError("No trial finished.")
+
+        best = results[0]
+        data = {
+            "model_weights": best["model_weights"],
+        }
+
+        spec_data["simulation_configuration"] = {
+            "step_size": sim_config["end_time"] / sim_config["n_steps"],
+        }
+        spec_data["model_configuration"] = best["model_configuration"]
+        spec_data["training_report"] = {
+            "validation_loss": best["validation_loss"],
+            "prediction_horizon": best["model_configuration"]["prediction_horizon"],
+        }
+        spec_data["training_envelope"] = get_training_envelope(
+            training_data, len(spec_data["species"])
+        )
+
+        df = pd.DataFrame(
+            [[result[name] for name, _ in TRIAL_COLUMNS] for result in results],
+            columns=[name for name, _ in TRIAL_COLUMNS],
+        )
+
+        return (
+            DeepAbstractionModelPortObject(DeepAbstractionModelSpec(spec_data), data),
+            knext.Table.from_pandas(df),
+        )
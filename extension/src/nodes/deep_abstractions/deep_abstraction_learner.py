@@ -18,6 +18,13 @@ from utils.port_objects import (
 from utils.categories import deep_abstractions_category
 from utils.simulation_manager import SimulationManager
 from utils.mdn_manager import MdnManager
+from utils.chunk_store import ChunkStore
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
 
 te.setDefaultPlottingEngine("matplotlib")
 
@@ -46,8 +53,62 @@ class DeepAbstractionLearner:
 
     A well-trained deep abstract model can be used to efficiently produce new CRN trajectories that follow the CRN dynamics
     encoded in the training data.
+
+    The output model spec contains a training report with the validation loss and the measured training throughput
+    (samples/s).
     """
 
+    class Architectures(knext.EnumParameterOptions):
+        LSTM = (
+            "LSTM",
+            "Recurrent network with LSTM layers.",
+        )
+        GRU = (
+            "GRU",
+            "Recurrent network with GRU layers, which are cheaper to run than LSTM layers.",
+        )
+        MLP = (
+            "MLP",
+            "Feed-forward network conditioned on the current state only. The fastest architecture to train and run.",
+        )
+
+    architecture = knext.EnumParameter(
+        label="Architecture",
+        description="The neural network architecture of the deep abstract model.",
+        default_value=Architectures.LSTM.name,
+        enum=Architectures,
+    )
+
+    hidden_size = knext.IntParameter(
+        label="Hidden size",
+        description="""
+        The number of units in every hidden layer.
+        
+        Larger models can learn more complex dynamics, but are slower to train and to simulate.""",
+        default_value=50,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    num_layers = knext.IntParameter(
+        label="Number of layers",
+        description="The number of recurrent (LSTM, GRU) or feed-forward (MLP) layers of the encoder.",
+        default_value=2,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    normalize = knext.BoolParameter(
+        label="Normalize inputs and outputs",
+        description="""
+        If enabled, the inputs and outputs of the model are scaled to zero mean and unit variance using statistics
+        of the training data. The scaling is stored together with the model weights.
+        
+        Normalization usually allows the model to converge in fewer epochs.""",
+        default_value=True,
+        is_advanced=True,
+    )
+
     n_epochs = knext.IntParameter(
         label="Number of epochs",
         description="""
@@ -82,11 +143,118 @@ class DeepAbstractionLearner:
         is_advanced=True,
     )
 
+    n_replay_samples = knext.IntParameter(
+        label="Replay sample size",
+        description="""
+        The number of training trajectories to store alongside the trained model.
+        
+        When the model is later fine-tuned on new data using the Deep Abstraction Fine-Tuner node,
+        these trajectories can be replayed to prevent the model from forgetting the original dynamics.
+        Set to 0 to store no trajectories.""",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    step_stride = knext.IntParameter(
+        label="Step stride",
+        description="""
+        Train the model on every n-th time point of the training data, i.e. at a step size n times coarser than
+        the resolution the data was recorded at.
+        
+        This allows to explore the trade-off between the step size and the accuracy of the model without
+        generating new training data. The chosen step size is recorded in the model spec.""",
+        default_value=1,
+        min_value=1,
+    )
+
+    time_step_strides = knext.StringParameter(
+        label="Time step strides",
+        description="""
+        Comma-separated multiples of the step size (e.g. `1, 2, 4, 8`) to train the model on.
+        
+        If set, the time step is an additional input of the model, which is trained on every trajectory
+        subsampled with each of the strides. The model can then be simulated with a variable step size,
+        taking large steps where the dynamics are slow. The smallest of the time steps is recorded as the
+        step size of the model. Leave empty to train the model on a single step size.""",
+        default_value="",
+        is_advanced=True,
+    )
+
+    prediction_horizon = knext.IntParameter(
+        label="Prediction horizon",
+        description="""
+        The number of future time steps the model predicts per forward pass.
+
+        With a horizon of K, simulating a trajectory requires K times fewer calls of the model, which makes
+        long simulations faster, potentially at the cost of accuracy. The accuracy and duration of simulating
+        the testing set both with K steps and with a single step per call are reported in the training report
+        of the model spec.""",
+        default_value=1,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    use_autocast = knext.BoolParameter(
+        label="Mixed precision training",
+        description="""
+        If enabled, the forward pass is computed in bfloat16 precision, which is considerably faster on
+        modern CPUs. Falls back to float32 if bfloat16 is not supported.""",
+        default_value=False,
+        is_advanced=True,
+    )
+
+    compile_model = knext.BoolParameter(
+        label="Compile model",
+        description="""
+        If enabled, the model is compiled using `torch.compile` before training. Compilation takes some time,
+        but speeds up every following training step. Falls back to eager execution if compilation is not supported.""",
+        default_value=False,
+        is_advanced=True,
+    )
+
+    n_threads = knext.IntParameter(
+        label="Number of threads",
+        description="The number of threads used for training. Set to 0 to use the PyTorch default.",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    n_loader_workers = knext.IntParameter(
+        label="Number of data loading workers",
+        description="""
+        The number of worker processes that read and prepare the training batches in the background
+        when the training data is streamed from a chunk store. Set to 0 to read the batches in the training process.""",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def get_time_step_strides(self):
+        try:
+            strides = sorted(
+                {int(s.strip()) for s in self.time_step_strides.split(",") if s.strip()}
+            )
+        except ValueError:
+            raise knext.InvalidParametersError(
+                "The time step strides must be comma-separated integers."
+            )
+        if strides and strides[0] < 1:
+            raise knext.InvalidParametersError("The time step strides must be positive.")
+        return strides
+
     def configure(
         self, config_context: knext.ConfigurationContext, input_spec: SimulationDataSpec
     ):
+        self.get_time_step_strides()
         return DeepAbstractionModelSpec(dict())
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
@@ -102,7 +270,28 @@ class DeepAbstractionLearner:
         start_time = sim_config["start_time"]
         end_time = sim_config["end_time"]
         n_steps = sim_config["n_steps"]
-        step_size = end_time / n_steps
+        base_step_size = end_time / n_steps
+        step_size = base_step_size * self.step_stride
+
+        if self.step_stride > n_steps:
+            raise ValueError(
+                f"The step stride ({self.step_stride}) exceeds the number of recorded steps ({n_steps})."
+            )
+        chunk_store_path = input_port_object.spec.spec_data.get("chunk_store")
+        if chunk_store_path:
+            # the training data does not fit in memory and is streamed from disk
+            training_data = ChunkStore(chunk_store_path, self.step_stride)
+        else:
+            training_data = sm.get_strided_dataset(training_data, self.step_stride)
+
+        strides = self.get_time_step_strides()
+        time_steps = None
+        if strides:
+            if (training_data.shape[1] - 1) // strides[-1] < self.prediction_horizon:
+                raise ValueError(
+                    f"The largest time step stride ({strides[-1]}) leaves no training samples in the trajectories."
+                )
+            time_steps = [stride * step_size for stride in strides]
 
         sm.set_model_parameters(
             n_init_conditions,
@@ -112,23 +301,81 @@ class DeepAbstractionLearner:
             n_steps,
         )
 
-        mm = MdnManager(sm.get_num_species())
+        n_parameters = 0
+        if sim_config.get("randomized_reaction_rates", False):
+            n_parameters = sm.get_num_parameters()
+
+        mm = MdnManager(
+            sm.get_num_species(),
+            n_parameters,
+            self.prediction_horizon,
+            architecture=self.architecture.lower(),
+            hidden_size=self.hidden_size,
+            num_layers=self.num_layers,
+            time_steps=time_steps,
+        )
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
         mm.load_data(training_data)
-        mm.prepare_data_loaders(batch_size=self.batch_size)
-        mm.train(
-            exec_context=exec_context, n_epochs=self.n_epochs, patience=self.patience
+        if self.normalize:
+            mm.fit_normalization()
+        mm.prepare_data_loaders(
+            batch_size=self.batch_size,
+            base_step_size=step_size,
+            n_workers=self.n_loader_workers,
         )
+        training_stats = mm.train(
+            exec_context=exec_context,
+            n_epochs=self.n_epochs,
+            patience=self.patience,
+            use_autocast=self.use_autocast,
+            compile_model=self.compile_model,
+            n_threads=self.n_threads,
+        )
+        LOGGER.info(
+            f"Training throughput: {training_stats['samples_per_second']:.1f} samples/s"
+        )
+
+        training_report = {
+            "validation_loss": mm.validate(),
+            "prediction_horizon": self.prediction_horizon,
+            **training_stats,
+        }
+        if time_steps:
+            # the smallest trained time step becomes the default step size of the model
+            test_data = mm.test_data[:, :: strides[0]]
+            step_size = time_steps[0]
+        else:
+            test_data = mm.test_data
+        if self.prediction_horizon > 1:
+            # compare rolling out K steps per call against a single step per call
+            for name, steps_per_call in (
+                ("multi_step_rollout", self.prediction_horizon),
+                ("single_step_rollout", 1),
+            ):
+                mae, seconds = mm.evaluate_rollout(test_data, step_size, steps_per_call)
+                training_report[name] = {"mae": mae, "seconds": seconds}
+                LOGGER.info(
+                    f"{name}: mean absolute error {mae:.4f}, rollout time {seconds:.4f}s"
+                )
 
         data = {
             "model_weights": mm.get_model_weights(),
         }
+        if self.n_replay_samples > 0:
+            data["replay_data"] = mm.get_replay_sample(self.n_replay_samples)
 
         # formulate the new sim_config only containing the start_time and step_size
         sim_config = {
             "step_size": step_size,
+            "base_step_size": base_step_size,
+            "step_stride": int(round(step_size / base_step_size)),
         }
         spec_data = input_port_object.spec.spec_data
         spec_data["simulation_configuration"] = sim_config
+        spec_data["model_configuration"] = mm.get_model_configuration()
+        spec_data["training_report"] = training_report
+        spec_data["training_envelope"] = mm.get_training_envelope()
 
         return DeepAbstractionModelPortObject(
             # DeepAbstractionModelSpec(input_port_object.spec.spec_data), data
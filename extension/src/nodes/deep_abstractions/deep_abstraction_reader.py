@@ -1,7 +1,7 @@
 import knime.extension as knext
 
 import logging
-import pickle
+from pathlib import Path
 
 from utils.port_objects import (
     deep_abstraction_model_port_type,
@@ -10,8 +10,14 @@ from utils.port_objects import (
 )
 
 from utils.categories import deep_abstractions_category
+from utils.model_io import (
+    read_model_file,
+    read_model_header,
+    read_legacy_model_file,
+    is_model_file,
+)
 from utils.simulation_manager import SimulationManager
-from utils.mdn_manager import MdnManager
+from utils.profiling import profiling_parameter, profile_execute
 
 LOGGER = logging.getLogger(__name__)
 DEFAULT_PATH = "/path/to/abstract/model"
@@ -38,37 +44,76 @@ class DeepAbstractionReader:
 
     file_path = knext.StringParameter(
         label="File path",
-        description="The path to the local file containing the model weights.",
+        description="""
+        The path to the local `.dam` file containing the model weights.""",
         default_value=DEFAULT_PATH,
     )
 
+    allow_legacy = knext.BoolParameter(
+        label="Allow legacy pickled model files",
+        description="""
+        If enabled, pickled model files written by earlier versions of the Writer node can be read as well.
+        Unpickling a file can execute arbitrary code, so only enable this for files from trusted sources,
+        and write the model again with the Writer node to convert it to the current format.""",
+        default_value=False,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
     def configure(self, config_context: knext.ConfigurationContext):
+        # the header is small, so the actual spec can be provided before execution
+        if Path(self.file_path).is_file() and is_model_file(self.file_path):
+            header, _ = read_model_header(self.file_path)
+            return DeepAbstractionModelSpec(header["spec_data"])
+
         return DeepAbstractionModelSpec(dict())
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
     ):
-        # load the pickle file and read in the data
-        with open(self.file_path, "rb") as f:
-            data = pickle.load(f)
-            ant_definition = data["antimony_definition"]
-            sim_config = data["simulation_configuration"]
-            model_weights = data["model_weights"]
+        if not is_model_file(self.file_path):
+            if not self.allow_legacy:
+                raise ValueError(
+                    f"{self.file_path} is not a model file of the current format. If it is a pickled model file "
+                    "written by an earlier version of the Writer node, write the model again with the current "
+                    "Writer node, or enable 'Allow legacy pickled model files' if the file is trusted."
+                )
+            return self.read_legacy_model(exec_context)
 
-        sm = SimulationManager(ant_definition)
-        mm = MdnManager(sm.get_num_species())
-        mm.set_model_weights(model_weights)
+        # the weights are memory-mapped from the file, the CRN definition is not compiled
+        spec_data, model_weights, extra_arrays = read_model_file(self.file_path)
 
         data = {
-            "model_weights": mm.get_model_weights(),
+            "model_weights": model_weights,
         }
+        if "replay_data" in extra_arrays:
+            data["replay_data"] = extra_arrays["replay_data"]
+
+        return DeepAbstractionModelPortObject(DeepAbstractionModelSpec(spec_data), data)
+
+    def read_legacy_model(self, exec_context):
+        """
+        Reads a pickled model file written by earlier versions of the Writer node.
+        """
+        LOGGER.warning(
+            f"{self.file_path} is a legacy pickled model file, write it again with the Writer node to load it faster."
+        )
+        exec_context.set_warning("The model was read from a legacy pickled model file.")
+        legacy_data = read_legacy_model_file(self.file_path)
+        ant_definition = legacy_data["antimony_definition"]
+        sm = SimulationManager(ant_definition)
 
         spec_data = {
             "species": sm.get_species_names(),
             "parameters": sm.get_parameter_names(),
             "antimony_definition": ant_definition,
-            "simulation_configuration": sim_config,
+            "simulation_configuration": legacy_data["simulation_configuration"],
+        }
+        data = {
+            "model_weights": legacy_data["model_weights"],
         }
 
         return DeepAbstractionModelPortObject(DeepAbstractionModelSpec(spec_data), data)
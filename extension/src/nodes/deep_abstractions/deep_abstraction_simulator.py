@@ -1,6 +1,7 @@
 import knime.extension as knext
 
 import tellurium as te
+import numpy as np
 import pandas as pd
 import logging
 
@@ -11,8 +12,23 @@ from utils.port_objects import (
 )
 
 from utils.categories import deep_abstractions_category
-from utils.mdn_manager import MdnManager
+from utils.model_cache import get_mdn_manager
+from utils.inference_server import InferenceClient
+from utils.sampling import randomize_initial_conditions
 from utils.simulation_manager import SimulationManager
+from utils.memory import (
+    check_footprint,
+    get_memory_budget,
+    get_trajectories_per_chunk,
+    CHUNKED_MESSAGE,
+)
+from utils.plotting import get_placeholder_png
+from utils.profiling import (
+    profiling_parameter,
+    trace_steps_parameter,
+    profile_execute,
+    get_trace_path,
+)
 
 te.setDefaultPlottingEngine("matplotlib")
 
@@ -67,11 +83,34 @@ class DeepAbstractionSimulator:
 
     end_time = knext.DoubleParameter(
         label="End time",
-        description="Time at which to stop the simulation.",
+        description="""
+        Time at which to stop the simulation.
+
+        Only used if the model was trained on several time steps, in which case the simulation takes
+        steps of `end time / number of steps`. Otherwise, the step size of the model is used.""",
         default_value=50.0,
         min_value=0.1,
     )
 
+    adaptive_time_step = knext.BoolParameter(
+        label="Adaptive time step",
+        description="""
+        If enabled, and the model was trained on several time steps, every step uses the largest time step
+        for which the predicted relative change of the species stays below the tolerance. The number of steps
+        is then determined by the dynamics instead of the number of steps per simulation. Only the trained
+        time steps are taken, so the simulation may stop up to the smallest of them before the end time.""",
+        default_value=False,
+        is_advanced=True,
+    )
+
+    tolerance = knext.DoubleParameter(
+        label="Adaptive time step tolerance",
+        description="The maximum mean relative change of the species per adaptive time step.",
+        default_value=0.1,
+        min_value=0.0,
+        is_advanced=True,
+    )
+
     variance_range = knext.DoubleParameter(
         label="Variance degree",
         description="The degree of the random perturbation to apply to the initial conditions.",
@@ -88,12 +127,108 @@ class DeepAbstractionSimulator:
         max_value=1.0,
     )
 
+    reaction_rates = knext.StringParameter(
+        label="Reaction rates",
+        description="""
+        Comma-separated reaction rates to simulate at, e.g. `k1=0.5, k2=1.2`.
+
+        Only used if the model was trained on data with randomized reaction rates. Reaction rates
+        that are not specified keep the values from the CRN definition.""",
+        default_value="",
+    )
+
+    server_address = knext.StringParameter(
+        label="Inference server address",
+        description="""
+        Address of a running deep abstraction inference server, either `unix:/path/to/socket` or `host:port`.
+
+        If set, the simulation is performed by the server, which keeps the model loaded and batches concurrent
+        requests from several workflows. The server is started with `python -m utils.inference_server --address <address>`
+        from the extension's `src` directory. If left empty, the simulation is performed by this node.""",
+        default_value="",
+        is_advanced=True,
+    )
+
+    memory_budget = knext.IntParameter(
+        label="Memory budget (MB)",
+        description="""
+        If the projected peak memory of the node exceeds this budget, the simulations are performed and written to the
+        output table in chunks of initial conditions that fit into it. Set to 0 to use half of the physical memory.""",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    plot_trajectories = knext.BoolParameter(
+        label="Plot trajectories",
+        description="""
+        If enabled, the mean and quantiles of the trajectories (and their density for large ensembles) are plotted
+        to the image and view outputs. Disable if these outputs are not used, the outputs then only show a placeholder.""",
+        default_value=True,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    trace_steps = trace_steps_parameter()
+
+    def check_footprint(self, n_species):
+        return check_footprint(
+            self.n_init_conditions * self.n_sims_per_init_condition,
+            self.n_steps + 1,
+            n_species + 1,
+            self.memory_budget,
+        )
+
+    def parse_reaction_rates(self, parameter_names, parameter_values):
+        rates = dict(zip(parameter_names, parameter_values))
+        for assignment in self.reaction_rates.split(","):
+            if not assignment.strip():
+                continue
+            name, _, value = assignment.partition("=")
+            name = name.strip()
+            if name not in rates:
+                raise ValueError(
+                    f"Unknown reaction rate '{name}', expected one of {list(parameter_names)}."
+                )
+            rates[name] = float(value)
+        return [rates[name] for name in parameter_names]
+
+    def check_time_step(self, model_configuration):
+        """
+        Raises a ValueError if the model is conditioned on the time step, and the time step of the simulation
+        lies outside the range of time steps the model was trained on, which the model would extrapolate to.
+        Adaptive time steps are always chosen among the trained ones.
+        """
+        time_steps = model_configuration.get("time_steps")
+        if not time_steps or self.adaptive_time_step:
+            return
+
+        time_step = self.end_time / self.n_steps
+        low, high = min(time_steps), max(time_steps)
+        if not (low <= time_step <= high or np.isclose(time_step, [low, high]).any()):
+            raise ValueError(
+                f"The time step {time_step:g} (end time / number of steps) is outside the range of time steps "
+                f"the model was trained on ({low:g} to {high:g})."
+            )
+
     def configure(
         self,
         config_context: knext.ConfigurationContext,
         input_spec: DeepAbstractionModelSpec,
     ):
         species_names = input_spec.spec_data["species"]
+        try:
+            self.check_time_step(input_spec.model_configuration)
+        except ValueError as e:
+            raise knext.InvalidParametersError(str(e))
+        try:
+            chunked, message = self.check_footprint(len(species_names))
+        except MemoryError as e:
+            raise knext.InvalidParametersError(str(e))
+        if chunked:
+            config_context.set_warning(f"{message} {CHUNKED_MESSAGE}")
+
         col_names = ["time"] + species_names
         types = [knext.double()] * len(col_names)
 
@@ -102,57 +237,154 @@ class DeepAbstractionSimulator:
             knext.ImagePortObjectSpec(knext.ImageFormat.PNG),
         )
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
         input_port_object: DeepAbstractionModelPortObject,
     ):
-        ant_definition = input_port_object.spec.spec_data["antimony_definition"]
-        sm = SimulationManager(ant_definition)
+        spec_data = input_port_object.spec.spec_data
+        species_names = spec_data["species"]
 
-        sim_config = input_port_object.spec.spec_data["simulation_configuration"]
+        sim_config = spec_data["simulation_configuration"]
         time_step = sim_config["step_size"]
 
-        mm = MdnManager(sm.get_num_species())
+        model_configuration = input_port_object.spec.model_configuration
         model_weights = input_port_object.data["model_weights"]
-        mm.set_model_weights(model_weights)
 
-        init_conditions = sm.get_randomized_initial_conditions(
+        time_step_conditioned = bool(model_configuration.get("time_steps"))
+        if time_step_conditioned:
+            self.check_time_step(model_configuration)
+            time_step = self.end_time / self.n_steps
+        elif not np.isclose(self.end_time, self.n_steps * time_step):
+            LOGGER.warning(
+                f"The model is trained on a single step size ({time_step}), the end time is ignored."
+            )
+
+        # same as SimulationManager.get_randomized_initial_conditions, without compiling the CRN
+        init_conditions = randomize_initial_conditions(
+            np.zeros(len(species_names)),
+            self.n_init_conditions,
             range_percentage=self.variance_range,
             zero_perturb_prob=self.zero_perturb_prob,
             zero_perturb_range=ZERO_PERTURB_RANGE,
-            n_conditions=self.n_init_conditions,
         )
-        init_conditions = sm.add_time_column(init_conditions)
+        init_conditions = SimulationManager.add_time_column(init_conditions)
 
-        mdn_data = mm.simulate(
-            init_conditions,
-            exec_context,
-            time_step,
-            self.n_steps,
-            self.n_sims_per_init_condition,
-        )
+        if model_configuration.get("n_parameters", 0) > 0:
+            parameter_values = spec_data.get("parameter_values")
+            if parameter_values is None:
+                sm = SimulationManager(spec_data["antimony_definition"])
+                parameter_values = sm.get_original_parameter_values()
 
-        png_bytes = sm.plot_simulations(
-            mdn_data,
-            self.n_init_conditions,
-            self.n_sims_per_init_condition,
-            sm.get_column_names(),
-        )
+            reaction_rates = self.parse_reaction_rates(
+                spec_data["parameters"], parameter_values
+            )
+            init_conditions = np.hstack(
+                (init_conditions, np.tile(reaction_rates, (len(init_conditions), 1)))
+            )
+        elif self.reaction_rates.strip():
+            LOGGER.warning(
+                "The model is not conditioned on reaction rates, the specified reaction rates are ignored."
+            )
 
-        col_names = ["time"] + sm.get_species_names()
+        col_names = ["time"] + species_names
         n_cols = len(col_names)
 
-        mdn_data = mdn_data.reshape(
-            self.n_init_conditions
-            * self.n_sims_per_init_condition
-            * (self.n_steps + 1),
-            n_cols,
-        )
-        df = pd.DataFrame(mdn_data, columns=col_names)
+        def simulate(conditions):
+            return self.simulate_trajectories(
+                exec_context,
+                conditions,
+                model_configuration,
+                model_weights,
+                time_step,
+                time_step_conditioned,
+            )
+
+        png = get_placeholder_png()
+        chunked, message = self.check_footprint(len(species_names))
+        if not chunked:
+            mdn_data = simulate(init_conditions)
+            if self.plot_trajectories:
+                png = SimulationManager.plot_simulations(
+                    mdn_data,
+                    self.n_init_conditions,
+                    self.n_sims_per_init_condition,
+                    col_names,
+                ).getvalue()
+            # the number of steps may differ from the configured one for adaptive time steps
+            table = knext.Table.from_pandas(
+                pd.DataFrame(mdn_data.reshape(-1, n_cols), columns=col_names)
+            )
+        else:
+            LOGGER.warning(f"{message} {CHUNKED_MESSAGE}")
+            n_trajectories = get_trajectories_per_chunk(
+                get_memory_budget(self.memory_budget), self.n_steps + 1, n_cols
+            )
+            n_chunk = max(n_trajectories // self.n_sims_per_init_condition, 1)
+            table = knext.BatchOutputTable.create(row_ids="generate")
+            for start in range(0, self.n_init_conditions, n_chunk):
+                chunk_conditions = init_conditions[start : start + n_chunk]
+                mdn_data = simulate(chunk_conditions)
+                if start == 0 and self.plot_trajectories:
+                    # the plot only shows the initial conditions of the first chunk
+                    png = SimulationManager.plot_simulations(
+                        mdn_data,
+                        len(chunk_conditions),
+                        self.n_sims_per_init_condition,
+                        col_names,
+                    ).getvalue()
+                table.append(
+                    pd.DataFrame(mdn_data.reshape(-1, n_cols), columns=col_names)
+                )
 
         return (
-            knext.Table.from_pandas(df),
-            png_bytes.getvalue(),
-            knext.view_matplotlib(),
+            table,
+            png,
+            knext.view_png(png),
+        )
+
+    def simulate_trajectories(
+        self,
+        exec_context,
+        init_conditions,
+        model_configuration,
+        model_weights,
+        time_step,
+        time_step_conditioned,
+    ):
+        if self.adaptive_time_step and time_step_conditioned:
+            if self.server_address.strip():
+                LOGGER.warning(
+                    "Adaptive time steps are not supported by the inference server, simulating locally."
+                )
+            mm = get_mdn_manager(model_configuration, model_weights)
+            return mm.adaptive_rollout(
+                np.repeat(init_conditions, self.n_sims_per_init_condition, axis=0),
+                self.end_time,
+                self.tolerance,
+                callback=lambda t: not exec_context.is_canceled(),
+            )
+
+        if self.server_address.strip():
+            with InferenceClient(self.server_address.strip()) as client:
+                return client.simulate(
+                    model_configuration,
+                    model_weights,
+                    init_conditions,
+                    time_step,
+                    self.n_steps,
+                    self.n_sims_per_init_condition,
+                )
+
+        # the model is built once per process and reused across executions
+        mm = get_mdn_manager(model_configuration, model_weights)
+        if self.profile_path.strip():
+            mm.enable_tracing(get_trace_path(self.profile_path.strip()), self.trace_steps)
+        return mm.simulate(
+            init_conditions,
+            exec_context,
+            time_step,
+            self.n_steps,
+            self.n_sims_per_init_condition,
         )
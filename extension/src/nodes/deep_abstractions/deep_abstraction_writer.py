@@ -2,7 +2,6 @@ import knime.extension as knext
 
 import logging
 from pathlib import Path
-import pickle
 
 from utils.port_objects import (
     deep_abstraction_model_port_type,
@@ -12,8 +11,9 @@ from utils.port_objects import (
 
 from utils.categories import deep_abstractions_category
 
-from utils.mdn_manager import MdnManager
-from utils.simulation_manager import SimulationManager
+from utils.model_cache import get_mdn_manager
+from utils.model_io import write_model_file, MODEL_FILE_EXTENSION
+from utils.profiling import profiling_parameter, profile_execute
 
 LOGGER = logging.getLogger(__name__)
 DEFAULT_WRITE_PATH = "/destination/path/"
@@ -35,17 +35,17 @@ class DeepAbstractionWriter:
     """
     Writes a trained deep abstract model to the specified local file.
 
-    The provided deep abstract model can be stored locally either in the form of its wieghts, or as an ONNX model.
+    The provided deep abstract model can be stored locally either in the form of its weights, or as an ONNX model.
     """
 
     class AvailableFormats(knext.EnumParameterOptions):
         WEIGHTS = (
             "PyTorch weights",
-            "Save the PyTorch model weights together with the CRN metadata. Can be read by the Reader node.",
+            "Save the PyTorch model weights together with the CRN metadata to a `.dam` model file. Can be read by the Reader node.",
         )
         ONNX = (
             "ONNX",
-            "Save the model in the universal ONNX format.",
+            "Save the model in the universal ONNX format. If the model was trained with normalization, it predicts normalized values, which are scaled back using its `output_mean` and `output_std` initializers.",
         )
 
     format_selection = knext.EnumParameter(
@@ -67,6 +67,8 @@ class DeepAbstractionWriter:
         default_value=DEFAULT_WRITE_PATH,
     )
 
+    profile_path = profiling_parameter()
+
     def configure(
         self,
         config_context: knext.ConfigurationContext,
@@ -74,6 +76,7 @@ class DeepAbstractionWriter:
     ):
         return
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
@@ -82,25 +85,25 @@ class DeepAbstractionWriter:
         # check that the destionation directory exists and create it if it doesn't
         Path(self.destination).mkdir(parents=True, exist_ok=True)
 
-        ant_definition = input_port_object.spec.spec_data["antimony_definition"]
-        sm = SimulationManager(ant_definition)
-        mm = MdnManager(sm.get_num_species())
-
+        model_configuration = input_port_object.spec.model_configuration
         model_weights = input_port_object.data["model_weights"]
 
         if self.format_selection == self.AvailableFormats.WEIGHTS.name:
-            data = {
-                "antimony_definition": ant_definition,
-                "simulation_configuration": input_port_object.spec.spec_data[
-                    "simulation_configuration"
-                ],
-                "model_weights": model_weights,
-            }
-
-            with open(Path(self.destination).joinpath(self.filename), "wb") as f:
-                pickle.dump(data, f)
+            spec_data = dict(input_port_object.spec.spec_data)
+            spec_data["model_configuration"] = model_configuration
+
+            extra_arrays = {}
+            if "replay_data" in input_port_object.data:
+                extra_arrays["replay_data"] = input_port_object.data["replay_data"]
+
+            write_model_file(
+                Path(self.destination).joinpath(self.filename + MODEL_FILE_EXTENSION),
+                spec_data,
+                model_weights,
+                extra_arrays,
+            )
         elif self.format_selection == self.AvailableFormats.ONNX.name:
-            mm.set_model_weights(model_weights)
+            mm = get_mdn_manager(model_configuration, model_weights)
             mm.save_model_to_onnx(
                 Path(self.destination).joinpath(self.filename + ".onnx")
             )
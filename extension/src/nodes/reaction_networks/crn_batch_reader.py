@@ -0,0 +1,113 @@
+import knime.extension as knext
+from pathlib import Path
+
+import pandas as pd
+import logging
+
+from utils.categories import reaction_networks_category
+from utils.batch_processing import list_crn_files, parse_crn_definitions
+from utils.profiling import profiling_parameter, profile_execute
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_DIRECTORY = "/path/to/model/definitions"
+
+CRN_TABLE_COLUMNS = [
+    ("name", knext.string()),
+    ("file", knext.string()),
+    ("antimony_definition", knext.string()),
+    ("species", knext.string()),
+    ("parameters", knext.string()),
+    ("n_species", knext.int64()),
+    ("n_parameters", knext.int64()),
+]
+
+
+@knext.node(
+    name="CRN Batch Reader",
+    node_type=knext.NodeType.SOURCE,
+    icon_path="src/assets/icons/icon.png",
+    category=reaction_networks_category,
+)
+@knext.output_table(
+    name="CRN Definitions",
+    description="One row per loaded CRN definition, with its Antimony definition, species and parameters.",
+)
+class CrnBatchReader:
+    """
+    This node allows you to read all CRN definitions in a directory.
+
+    Supported definition types are *Antimony* (.txt) and *SBML* (.xml). The definitions are parsed in parallel
+    worker processes. Files that cannot be parsed are skipped with a warning.
+
+    The resulting table can be simulated at once with the Batch Stochastic Simulator node.
+    """
+
+    directory = knext.StringParameter(
+        label="Directory",
+        description="The path to the local directory containing the CRN definitions.",
+        default_value=DEFAULT_DIRECTORY,
+    )
+
+    recursive = knext.BoolParameter(
+        label="Include subdirectories",
+        description="If enabled, the CRN definitions in all subdirectories are read as well.",
+        default_value=False,
+    )
+
+    n_workers = knext.IntParameter(
+        label="Number of workers",
+        description="The number of CRN definitions to parse concurrently, each in its own process.",
+        default_value=2,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    def configure(self, config_context: knext.ConfigurationContext):
+        if not Path(self.directory).is_dir():
+            raise knext.InvalidParametersError(
+                f"Directory {self.directory} does not exist."
+            )
+
+        return knext.Schema(
+            ktypes=[ktype for _, ktype in CRN_TABLE_COLUMNS],
+            names=[name for name, _ in CRN_TABLE_COLUMNS],
+        )
+
+    @profile_execute
+    def execute(self, exec_context: knext.ExecutionContext):
+        paths = list_crn_files(self.directory, self.recursive)
+        if not paths:
+            raise ValueError(
+                f"Directory {self.directory} does not contain any .xml or .txt files."
+            )
+        LOGGER.info(f"Parsing {len(paths)} CRN definitions.")
+
+        rows = []
+        failed = []
+        for result in parse_crn_definitions(paths, exec_context, self.n_workers):
+            if result["error"] is not None:
+                LOGGER.warning(f"Skipping {result['file']}: {result['error']}")
+                failed.append(result["name"])
+                continue
+            rows.append(
+                (
+                    result["name"],
+                    result["file"],
+                    result["antimony_definition"],
+                    ",".join(result["species"]),
+                    ",".join(result["parameters"]),
+                    len(result["species"]),
+                    len(result["parameters"]),
+                )
+            )
+
+        if failed:
+            exec_context.set_warning(
+                f"{len(failed)} CRN definitions could not be read: {', '.join(failed)}"
+            )
+
+        df = pd.DataFrame(rows, columns=[name for name, _ in CRN_TABLE_COLUMNS])
+        return knext.Table.from_pandas(df)
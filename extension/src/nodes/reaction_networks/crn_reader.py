@@ -9,6 +9,7 @@ from utils.port_objects import (
 
 from utils.categories import reaction_networks_category
 from utils.simulation_manager import SimulationManager
+from utils.profiling import profiling_parameter, profile_execute
 
 DEFAULT_SBML_PATH = "/path/to/model/definition.xml"
 
@@ -37,6 +38,8 @@ class CrnReader:
         default_value=DEFAULT_SBML_PATH,
     )
 
+    profile_path = profiling_parameter()
+
     def _validate_file_path(self):
         file_extension = Path(self.file_path).suffix
         if file_extension not in [".xml", ".txt"]:
@@ -52,6 +55,7 @@ class CrnReader:
 
         return CrnDefinitionSpec(spec_data)
 
+    @profile_execute
     def execute(self, exec_context: knext.ExecutionContext):
         sm = SimulationManager(self.file_path)
         ant_definition = sm.model.getAntimony()
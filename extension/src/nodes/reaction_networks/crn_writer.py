@@ -9,6 +9,7 @@ from utils.port_objects import (
 )
 
 from utils.categories import reaction_networks_category
+from utils.profiling import profiling_parameter, profile_execute
 
 DEFAULT_WRITE_PATH = "/destination/path/"
 DEFAULT_FILENAME = "crn"
@@ -52,11 +53,14 @@ class CrnWriter:
         default_value=DEFAULT_WRITE_PATH,
     )
 
+    profile_path = profiling_parameter()
+
     def configure(
         self, config_context: knext.ConfigurationContext, input_spec: CrnDefinitionSpec
     ):
         return
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
@@ -0,0 +1,150 @@
+import knime.extension as knext
+
+import numpy as np
+import pandas as pd
+import logging
+
+from utils.categories import simulations_category
+from utils.batch_processing import simulate_crns
+from utils.profiling import profiling_parameter, profile_execute
+
+LOGGER = logging.getLogger(__name__)
+
+TRACE_COLUMNS = [
+    ("name", knext.string()),
+    ("simulation", knext.int64()),
+    ("time", knext.double()),
+    ("species", knext.string()),
+    ("value", knext.double()),
+]
+
+
+@knext.node(
+    name="Batch Stochastic Simulator",
+    node_type=knext.NodeType.MANIPULATOR,
+    icon_path="src/assets/icons/icon.png",
+    category=simulations_category,
+)
+@knext.input_table(
+    name="CRN Definitions",
+    description="Table of CRN definitions with an `antimony_definition` and a `name` column, e.g. from the CRN Batch Reader node.",
+)
+@knext.output_table(
+    name="Simulation traces",
+    description="The simulation traces of all CRNs in long format, with one row per CRN, simulation, time point and species.",
+)
+class BatchStochasticSimulator:
+    """
+    This node allows to simulate many CRN models using the Gillespie algorithm.
+
+    Every CRN is simulated from the initial condition in its definition, as in the Stochastic Simulator node.
+    The CRNs are distributed over a shared pool of worker processes, which avoids the overhead of simulating
+    them one by one in a loop. Since the CRNs have different species, the traces are returned in long format.
+    """
+
+    start_time = knext.DoubleParameter(
+        label="Start time",
+        description="Time from which to start the simulation.",
+        default_value=0.0,
+    )
+
+    end_time = knext.DoubleParameter(
+        label="End time",
+        description="Time at which to stop the simulation.",
+        default_value=50.0,
+        min_value=0.1,
+    )
+
+    n_steps = knext.IntParameter(
+        label="Steps",
+        description="Number of steps to perform during the specified span of time.",
+        default_value=50,
+        min_value=1,
+    )
+
+    n_simulations = knext.IntParameter(
+        label="Number of simulations",
+        description="Number of simulations to perform for every CRN.",
+        default_value=50,
+        min_value=1,
+    )
+
+    random_seed = knext.IntParameter(
+        label="Random seed",
+        description="If set to non-zero, it will be used to enable reproducible simulations.",
+        default_value=0,
+        is_advanced=True,
+    )
+
+    n_workers = knext.IntParameter(
+        label="Number of workers",
+        description="The number of CRNs to simulate concurrently, each in its own process.",
+        default_value=2,
+        min_value=1,
+    )
+
+    profile_path = profiling_parameter()
+
+    def configure(
+        self, config_context: knext.ConfigurationContext, input_schema: knext.Schema
+    ):
+        for column in ("name", "antimony_definition"):
+            if column not in input_schema.column_names:
+                raise knext.InvalidParametersError(
+                    f"The input table has no '{column}' column."
+                )
+
+        return knext.Schema(
+            ktypes=[ktype for _, ktype in TRACE_COLUMNS],
+            names=[name for name, _ in TRACE_COLUMNS],
+        )
+
+    @profile_execute
+    def execute(self, exec_context: knext.ExecutionContext, input_table: knext.Table):
+        crns = input_table.to_pandas()
+        LOGGER.info(f"Simulating {len(crns)} CRNs on {self.n_workers} workers.")
+
+        results = simulate_crns(
+            crns["antimony_definition"].tolist(),
+            exec_context,
+            self.n_simulations,
+            self.start_time,
+            self.end_time,
+            self.n_steps,
+            self.random_seed,
+            self.n_workers,
+        )
+
+        frames = []
+        failed = []
+        for name, result in zip(crns["name"], results):
+            if result["error"] is not None:
+                LOGGER.warning(f"Skipping {name}: {result['error']}")
+                failed.append(name)
+                continue
+            species_names, data = result["species"], result["data"]
+            n_simulations, n_points, _ = data.shape
+            frames.append(
+                pd.DataFrame(
+                    {
+                        "name": name,
+                        "simulation": np.repeat(
+                            np.arange(n_simulations), n_points * len(species_names)
+                        ),
+                        "time": np.repeat(data[:, :, 0].reshape(-1), len(species_names)),
+                        "species": np.tile(species_names, n_simulations * n_points),
+                        "value": data[:, :, 1:].reshape(-1),
+                    }
+                )
+            )
+
+        if failed:
+            exec_context.set_warning(
+                f"{len(failed)} CRNs could not be simulated: {', '.join(failed)}"
+            )
+
+        if frames:
+            df = pd.concat(frames, ignore_index=True)
+        else:
+            df = pd.DataFrame(columns=[name for name, _ in TRACE_COLUMNS])
+        return knext.Table.from_pandas(df)
@@ -12,6 +12,14 @@ from utils.port_objects import (
 
 from utils.categories import simulations_category
 from utils.simulation_manager import SimulationManager
+from utils.memory import (
+    check_footprint,
+    get_memory_budget,
+    get_trajectories_per_chunk,
+    CHUNKED_MESSAGE,
+)
+from utils.profiling import profiling_parameter, profile_execute
+from utils.plotting import get_placeholder_png
 
 te.setDefaultPlottingEngine("matplotlib")
 
@@ -83,10 +91,43 @@ class StochasticSimulator:
         is_advanced=True,
     )
 
+    memory_budget = knext.IntParameter(
+        label="Memory budget (MB)",
+        description="""
+        If the projected peak memory of the node exceeds this budget, the simulations are performed and written to the
+        output table in chunks that fit into it. Set to 0 to use half of the physical memory.""",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    plot_trajectories = knext.BoolParameter(
+        label="Plot trajectories",
+        description="""
+        If enabled, the mean and quantiles of the trajectories (and their density for large ensembles) are plotted
+        to the image and view outputs. Disable if these outputs are not used, the outputs then only show a placeholder.""",
+        default_value=True,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    def check_footprint(self, n_species):
+        return check_footprint(
+            self.n_simulations, self.n_steps + 1, n_species + 1, self.memory_budget
+        )
+
     def configure(
         self, config_context: knext.ConfigurationContext, input_spec: CrnDefinitionSpec
     ):
         species_names = input_spec.spec_data["species"]
+        try:
+            chunked, message = self.check_footprint(len(species_names))
+        except MemoryError as e:
+            raise knext.InvalidParametersError(str(e))
+        if chunked:
+            config_context.set_warning(f"{message} {CHUNKED_MESSAGE}")
+
         col_names = ["time"] + species_names
         types = [knext.double()] * len(col_names)
         return (
@@ -94,6 +135,7 @@ class StochasticSimulator:
             knext.ImagePortObjectSpec(knext.ImageFormat.PNG),
         )
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
@@ -113,21 +155,42 @@ class StochasticSimulator:
         init_conditions = sm.get_randomized_initial_conditions(
             zero_perturb_prob=1.0, n_conditions=1
         )
-        data = sm.simulate(init_conditions, exec_context)
-        png_bytes = sm.plot_simulations(
-            data,
-            1,
-            self.n_simulations,
-            sm.get_column_names(),
-        )
-
         col_names = ["time"] + sm.get_species_names()
         n_cols = len(col_names)
-        reshaped_sum = data.reshape(self.n_simulations * (self.n_steps + 1), n_cols)
-        df = pd.DataFrame(reshaped_sum, columns=col_names)
+
+        png = get_placeholder_png()
+        chunked, message = self.check_footprint(sm.get_num_species())
+        if not chunked:
+            data = sm.simulate(init_conditions, exec_context)
+            if self.plot_trajectories:
+                png = sm.plot_simulations(
+                    data,
+                    1,
+                    self.n_simulations,
+                    sm.get_column_names(),
+                ).getvalue()
+            reshaped_sum = data.reshape(self.n_simulations * (self.n_steps + 1), n_cols)
+            table = knext.Table.from_pandas(pd.DataFrame(reshaped_sum, columns=col_names))
+        else:
+            LOGGER.warning(f"{message} {CHUNKED_MESSAGE}")
+            n_chunk = get_trajectories_per_chunk(
+                get_memory_budget(self.memory_budget), self.n_steps + 1, n_cols
+            )
+            table = knext.BatchOutputTable.create(row_ids="generate")
+            for start in range(0, self.n_simulations, n_chunk):
+                sm.n_sims_per_init_condition = min(n_chunk, self.n_simulations - start)
+                data = sm.simulate(init_conditions, exec_context)
+                if start == 0 and self.plot_trajectories:
+                    # the plot only shows the first chunk of simulations
+                    png = sm.plot_simulations(
+                        data, 1, len(data), sm.get_column_names()
+                    ).getvalue()
+                table.append(
+                    pd.DataFrame(data.reshape(-1, n_cols), columns=col_names)
+                )
 
         return (
-            knext.Table.from_pandas(df),
-            png_bytes.getvalue(),
-            knext.view_matplotlib(),
+            table,
+            png,
+            knext.view_png(png),
         )
@@ -1,6 +1,7 @@
 import knime.extension as knext
 
 import logging
+import tempfile
 
 from utils.port_objects import (
     crn_definition_port_type,
@@ -16,9 +17,21 @@ from utils.port_objects import (
 
 from utils.categories import simulations_category
 from utils.simulation_manager import SimulationManager
+from utils.chunk_store import ChunkStoreWriter
+from utils.trajectory_encoding import CompactTrajectories
+from utils.memory import (
+    check_footprint,
+    PORT_OUTPUT,
+    VALUE_SIZE,
+    COMPACT_VALUE_SIZE,
+)
+from utils.profiling import profiling_parameter, profile_execute
 
 LOGGER = logging.getLogger(__name__)
 ZERO_PERTURB_RANGE = (0, 10)
+# recorded in the chunk stores written by this node, which it may overwrite when executed again
+CHUNK_STORE_OWNER = "Training Data Generator"
+TEMPORARY_STORE_MESSAGE = "The training data is written to a temporary chunk store instead."
 
 
 @knext.node(
@@ -41,7 +54,8 @@ class TrainingDataGenerator:
     """
     This node allows to generate training data for the provided CRN model. The process differs
     from the Stochastic Simulator node in that the initial conditions are randomly varied to cover a predefined
-    range. The generated training data has a shape of (n_init_conditions * n_sims_per_init_conditions, n_steps, n_species + 1).
+    range. The generated training data has a shape of (n_init_conditions * n_sims_per_init_conditions, n_steps, n_species + 1),
+    or (n_init_conditions * n_sims_per_init_conditions, n_steps, n_species + n_parameters + 1) if the reaction rates are randomized.
 
     The training data can then be used to train a deep abstract model.
     """
@@ -61,7 +75,12 @@ class TrainingDataGenerator:
 
     n_steps = knext.IntParameter(
         label="Steps",
-        description="Number of steps to perform during the specified span of time.",
+        description="""
+        Number of steps to perform during the specified span of time.
+
+        This is the base resolution the trajectories are recorded at. Deep abstract models can be trained at any
+        multiple of the resulting step size from the same data (see the step stride of the Learner), so it is
+        worth recording at a fine resolution.""",
         default_value=50,
         min_value=1,
     )
@@ -96,11 +115,224 @@ class TrainingDataGenerator:
         max_value=1.0,
     )
 
+    class SamplingMethods(knext.EnumParameterOptions):
+        UNIFORM = (
+            "Uniform",
+            "Sample each initial condition independently and uniformly at random.",
+        )
+        LHS = (
+            "Latin hypercube",
+            "Stratify every species range, so that the initial conditions cover it evenly.",
+        )
+        SOBOL = (
+            "Sobol",
+            "Use a scrambled Sobol sequence, which covers the joint range of all species evenly.",
+        )
+
+    sampling_method = knext.EnumParameter(
+        label="Sampling method",
+        description="""
+        How the randomized initial conditions (and reaction rates) are sampled from the perturbation ranges.
+
+        Space-filling designs cover the ranges more evenly than uniform sampling, which allows to train
+        equally accurate models using fewer initial conditions.""",
+        default_value=SamplingMethods.UNIFORM.name,
+        enum=SamplingMethods,
+        is_advanced=True,
+    )
+
+    randomize_reaction_rates = knext.BoolParameter(
+        label="Randomize reaction rates",
+        description="""
+        If enabled, the reaction rates are randomly varied together with the initial conditions, and are appended
+        to the generated trajectories. A deep abstract model trained on such data is conditioned on the reaction rates,
+        and can be simulated at different reaction rates without retraining.""",
+        default_value=False,
+    )
+
+    rate_variance_range = knext.DoubleParameter(
+        label="Reaction rate variance degree",
+        description="The degree of the random perturbation to apply to the reaction rates.",
+        default_value=0.1,
+        min_value=0.0,
+        max_value=1.0,
+    )
+
+    class BurnInModes(knext.EnumParameterOptions):
+        NONE = (
+            "None",
+            "Every replica is simulated from the initial condition.",
+        )
+        SNAPSHOT = (
+            "Snapshot",
+            "The burn-in is simulated once per initial condition, and every replica branches from a snapshot of its final state with its own seed.",
+        )
+        LONG_RUN = (
+            "Long run",
+            "The replicas are consecutive segments of a single long run after the burn-in, separated by the decorrelation time.",
+        )
+
+    burn_in_mode = knext.EnumParameter(
+        label="Burn-in mode",
+        description="""
+        How to record trajectories after a burn-in period, e.g. to generate data of the stationary behaviour of the CRN.
+        
+        Both modes simulate the transient only once per initial condition instead of once per replica.
+        The recorded trajectories start at time 0 after the burn-in.""",
+        default_value=BurnInModes.NONE.name,
+        enum=BurnInModes,
+        is_advanced=True,
+    )
+
+    burn_in_time = knext.DoubleParameter(
+        label="Burn-in time",
+        description="The duration of the burn-in period that is simulated before recording the trajectories.",
+        default_value=0.0,
+        min_value=0.0,
+        is_advanced=True,
+    )
+
+    decorrelation_time = knext.DoubleParameter(
+        label="Decorrelation time",
+        description="""
+        The time between consecutive replicas cut from a single long run (rounded to a multiple of the step size,
+        and at least one step). Only used in the long run burn-in mode.""",
+        default_value=10.0,
+        min_value=0.0,
+        is_advanced=True,
+    )
+
+    sparse_ssa = knext.BoolParameter(
+        label="Sparse SSA",
+        description="""
+        If enabled, the trajectories are simulated with Gillespie's direct method on a sparse representation of the
+        reaction network, which after every reaction only recomputes the propensities of the reactions it affects.
+        This is faster than the default simulator for large CRNs in which every reaction affects only a few others.
+        Requires mass-action kinetics in compartments of unit volume.""",
+        default_value=False,
+        is_advanced=True,
+    )
+
+    class Encodings(knext.EnumParameterOptions):
+        DENSE = (
+            "Dense",
+            "Store the trajectories as a floating point array, including the time column.",
+        )
+        COMPACT = (
+            "Compact",
+            "Store the molecule counts as the narrowest fitting integer type, and the time grid and reaction rates only once.",
+        )
+        DELTA = (
+            "Compact delta",
+            "Like compact, but store the differences of the counts between consecutive time points, which need fewer bits for fine time grids.",
+        )
+
+    encoding = knext.EnumParameter(
+        label="Encoding",
+        description="""
+        How the trajectories are represented in memory and in the output port. Compact encodings reduce the size of the
+        training data several times, and are decoded on the fly during training. Not used for chunk stores.""",
+        default_value=Encodings.DENSE.name,
+        enum=Encodings,
+        is_advanced=True,
+    )
+
+    class Codecs(knext.EnumParameterOptions):
+        NONE = ("None", "Store the training data uncompressed.")
+        ZLIB = ("zlib", "Fast compression with a moderate compression ratio.")
+        LZMA = ("lzma", "Slower compression with a high compression ratio.")
+
+    port_compression = knext.EnumParameter(
+        label="Output compression",
+        description="""
+        How the training data is compressed when the workflow is saved. SSA trajectories consist of integer
+        molecule counts, which compress well.""",
+        default_value=Codecs.ZLIB.name,
+        enum=Codecs,
+        is_advanced=True,
+    )
+
+    chunk_store_path = knext.StringParameter(
+        label="Chunk store directory",
+        description="""
+        If set, the trajectories are written to a chunk store in this directory instead of being kept in memory
+        and in the output port, which allows to generate datasets larger than the available memory. A chunk store
+        previously written to the directory by a Training Data Generator is overwritten, any other one is kept.
+        
+        The trajectories of every chunk of initial conditions are written as soon as they are simulated.
+        Chunk stores are streamed from disk by the Deep Abstraction Learner.""",
+        default_value="",
+        is_advanced=True,
+    )
+
+    n_init_conditions_per_chunk = knext.IntParameter(
+        label="Initial conditions per chunk",
+        description="The number of initial conditions whose trajectories are written to one chunk file.",
+        default_value=100,
+        min_value=1,
+        is_advanced=True,
+    )
+
+    memory_budget = knext.IntParameter(
+        label="Memory budget (MB)",
+        description="""
+        If the projected peak memory of the training data exceeds this budget and no chunk store directory is set,
+        the trajectories are written to a temporary chunk store in the temporary directory of the workflow, which
+        is deleted when the workflow is closed. Set to 0 to use half of the physical memory.""",
+        default_value=0,
+        min_value=0,
+        is_advanced=True,
+    )
+
+    profile_path = profiling_parameter()
+
+    def get_burn_in_kwargs(self):
+        """
+        The keyword arguments of `SimulationManager.simulate` for the selected burn-in mode.
+        """
+        if self.burn_in_mode == self.BurnInModes.SNAPSHOT.name:
+            return {"burn_in_time": self.burn_in_time}
+        if self.burn_in_mode == self.BurnInModes.LONG_RUN.name:
+            return {
+                "burn_in_time": self.burn_in_time,
+                "decorrelation_time": self.decorrelation_time,
+            }
+        return {}
+
+    def check_footprint(self, n_species, n_parameters):
+        """
+        Returns whether the training data exceeds the memory budget, and a message describing its footprint.
+        """
+        n_variables = 1 + n_species
+        if self.randomize_reaction_rates:
+            n_variables += n_parameters
+        return check_footprint(
+            self.n_init_conditions * self.n_sims_per_init_condition,
+            self.n_steps + 1,
+            n_variables,
+            self.memory_budget,
+            output=PORT_OUTPUT,
+            stored_value_size=(
+                VALUE_SIZE
+                if self.encoding == self.Encodings.DENSE.name
+                else COMPACT_VALUE_SIZE
+            ),
+        )
+
     def configure(
         self, config_context: knext.ConfigurationContext, input_spec: CrnDefinitionSpec
     ):
+        spec_data = input_spec.spec_data
+        if "species" in spec_data and not self.chunk_store_path.strip():
+            chunked, message = self.check_footprint(
+                len(spec_data["species"]), len(spec_data.get("parameters", []))
+            )
+            if chunked:
+                config_context.set_warning(f"{message} {TEMPORARY_STORE_MESSAGE}")
+
         return SimulationDataSpec(dict())
 
+    @profile_execute
     def execute(
         self,
         exec_context: knext.ExecutionContext,
@@ -115,17 +347,59 @@ class TrainingDataGenerator:
             self.end_time,
             self.n_steps,
         )
+        if self.sparse_ssa:
+            sm.enable_sparse_ssa()
 
         init_conditions = sm.get_randomized_initial_conditions(
             range_percentage=self.variance_range,
             zero_perturb_prob=self.zero_perturb_prob,
             zero_perturb_range=ZERO_PERTURB_RANGE,
+            sampling_method=self.sampling_method.lower(),
         )
 
-        data = sm.simulate(init_conditions, exec_context)
+        parameter_values = sm.get_original_parameter_values()
+        reaction_rates = None
+        if self.randomize_reaction_rates:
+            reaction_rates = sm.get_randomized_reaction_rates(
+                range_percentage=self.rate_variance_range,
+                sampling_method=self.sampling_method.lower(),
+            )
+
+        chunk_store_path = self.chunk_store_path.strip()
+        if not chunk_store_path:
+            chunked, message = self.check_footprint(
+                sm.get_num_species(), sm.get_num_parameters()
+            )
+            if chunked:
+                LOGGER.warning(f"{message} {TEMPORARY_STORE_MESSAGE}")
+                exec_context.set_warning(f"{message} {TEMPORARY_STORE_MESSAGE}")
+                chunk_store_path = tempfile.mkdtemp(
+                    prefix="training_data_", dir=exec_context.get_workflow_temp_dir()
+                )
+        if chunk_store_path:
+            self.simulate_to_chunk_store(
+                sm, init_conditions, reaction_rates, exec_context, chunk_store_path
+            )
+            data = None
+        else:
+            data = sm.simulate(
+                init_conditions, exec_context, reaction_rates, **self.get_burn_in_kwargs()
+            )
+            if self.encoding != self.Encodings.DENSE.name:
+                dense_bytes = data.nbytes
+                data = CompactTrajectories.encode(
+                    data,
+                    sm.get_num_species(),
+                    delta_encoded=self.encoding == self.Encodings.DELTA.name,
+                )
+                LOGGER.info(
+                    f"Encoded the training data in {data.nbytes} instead of {dense_bytes} bytes."
+                )
+
         data_spec = {
             "species": sm.get_species_names(),
             "parameters": sm.get_parameter_names(),
+            "parameter_values": [float(v) for v in parameter_values],
             "antimony_definition": ant_definition,
             "simulation_configuration": {
                 "n_init_conditions": self.n_init_conditions,
@@ -133,7 +407,38 @@ class TrainingDataGenerator:
                 "start_time": self.start_time,
                 "end_time": self.end_time,
                 "n_steps": self.n_steps,
+                "base_step_size": self.end_time / self.n_steps,
+                "randomized_reaction_rates": self.randomize_reaction_rates,
+                "sampling_method": self.sampling_method.lower(),
+                "burn_in_mode": self.burn_in_mode.lower(),
+                **self.get_burn_in_kwargs(),
             },
         }
+        if chunk_store_path:
+            data_spec["chunk_store"] = chunk_store_path
 
-        return SimulationDataPortObject(SimulationDataSpec(data_spec), data)
+        return SimulationDataPortObject(
+            SimulationDataSpec(data_spec), data, codec=self.port_compression.lower()
+        )
+
+    def simulate_to_chunk_store(
+        self, sm, init_conditions, reaction_rates, exec_context, path
+    ):
+        n_chunk = self.n_init_conditions_per_chunk
+        with ChunkStoreWriter(path, owner=CHUNK_STORE_OWNER) as writer:
+            for start in range(0, self.n_init_conditions, n_chunk):
+                if exec_context.is_canceled():
+                    raise RuntimeError("Execution cancelled.")
+                stop = min(start + n_chunk, self.n_init_conditions)
+                LOGGER.info(
+                    f"Simulating initial conditions {start + 1} to {stop} / {self.n_init_conditions}."
+                )
+                sm.n_init_conditions = stop - start
+                writer.append(
+                    sm.simulate(
+                        init_conditions[start:stop],
+                        exec_context,
+                        None if reaction_rates is None else reaction_rates[start:stop],
+                        **self.get_burn_in_kwargs(),
+                    )
+                )
@@ -5,14 +5,21 @@ Exposes individual nodes to KNIME AP.
 # CRN definition nodes
 import nodes.reaction_networks.crn_writer
 import nodes.reaction_networks.crn_reader
+import nodes.reaction_networks.crn_batch_reader
 
 # SSA simulation nodes
 import nodes.simulations.ssa_simulator
 import nodes.simulations.training_data_generator
+import nodes.simulations.batch_ssa_simulator
 
 # Deep abstraction nodes
 import nodes.deep_abstractions.deep_abstraction_learner
+import nodes.deep_abstractions.deep_abstraction_fine_tuner
+import nodes.deep_abstractions.deep_abstraction_hyperparameter_search
+import nodes.deep_abstractions.deep_abstraction_active_learner
 import nodes.deep_abstractions.deep_abstraction_simulator
+import nodes.deep_abstractions.deep_abstraction_hybrid_simulator
+import nodes.deep_abstractions.deep_abstraction_evaluator
 
 import nodes.deep_abstractions.deep_abstraction_writer
 import nodes.deep_abstractions.deep_abstraction_reader
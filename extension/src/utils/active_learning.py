@@ -0,0 +1,116 @@
+"""
+Active learning of deep abstract models.
+
+Instead of spending the whole SSA budget on blindly sampled initial conditions, the model is trained on a small
+initial dataset, and then repeatedly:
+- a large pool of candidate initial conditions is sampled, which is cheap since nothing is simulated yet,
+- the model is rolled out from every candidate, and the candidates are scored by the model's own uncertainty,
+  i.e. the predicted standard deviation `sigma` relative to the predicted molecule counts,
+- only the most uncertain candidates are simulated with SSA and added to the training data,
+- the model is fine-tuned on the extended dataset,
+until the validation loss reaches the target or the iteration budget is spent.
+
+The validation set is held out from the initial dataset and stays fixed, while all newly simulated trajectories
+are added to the training set, so that the validation losses of all iterations are comparable.
+"""
+import numpy as np
+
+
+def score_initial_conditions(mm, init_conditions, time_step, n_steps):
+    """
+    Returns the mean relative predicted standard deviation of the rollout from every initial condition.
+    """
+    trajectories, sigmas = mm.rollout(
+        init_conditions, time_step, n_steps, return_sigma=True
+    )
+    relative_sigmas = sigmas / (np.abs(trajectories[:, 1:, 1:]) + 1.0)
+    return relative_sigmas.mean(axis=(1, 2))
+
+
+def run_active_learning(
+    sm,
+    mm,
+    exec_context,
+    n_initial_conditions,
+    n_new_conditions,
+    n_candidates,
+    max_iterations,
+    target_loss,
+    split=0.8,
+    n_epochs=20,
+    n_fine_tune_epochs=5,
+    fine_tune_learning_rate=1e-4,
+    batch_size=128,
+    patience=5,
+    sampling_kwargs=None,
+):
+    """
+    Trains `mm` on data generated by `sm` (whose model parameters must be set), spending the SSA budget on the
+    initial conditions the model is most uncertain about.
+
+    Returns: the generated training data, and a list with the validation loss and dataset size of every iteration.
+    """
+    sampling_kwargs = sampling_kwargs or {}
+    time_step = sm.end_time / sm.n_steps
+
+    def simulate(init_conditions):
+        sm.n_init_conditions = len(init_conditions)
+        return sm.simulate(init_conditions, exec_context)
+
+    init_conditions = sm.get_randomized_initial_conditions(
+        n_conditions=n_initial_conditions, **sampling_kwargs
+    )
+    data = simulate(init_conditions)
+
+    # the simulations of an initial condition are kept together, in either the training or the validation set
+    n_train_conditions = min(
+        max(int(n_initial_conditions * split), 1), n_initial_conditions - 1
+    )
+    split_index = n_train_conditions * sm.n_sims_per_init_condition
+    train_data, validation_data = data[:split_index], data[split_index:]
+
+    mm.load_data(train_data)
+    mm.fit_normalization(split=1.0)
+    mm.prepare_data_loaders(batch_size=batch_size, test_data=validation_data)
+    mm.train(exec_context, n_epochs=n_epochs, patience=patience)
+
+    history = []
+    for iteration in range(max_iterations + 1):
+        validation_loss = mm.validate()
+        history.append(
+            {
+                "iteration": iteration,
+                "n_init_conditions": (len(train_data) + len(validation_data))
+                // sm.n_sims_per_init_condition,
+                "n_trajectories": len(train_data) + len(validation_data),
+                "validation_loss": validation_loss,
+            }
+        )
+        print(f"Active learning iteration {iteration}: validation loss {validation_loss:.4f}")
+
+        if validation_loss <= target_loss:
+            print("Target validation loss reached.")
+            break
+        if iteration == max_iterations or exec_context.is_canceled():
+            break
+
+        candidates = sm.get_randomized_initial_conditions(
+            n_conditions=n_candidates, **sampling_kwargs
+        )
+        scores = score_initial_conditions(
+            mm, sm.add_time_column(candidates), time_step, sm.n_steps
+        )
+        selected = candidates[np.argsort(scores)[::-1][:n_new_conditions]]
+
+        train_data = np.concatenate([train_data, simulate(selected)], axis=0)
+
+        mm.load_data(train_data)
+        mm.prepare_data_loaders(batch_size=batch_size, test_data=validation_data)
+        mm.train(
+            exec_context,
+            n_epochs=n_fine_tune_epochs,
+            patience=patience,
+            learning_rate=fine_tune_learning_rate,
+        )
+
+    return np.concatenate([train_data, validation_data], axis=0), history
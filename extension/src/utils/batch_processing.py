@@ -0,0 +1,134 @@
+"""
+Batch processing of many CRN definitions, e.g. the variants of a CRN in a screening study.
+
+Parsing a CRN definition and simulating it with SSA are independent for every definition, so both are distributed
+over a shared pool of worker processes. Every worker loads the definitions through SimulationManager, exactly as
+the single-CRN nodes do.
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+
+from utils.simulation_manager import SimulationManager
+from utils.worker_context import WorkerContext
+
+CRN_FILE_EXTENSIONS = (".xml", ".txt")
+
+
+def list_crn_files(directory, recursive=False):
+    """
+    Returns the sorted paths of all Antimony (.txt) and SBML (.xml) files in the directory.
+    """
+    pattern = "**/*" if recursive else "*"
+    return sorted(
+        str(path)
+        for path in Path(directory).glob(pattern)
+        if path.is_file() and path.suffix in CRN_FILE_EXTENSIONS
+    )
+
+
+def parse_crn_definition(path):
+    """
+    Loads the CRN definition in the given file. Returns a dict with its Antimony definition, species and
+    parameters, or with the error message if the definition cannot be loaded.
+    """
+    result = {"file": path, "name": Path(path).stem}
+    try:
+        sm = SimulationManager(path)
+        result.update(
+            {
+                "antimony_definition": sm.model.getAntimony(),
+                "species": list(sm.get_species_names()),
+                "parameters": list(sm.get_parameter_names()),
+                "error": None,
+            }
+        )
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def simulate_crn(
+    ant_definition, n_simulations, start_time, end_time, n_steps, random_seed=0
+):
+    """
+    Simulates the CRN from the initial condition in its definition.
+
+    Returns: a dict with the species names and a numpy array of shape (n_simulations, n_steps + 1, n_species + 1),
+    or with the error message if the CRN cannot be simulated.
+    """
+    try:
+        sm = SimulationManager(ant_definition)
+        sm.set_model_parameters(
+            1, n_simulations, start_time, end_time, n_steps, random_seed
+        )
+        # SimulationManager.simulate expects the species values of every initial condition, without a time column
+        init_conditions = np.atleast_2d(sm.get_original_species_values())
+        return {
+            "species": list(sm.get_species_names()),
+            "data": sm.simulate(init_conditions, WorkerContext()),
+            "error": None,
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+
+def run_in_pool(function, arguments, exec_context, n_workers):
+    """
+    Calls `function` with every tuple of arguments in a process pool, reporting the progress to the execution
+    context. Returns the results in the order of the arguments. Raises a RuntimeError if the execution is
+    cancelled, after the running calls have finished and the pending ones have been cancelled.
+    """
+    results = [None] * len(arguments)
+    n_done = 0
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending = {
+            executor.submit(function, *args): index
+            for index, args in enumerate(arguments)
+        }
+
+        while pending:
+            if exec_context.is_canceled():
+                print("Execution cancelled.")
+                executor.shutdown(wait=True, cancel_futures=True)
+                raise RuntimeError("Execution cancelled.")
+
+            done, _ = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                n_done += 1
+            exec_context.set_progress(n_done / len(arguments))
+
+    return results
+
+
+def parse_crn_definitions(paths, exec_context, n_workers=2):
+    return run_in_pool(
+        parse_crn_definition, [(path,) for path in paths], exec_context, n_workers
+    )
+
+
+def simulate_crns(
+    ant_definitions,
+    exec_context,
+    n_simulations,
+    start_time,
+    end_time,
+    n_steps,
+    random_seed=0,
+    n_workers=2,
+):
+    return run_in_pool(
+        simulate_crn,
+        [
+            (definition, n_simulations, start_time, end_time, n_steps, random_seed)
+            for definition in ant_definitions
+        ],
+        exec_context,
+        n_workers,
+    )
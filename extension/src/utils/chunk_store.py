@@ -0,0 +1,187 @@
+"""
+On-disk storage of simulation datasets that do not fit in memory.
+
+A chunk store is a directory of `.npy` chunk files, each holding a contiguous block of trajectories of shape
+(n_trajectories, n_steps + 1, n_variables), and a JSON manifest listing the chunks. Chunks are appended one
+at a time while the data is generated, and are memory-mapped when read, so that only the trajectories that are
+actually accessed are loaded.
+"""
+import json
+import os
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+
+
+class ChunkStoreWriter:
+    """
+    Appends trajectories to a new chunk store. The manifest is written when the writer is closed,
+    so an interrupted generation does not leave a store that appears complete.
+
+    The optional `owner` is recorded in the manifest. An existing store with the same owner is cleared and
+    overwritten (e.g. when the node that wrote it is executed again), any other existing store is kept.
+    """
+
+    def __init__(self, path, dtype=np.float32, owner=None):
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if owner is None or manifest.get("owner") != owner:
+                raise FileExistsError(f"A chunk store already exists at {path}.")
+            # the manifest is removed first, so that the store never appears complete while it is cleared
+            os.remove(manifest_path)
+            for chunk in manifest["chunks"]:
+                chunk_path = os.path.join(path, chunk["file"])
+                if os.path.exists(chunk_path):
+                    os.remove(chunk_path)
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.owner = owner
+        self.chunks = []
+        self.trajectory_shape = None
+
+    def append(self, trajectories):
+        trajectories = np.asarray(trajectories, dtype=self.dtype)
+        if self.trajectory_shape is None:
+            self.trajectory_shape = trajectories.shape[1:]
+        elif trajectories.shape[1:] != self.trajectory_shape:
+            raise ValueError(
+                f"Trajectories of shape {trajectories.shape[1:]} do not match the store of shape {self.trajectory_shape}."
+            )
+
+        file_name = f"chunk_{len(self.chunks):05d}.npy"
+        np.save(os.path.join(self.path, file_name), trajectories)
+        self.chunks.append({"file": file_name, "n_trajectories": len(trajectories)})
+
+    def close(self):
+        manifest = {
+            "dtype": self.dtype.str,
+            "trajectory_shape": list(self.trajectory_shape or ()),
+            "chunks": self.chunks,
+        }
+        if self.owner is not None:
+            manifest["owner"] = self.owner
+        with open(os.path.join(self.path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class ChunkStore:
+    """
+    Read access to a chunk store. Behaves like a read-only array of shape (n_trajectories, n_steps + 1, n_variables)
+    for the operations needed during training: slicing contiguous ranges of trajectories and gathering
+    sorted subsets of them. Every read returns a copy in memory.
+
+    If `step_stride` is given, only every n-th time point of the trajectories is read.
+    """
+
+    def __init__(self, path, step_stride=1):
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+
+        self.path = path
+        self.step_stride = step_stride
+        self.chunk_files = [chunk["file"] for chunk in manifest["chunks"]]
+        # index of the first trajectory of every chunk, and the total number of trajectories
+        self.offsets = np.cumsum(
+            [0] + [chunk["n_trajectories"] for chunk in manifest["chunks"]]
+        )
+
+        n_steps, n_variables = manifest["trajectory_shape"]
+        n_steps = len(range(0, n_steps, step_stride))
+        self.shape = (int(self.offsets[-1]), n_steps, n_variables)
+        self.dtype = np.dtype(manifest["dtype"])
+        self._chunks = {}
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_chunk(self, index):
+        if index not in self._chunks:
+            self._chunks[index] = np.load(
+                os.path.join(self.path, self.chunk_files[index]), mmap_mode="r"
+            )
+        return self._chunks[index]
+
+    def read(self, start, stop):
+        """
+        Returns the trajectories with indices in [start, stop).
+        """
+        start, stop = max(start, 0), min(stop, len(self))
+        first = np.searchsorted(self.offsets, start, side="right") - 1
+        parts = []
+        index = first
+        while index < len(self.chunk_files) and self.offsets[index] < stop:
+            offset = self.offsets[index]
+            chunk = self.get_chunk(index)
+            parts.append(
+                chunk[
+                    max(start - offset, 0) : stop - offset, :: self.step_stride
+                ]
+            )
+            index += 1
+
+        if not parts:
+            return np.empty((0,) + self.shape[1:], dtype=self.dtype)
+        return np.concatenate(parts, axis=0)
+
+    def take(self, indices):
+        """
+        Returns the trajectories with the given indices, in the given order.
+        """
+        indices = np.asarray(indices)
+        chunk_indices = np.searchsorted(self.offsets, indices, side="right") - 1
+        result = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        for chunk_index in np.unique(chunk_indices):
+            mask = chunk_indices == chunk_index
+            local_indices = indices[mask] - self.offsets[chunk_index]
+            result[mask] = self.get_chunk(chunk_index)[local_indices, :: self.step_stride]
+        return result
+
+    def get_mean_std(self, start=0, stop=None):
+        """
+        Returns the mean and standard deviation of every variable over the trajectories with indices in
+        [start, stop) (all by default) and all time points, accumulated chunk by chunk.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        count = 0
+        total = np.zeros(self.shape[2])
+        total_squares = np.zeros(self.shape[2])
+        for index in range(len(self.chunk_files)):
+            offset = self.offsets[index]
+            if self.offsets[index + 1] <= start or offset >= stop:
+                continue
+            chunk = np.asarray(
+                self.get_chunk(index)[
+                    max(start - offset, 0) : stop - offset, :: self.step_stride
+                ],
+                dtype=np.float64,
+            )
+            count += chunk.shape[0] * chunk.shape[1]
+            total += chunk.sum(axis=(0, 1))
+            total_squares += np.square(chunk).sum(axis=(0, 1))
+
+        mean = total / count
+        std = np.sqrt(np.maximum(total_squares / count - np.square(mean), 0.0))
+        return mean, std
+
+    def get_min_max(self):
+        """
+        Returns the minimum and maximum of every variable over all trajectories and time points.
+        """
+        minimum = np.full(self.shape[2], np.inf)
+        maximum = np.full(self.shape[2], -np.inf)
+        for index in range(len(self.chunk_files)):
+            chunk = self.get_chunk(index)[:, :: self.step_stride]
+            minimum = np.minimum(minimum, chunk.min(axis=(0, 1)))
+            maximum = np.maximum(maximum, chunk.max(axis=(0, 1)))
+        return minimum, maximum
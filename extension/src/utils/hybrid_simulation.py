@@ -0,0 +1,97 @@
+"""
+Hybrid simulation with a deep abstract model and SSA.
+
+A deep abstract model is only trustworthy inside the region of the state space covered by its training data.
+The hybrid simulation advances every trajectory with the model as long as its state stays inside the training
+envelope (the per-species bounds of the training data, widened by a relative margin), and hands trajectories
+that leave it over to SSA for a segment of steps, after which the envelope is checked again.
+"""
+import contextlib
+
+import numpy as np
+
+
+def is_inside_envelope(species, envelope, margin=0.0):
+    """
+    Returns a boolean mask of the states of shape (n_states, n_species) that are inside the envelope,
+    widened by `margin` times the range of every species.
+    """
+    species_min = np.asarray(envelope["species_min"])
+    species_max = np.asarray(envelope["species_max"])
+    tolerance = margin * (species_max - species_min)
+    return np.all(
+        (species >= species_min - tolerance) & (species <= species_max + tolerance),
+        axis=1,
+    )
+
+
+def run_hybrid_simulation(
+    mm,
+    sm,
+    states,
+    time_step,
+    n_steps,
+    envelope,
+    margin=0.0,
+    ssa_segment_steps=10,
+    callback=None,
+):
+    """
+    Simulates one trajectory from each of the given states of shape (n_trajectories, 1 + n_species + n_parameters),
+    using the deep abstract model `mm` inside the training envelope, and SSA via `sm` outside of it.
+    The optional callback is called with the index of every step, and stops the simulation if it returns False.
+    If tracing is enabled on `mm` (see `MdnManager.enable_tracing`), the first steps are recorded.
+
+    Returns: the trajectories of shape (n_trajectories, n_steps + 1, n_species + 1), a boolean array of shape
+    (n_trajectories, n_steps) which is True for the steps simulated with SSA. Both are truncated if the
+    simulation is stopped.
+    """
+    states = np.asarray(states, dtype=np.float64)
+    n_trajectories = len(states)
+    n_species = mm.n_species
+    reaction_rates = states[:, n_species + 1 :] if mm.n_parameters > 0 else None
+
+    trajectories = np.empty((n_trajectories, n_steps + 1, n_species + 1))
+    trajectories[:, 0] = states[:, : n_species + 1]
+    ssa_steps = np.zeros((n_trajectories, n_steps), dtype=bool)
+    # the number of steps simulated so far, which differs between trajectories during SSA segments
+    n_filled = np.zeros(n_trajectories, dtype=int)
+
+    trace = mm.get_trace()
+    with trace if trace is not None else contextlib.nullcontext():
+        for j in range(n_steps):
+            if callback is not None and callback(j) is False:
+                return trajectories[:, : j + 1], ssa_steps[:, :j]
+
+            current = np.flatnonzero(n_filled == j)
+            if len(current) == 0:
+                continue
+            inside = is_inside_envelope(
+                trajectories[current, j, 1:], envelope, margin
+            )
+
+            da_indices = current[inside]
+            if len(da_indices) > 0:
+                da_states = np.hstack(
+                    (trajectories[da_indices, j], states[da_indices, n_species + 1 :])
+                )
+                trajectories[da_indices, j : j + 2] = mm.rollout(da_states, time_step, 1)
+                trajectories[da_indices, j + 1, 0] = trajectories[da_indices, j, 0] + time_step
+                n_filled[da_indices] += 1
+
+            ssa_indices = current[~inside]
+            if len(ssa_indices) > 0:
+                n_segment = min(ssa_segment_steps, n_steps - j)
+                trajectories[ssa_indices, j : j + n_segment + 1] = sm.simulate_from_states(
+                    trajectories[ssa_indices, j],
+                    time_step,
+                    n_segment,
+                    None if reaction_rates is None else reaction_rates[ssa_indices],
+                )
+                ssa_steps[ssa_indices, j : j + n_segment] = True
+                n_filled[ssa_indices] += n_segment
+
+            if trace is not None:
+                trace.step()
+
+    return trajectories, ssa_steps
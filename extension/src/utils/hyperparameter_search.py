@@ -0,0 +1,183 @@
+"""
+Parallel hyperparameter search for deep abstract models.
+
+Candidate configurations are trained concurrently in a process pool, with the number of PyTorch threads
+capped per worker so that the workers do not oversubscribe the CPU. After every epoch, each trial reports
+its validation loss, and is pruned if it is worse than the median of the other trials at the same epoch.
+Every trial keeps the weights of its epoch with the lowest validation loss in memory, and reports that loss.
+"""
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import copy
+import itertools
+import multiprocessing
+import random
+import time
+
+import numpy as np
+import torch
+
+from utils.mdn_manager import MdnManager
+from utils.worker_context import WorkerContext
+
+# hyperparameters that are passed to MdnManager, the others are used for training
+MODEL_HYPERPARAMETERS = ("architecture", "hidden_size", "num_layers")
+TRAINING_HYPERPARAMETERS = ("batch_size", "learning_rate")
+
+# the training data is sent to every worker once, instead of once per trial
+_worker_data = None
+
+
+def sample_trials(search_space, n_trials, seed=None):
+    """
+    Samples up to `n_trials` distinct configurations from the grid spanned by the search space,
+    a dict mapping hyperparameter names to lists of candidate values.
+    """
+    names = list(search_space)
+    grid = list(itertools.product(*(search_space[name] for name in names)))
+    random.Random(seed).shuffle(grid)
+
+    return [dict(zip(names, values)) for values in grid[:n_trials]]
+
+
+def _init_worker(data, n_threads):
+    global _worker_data
+    _worker_data = data
+    torch.set_num_threads(n_threads)
+
+
+def _should_prune(trial_id, epoch, loss, shared_losses, n_startup_trials):
+    """
+    Median pruning: a trial is pruned if its loss is worse than the median loss the other trials
+    reported at the same epoch, once enough trials reported it.
+    """
+    other_losses = [
+        losses[epoch]
+        for other_id, losses in shared_losses.items()
+        if other_id != trial_id and len(losses) > epoch
+    ]
+    if len(other_losses) < n_startup_trials:
+        return False
+    return loss > np.median(other_losses)
+
+
+def run_trial(
+    trial_id,
+    hyperparameters,
+    model_configuration,
+    n_epochs,
+    patience,
+    shared_losses,
+    cancel_event,
+    n_startup_trials=2,
+):
+    """
+    Trains a single candidate model in a worker process. Returns the trial results,
+    including the model weights and configuration.
+    """
+    start = time.perf_counter()
+
+    model_configuration = dict(model_configuration)
+    model_configuration.update(
+        {name: hyperparameters[name] for name in MODEL_HYPERPARAMETERS if name in hyperparameters}
+    )
+    mm = MdnManager.from_configuration(model_configuration)
+    mm.load_data(_worker_data)
+    mm.fit_normalization()
+    mm.prepare_data_loaders(batch_size=hyperparameters.get("batch_size", 128))
+
+    losses = []
+    pruned = False
+    best_weights = None
+
+    def report_epoch(epoch):
+        nonlocal pruned, best_weights
+        loss = mm.validate()
+        if not losses or loss < min(losses):
+            best_weights = copy.deepcopy(mm.get_model_weights())
+        losses.append(loss)
+        shared_losses[trial_id] = list(losses)
+
+        if _should_prune(trial_id, epoch, loss, shared_losses, n_startup_trials):
+            pruned = True
+            return False
+
+    mm.train(
+        WorkerContext(cancel_event),
+        n_epochs=n_epochs,
+        patience=patience,
+        learning_rate=hyperparameters.get("learning_rate", 1e-3),
+        epoch_callback=report_epoch,
+        # the workers train concurrently, so the best weights are kept in memory instead
+        checkpoint_path=None,
+    )
+    if best_weights is None:
+        best_weights = mm.get_model_weights()
+
+    return {
+        "trial": trial_id,
+        **hyperparameters,
+        "validation_loss": min(losses) if losses else float("inf"),
+        "n_epochs": len(losses),
+        "pruned": pruned,
+        "seconds": time.perf_counter() - start,
+        "model_configuration": mm.get_model_configuration(),
+        "model_weights": {name: tensor.cpu() for name, tensor in best_weights.items()},
+    }
+
+
+def run_search(
+    data,
+    model_configuration,
+    trials,
+    exec_context,
+    n_epochs=20,
+    patience=5,
+    n_workers=2,
+    n_threads_per_worker=1,
+):
+    """
+    Trains all trials in a process pool, and returns their results sorted by validation loss,
+    with pruned trials last. Raises a RuntimeError if the execution is cancelled.
+    """
+    results = []
+
+    with multiprocessing.Manager() as manager:
+        shared_losses = manager.dict()
+        cancel_event = manager.Event()
+
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(data, n_threads_per_worker),
+        ) as executor:
+            pending = {
+                executor.submit(
+                    run_trial,
+                    trial_id,
+                    hyperparameters,
+                    model_configuration,
+                    n_epochs,
+                    patience,
+                    shared_losses,
+                    cancel_event,
+                )
+                for trial_id, hyperparameters in enumerate(trials)
+            }
+
+            while pending:
+                if exec_context.is_canceled():
+                    # running trials stop after their current epoch, pending ones never start
+                    cancel_event.set()
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise RuntimeError("Execution cancelled.")
+
+                done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.append(future.result())
+                    print(
+                        f"Trial {results[-1]['trial']} finished with validation loss {results[-1]['validation_loss']:.4f}"
+                    )
+                exec_context.set_progress(len(results) / len(trials))
+
+    return sorted(results, key=lambda r: (r["pruned"], r["validation_loss"]))
@@ -0,0 +1,350 @@
+"""
+Local batching inference server for deep abstract model rollouts.
+
+A long-lived server process holds the loaded models, so that several KNIME workflows or batch jobs
+do not each load their own copy. Rollout requests that arrive within a short time window are coalesced
+into a single batched rollout, which utilises the CPU much better than many rollouts of a few trajectories.
+
+The server listens either on a Unix socket or on localhost, and is started with e.g.:
+
+    python -m utils.inference_server --address unix:/tmp/deep_abstractions.sock
+
+Clients (such as the Deep Abstraction Simulator node) connect using `InferenceClient`.
+
+Requests are pickled, so connections are authenticated with a key that only the user running the server and
+its clients can read: either the one in the DEEP_ABSTRACTIONS_AUTHKEY environment variable, or a random key
+that is generated on first use and stored in ~/.deep_abstractions/authkey with permissions 0600.
+"""
+import argparse
+import os
+import queue
+import secrets
+import stat
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+import torch
+
+from utils.model_cache import (
+    ModelCache,
+    get_model_key,
+    get_model_size,
+    DEFAULT_MEMORY_BUDGET,
+)
+
+AUTHKEY_ENV_VARIABLE = "DEEP_ABSTRACTIONS_AUTHKEY"
+AUTHKEY_PATH = os.path.join(os.path.expanduser("~"), ".deep_abstractions", "authkey")
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+DEFAULT_MAX_BATCH_SIZE = 8192
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+def parse_address(address):
+    """
+    Converts `unix:/path/to/socket` or `host:port` into an address accepted by multiprocessing.connection.
+    Only local hosts are accepted, the server must not be reachable from other machines.
+    """
+    if address.startswith("unix:"):
+        return address[len("unix:") :]
+
+    host, _, port = address.rpartition(":")
+    host = host.strip("[]") or "localhost"
+    if host not in LOCAL_HOSTS:
+        raise ValueError(
+            f"The inference server only listens on a Unix socket or on {', '.join(LOCAL_HOSTS)}, not on '{host}'."
+        )
+    return (host, int(port))
+
+
+def get_authkey(path=AUTHKEY_PATH):
+    """
+    Returns the key from the environment, or the per-user key stored at `path`, which is generated if missing.
+    """
+    authkey = os.environ.get(AUTHKEY_ENV_VARIABLE)
+    if authkey:
+        return authkey.encode("utf-8")
+
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        if os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise PermissionError(
+                f"The inference server key {path} must only be accessible by its owner (chmod 600)."
+            )
+    else:
+        with os.fdopen(fd, "w") as f:
+            f.write(secrets.token_hex(32))
+
+    with open(path) as f:
+        return f.read().strip().encode("utf-8")
+
+
+class _RolloutRequest:
+    def __init__(self, key, states, time_step, n_steps):
+        self.key = key
+        self.states = states
+        self.time_step = time_step
+        self.n_steps = n_steps
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceServer:
+    def __init__(
+        self,
+        address,
+        authkey=None,
+        max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+        max_wait_ms=DEFAULT_MAX_WAIT_MS,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+    ):
+        """
+        Rollout requests are collected for at most `max_wait_ms` after the first one arrives, or until
+        `max_batch_size` trajectories are pending, and are then simulated together.
+        """
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.authkey = authkey or get_authkey()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.models = ModelCache(memory_budget)
+
+        self._requests = queue.Queue()
+        self._stopped = threading.Event()
+        self._listener = None
+
+    def serve_forever(self):
+        self._listener = Listener(self.address, authkey=self.authkey)
+        print(f"Inference server listening on {self._listener.address}")
+
+        threading.Thread(target=self._batch_loop, daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    connection = self._listener.accept()
+                except OSError:
+                    continue
+                if self._stopped.is_set():
+                    connection.close()
+                    break
+                threading.Thread(
+                    target=self._handle_connection, args=(connection,), daemon=True
+                ).start()
+        finally:
+            self._listener.close()
+
+    def shutdown(self):
+        self._stopped.set()
+        # wake up the blocking accept() call in serve_forever
+        try:
+            Client(self._listener.address, authkey=self.authkey).close()
+        except (OSError, AttributeError):
+            pass
+
+    def _handle_connection(self, connection):
+        with connection:
+            while not self._stopped.is_set():
+                try:
+                    command, *args = connection.recv()
+                except EOFError:
+                    return
+
+                if command == "has_model":
+                    connection.send(("ok", self.models.lookup(args[0]) is not None))
+                elif command == "load_model":
+                    key, model_configuration, model_weights = args
+                    model_weights = {
+                        name: torch.from_numpy(array)
+                        for name, array in model_weights.items()
+                    }
+                    mm = self.models.add(key, model_configuration, model_weights)
+                    if self.models.lookup(key) is None:
+                        connection.send(
+                            (
+                                "error",
+                                f"The model ({get_model_size(mm)} bytes) does not fit into the memory budget "
+                                f"of the inference server ({self.models.memory_budget} bytes).",
+                            )
+                        )
+                    else:
+                        connection.send(("ok", None))
+                elif command == "rollout":
+                    request = _RolloutRequest(*args)
+                    self._requests.put(request)
+                    request.done.wait()
+                    if request.error is not None:
+                        connection.send(("error", request.error))
+                    else:
+                        connection.send(("ok", request.result))
+                elif command == "shutdown":
+                    connection.send(("ok", None))
+                    self.shutdown()
+                else:
+                    connection.send(("error", f"Unknown command '{command}'."))
+
+    def _collect_batch(self):
+        batch = [self._requests.get()]
+        n_pending = len(batch[0].states)
+        deadline = time.monotonic() + self.max_wait
+
+        while n_pending < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            n_pending += len(request.states)
+
+        return batch
+
+    def _batch_loop(self):
+        while not self._stopped.is_set():
+            batch = self._collect_batch()
+
+            # only rollouts of the same model over the same time grid can be coalesced
+            groups = {}
+            for request in batch:
+                group_key = (request.key, request.time_step, request.n_steps)
+                groups.setdefault(group_key, []).append(request)
+
+            for (key, time_step, n_steps), requests in groups.items():
+                self._run_group(key, time_step, n_steps, requests)
+
+    def _run_group(self, key, time_step, n_steps, requests):
+        try:
+            mm = self.models.lookup(key)
+            if mm is None:
+                raise KeyError(key)
+
+            states = np.concatenate([request.states for request in requests], axis=0)
+            trajectories = mm.rollout(states, time_step, n_steps)
+
+            start = 0
+            for request in requests:
+                end = start + len(request.states)
+                request.result = trajectories[start:end]
+                start = end
+        except KeyError:
+            for request in requests:
+                request.error = "unknown_model"
+        except Exception as e:
+            for request in requests:
+                request.error = str(e)
+        finally:
+            for request in requests:
+                request.done.set()
+
+
+class InferenceClient:
+    def __init__(self, address, authkey=None):
+        self.address = parse_address(address) if isinstance(address, str) else address
+        self.authkey = authkey or get_authkey()
+        self._connection = None
+
+    def _request(self, *message):
+        if self._connection is None:
+            self._connection = Client(self.address, authkey=self.authkey)
+        self._connection.send(message)
+        status, result = self._connection.recv()
+        if status == "error" and result != "unknown_model":
+            raise RuntimeError(f"Inference server error: {result}")
+        return status, result
+
+    def load_model(self, model_configuration, model_weights):
+        """
+        Uploads the model to the server unless it is already loaded, and returns its key.
+        """
+        key = get_model_key(model_configuration, model_weights)
+        _, loaded = self._request("has_model", key)
+        if not loaded:
+            self._upload_model(key, model_configuration, model_weights)
+        return key
+
+    def _upload_model(self, key, model_configuration, model_weights):
+        model_weights = {
+            name: tensor.detach().cpu().numpy() for name, tensor in model_weights.items()
+        }
+        self._request("load_model", key, model_configuration, model_weights)
+
+    def rollout(self, model_configuration, model_weights, states, time_step, n_steps):
+        key = self.load_model(model_configuration, model_weights)
+        status, result = self._request("rollout", key, states, time_step, n_steps)
+
+        if status == "error":
+            # the model was evicted from the server's cache in the meantime
+            self._upload_model(key, model_configuration, model_weights)
+            status, result = self._request("rollout", key, states, time_step, n_steps)
+            if status == "error":
+                raise RuntimeError(
+                    "Inference server error: the model was evicted from the server's cache again."
+                )
+
+        return result
+
+    def simulate(
+        self,
+        model_configuration,
+        model_weights,
+        init_conditions,
+        time_step,
+        n_steps=10,
+        n_sims_per_condition=1,
+    ):
+        """
+        Same as `MdnManager.simulate`, but performed by the inference server.
+        """
+        states = np.repeat(init_conditions, n_sims_per_condition, axis=0)
+        return self.rollout(
+            model_configuration, model_weights, states, time_step, n_steps
+        )
+
+    def shutdown_server(self):
+        self._request("shutdown")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--address",
+        required=True,
+        help="unix:/path/to/socket or localhost:port (e.g. localhost:6000)",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument("--n-threads", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.n_threads > 0:
+        torch.set_num_threads(args.n_threads)
+
+    server = InferenceServer(
+        args.address,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
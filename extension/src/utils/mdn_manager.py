@@ -1,10 +1,16 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset
-from torch.utils.data import DataLoader
+from torch.utils.data import Dataset, IterableDataset
+from torch.utils.data import DataLoader, get_worker_info
 
+import contextlib
 import numpy as np
 import platform
+import time
+
+from utils.chunk_store import ChunkStore
+from utils.trajectory_encoding import CompactTrajectories
+from utils.profiling import TorchTrace
 
 
 def auto_select_device():
@@ -36,29 +42,163 @@ class DataWrapper(Dataset):
     Used for wrapping raw NumPy data. Training and testing sets should be wrapped separately.
     """
 
-    def __init__(self, data, n_species):
+    def __init__(
+        self, data, n_species, prediction_horizon=1, strides=None, base_step_size=None
+    ):
+        """
+        If `strides` are given, every trajectory is additionally subsampled with each of the strides, and the
+        time step (stride * `base_step_size`) is appended to the inputs. All samples have the same length, which
+        is determined by the largest stride: every subsampled sequence (one per stride and offset) is split into
+        windows of that length, the last one aligned to the end of the sequence, so that every stride covers
+        the whole trajectory.
+        """
         self.data = data
         self.n_species = n_species
+        self.prediction_horizon = prediction_horizon
+        self.time_step_conditioned = strides is not None
+        self.strides = strides if self.time_step_conditioned else [1]
+        self.base_step_size = base_step_size
+        self.n_transitions = (data.shape[1] - 1) // max(self.strides)
+        self.windows = self.get_windows(data.shape[1])
+
+    def get_windows(self, n_points):
+        """
+        Returns the (stride, start index) of the windows of every trajectory.
+        """
+        windows = []
+        for stride in self.strides:
+            for offset in range(stride):
+                n_sequence_transitions = (n_points - 1 - offset) // stride
+                if n_sequence_transitions < self.n_transitions:
+                    continue
+                starts = list(
+                    range(
+                        0,
+                        n_sequence_transitions - self.n_transitions + 1,
+                        self.n_transitions,
+                    )
+                )
+                if starts[-1] + self.n_transitions < n_sequence_transitions:
+                    starts.append(n_sequence_transitions - self.n_transitions)
+                windows.extend((stride, offset + start * stride) for start in starts)
+        return windows
 
     def __getitem__(self, index):
         """
-        Inputs contain all information: time, species concentrations, reaction rates.
-        Targets only contain species concentrations.
+        Inputs contain all information: time, species concentrations, reaction rates (and time step).
+        Targets only contain species concentrations of the following `prediction_horizon` time steps,
+        flattened to shape (n_steps - prediction_horizon + 1, prediction_horizon * n_species).
         """
-        # species_concentration_indices = [0, 1, 2]
-        species_concentration_indices = list(range(1, self.n_species + 1))
+        horizon = self.prediction_horizon
+        trajectory_index, window_index = divmod(index, len(self.windows))
+        stride, start = self.windows[window_index]
+        trajectory = self.data[
+            trajectory_index, start : start + stride * self.n_transitions + 1 : stride, :
+        ]
+
+        inputs = trajectory[:-horizon, :].astype(np.float32)
+        if self.time_step_conditioned:
+            time_steps = np.full(
+                (len(inputs), 1), stride * self.base_step_size, dtype=np.float32
+            )
+            inputs = np.hstack((inputs, time_steps))
+        species = trajectory[1:, 1 : self.n_species + 1]
 
-        inputs = self.data[index, :-1, :].astype(np.float32)
-        targets = self.data[index, 1:, species_concentration_indices].astype(np.float32)
-        targets = np.transpose(targets, (1, 0))
+        # windows of shape (n_windows, n_species, horizon)
+        windows = np.lib.stride_tricks.sliding_window_view(species, horizon, axis=0)
+        targets = np.transpose(windows, (0, 2, 1)).reshape(len(inputs), -1)
+        targets = targets.astype(np.float32)
 
         return (torch.from_numpy(inputs), torch.from_numpy(targets))
 
     def __len__(self):
-        return len(self.data)
+        return len(self.data) * len(self.windows)
+
+
+class StreamingDataWrapper(IterableDataset):
+    """
+    Streams the samples of the trajectories with indices in [start, stop) of a ChunkStore.
+
+    The range is read in blocks of `block_size` consecutive trajectories, which are visited in random order.
+    The samples of every block are passed through a shuffle buffer of `shuffle_buffer_size` samples, so that
+    consecutive batches mix trajectories of several blocks. With several DataLoader workers, every worker
+    streams its own share of the blocks, which prefetches the next batches while the model is trained.
+
+    The shuffling is seeded with the seed of torch at construction, the number of previous iterations and
+    the seed of the worker, so that every epoch visits the blocks in a different order.
+    """
+
+    def __init__(
+        self,
+        store,
+        start,
+        stop,
+        n_species,
+        prediction_horizon=1,
+        strides=None,
+        base_step_size=None,
+        shuffle=True,
+        block_size=256,
+        shuffle_buffer_size=8192,
+    ):
+        self.store = store
+        self.start = start
+        self.stop = stop
+        self.wrapper_args = (n_species, prediction_horizon, strides, base_step_size)
+        # the number of samples per trajectory
+        empty = np.empty((0,) + tuple(store.shape[1:]))
+        self.n_windows = len(DataWrapper(empty, *self.wrapper_args).windows)
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = torch.initial_seed()
+        # incremented by every iteration, i.e. per epoch in the main process and in persistent workers
+        self.epoch = 0
+
+    def __iter__(self):
+        blocks = np.arange(self.start, self.stop, self.block_size)
+        worker_info = get_worker_info()
+        # the seed of a worker differs per worker, and per epoch unless the workers are persistent
+        worker_seed = 0
+        if worker_info is not None:
+            blocks = blocks[worker_info.id :: worker_info.num_workers]
+            worker_seed = worker_info.seed
+
+        rng = np.random.default_rng([self.seed, self.epoch, worker_seed])
+        self.epoch += 1
+        if self.shuffle:
+            blocks = rng.permutation(blocks)
+
+        buffer = []
+        for block_start in blocks:
+            block = self.store.read(
+                block_start, min(block_start + self.block_size, self.stop)
+            )
+            samples = DataWrapper(block, *self.wrapper_args)
+            for index in range(len(samples)):
+                if not self.shuffle:
+                    yield samples[index]
+                    continue
+                buffer.append(samples[index])
+                if len(buffer) >= self.shuffle_buffer_size:
+                    # swap a random sample to the end of the buffer and yield it
+                    j = rng.integers(len(buffer))
+                    buffer[j], buffer[-1] = buffer[-1], buffer[j]
+                    yield buffer.pop()
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def __len__(self):
+        return (self.stop - self.start) * self.n_windows
 
 
 class MDN(nn.Module):
+    """
+    Mixture density network with an LSTM encoder. Subclasses replace the encoder, while sharing the
+    fully connected head that predicts the mean and standard deviation of the next state.
+    """
+
     def __init__(
         self, input_size, hidden_size, num_layers, output_size, dropout_rate=0.0
     ):
@@ -67,9 +207,13 @@ class MDN(nn.Module):
         self.hidden_size = hidden_size
         self.num_layers = num_layers
 
-        self.lstm = nn.LSTM(
-            input_size, hidden_size, num_layers, batch_first=True, dropout=dropout_rate
-        )
+        # per-feature scaling statistics, stored with the weights (identity by default)
+        self.register_buffer("input_mean", torch.zeros(input_size))
+        self.register_buffer("input_std", torch.ones(input_size))
+        self.register_buffer("output_mean", torch.zeros(output_size))
+        self.register_buffer("output_std", torch.ones(output_size))
+
+        self.build_encoder(input_size, hidden_size, num_layers, dropout_rate)
 
         self.fc1 = nn.Linear(hidden_size, hidden_size)
         self.fc2 = nn.Linear(hidden_size, hidden_size)
@@ -78,11 +222,30 @@ class MDN(nn.Module):
 
         self.relu = nn.ReLU()
 
-    def forward(self, x):
+    def build_encoder(self, input_size, hidden_size, num_layers, dropout_rate):
+        self.lstm = nn.LSTM(
+            input_size, hidden_size, num_layers, batch_first=True, dropout=dropout_rate
+        )
+
+    def encode(self, x):
         h0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(device)
         c0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(device)
 
         out, _ = self.lstm(x, (h0, c0))
+        return out
+
+    def normalize_targets(self, targets):
+        return (targets - self.output_mean) / self.output_std
+
+    def denormalize_outputs(self, mu, sigma):
+        return mu * self.output_std + self.output_mean, sigma * self.output_std
+
+    def forward(self, x):
+        """
+        Takes raw inputs, and returns mu and sigma in the normalized output space.
+        """
+        x = (x - self.input_mean) / self.input_std
+        out = self.encode(x)
 
         out = self.fc1(out)
         out = self.relu(out)
@@ -98,29 +261,231 @@ class MDN(nn.Module):
         return mu, sigma
 
 
+class GruMDN(MDN):
+    """
+    Mixture density network with a GRU encoder, which is cheaper to run than the LSTM.
+    """
+
+    def build_encoder(self, input_size, hidden_size, num_layers, dropout_rate):
+        self.gru = nn.GRU(
+            input_size, hidden_size, num_layers, batch_first=True, dropout=dropout_rate
+        )
+
+    def encode(self, x):
+        h0 = torch.zeros(self.num_layers, x.size(0), self.hidden_size).to(device)
+
+        out, _ = self.gru(x, h0)
+        return out
+
+
+class MlpMDN(MDN):
+    """
+    Mixture density network with a feed-forward encoder. Since the CRN state is Markovian, the next state
+    only depends on the current one, so every time step is encoded independently. This is the cheapest
+    architecture to train and to run.
+    """
+
+    def build_encoder(self, input_size, hidden_size, num_layers, dropout_rate):
+        layers = []
+        for i in range(num_layers):
+            layers.append(nn.Linear(input_size if i == 0 else hidden_size, hidden_size))
+            layers.append(nn.ReLU())
+            if dropout_rate > 0:
+                layers.append(nn.Dropout(dropout_rate))
+        self.mlp = nn.Sequential(*layers)
+
+    def encode(self, x):
+        return self.mlp(x)
+
+
+NORMALIZATION_BUFFERS = ("input_mean", "input_std", "output_mean", "output_std")
+
+# available model architectures, as recorded in the model configuration
+ARCHITECTURES = {
+    "lstm": MDN,
+    "gru": GruMDN,
+    "mlp": MlpMDN,
+}
+
+# the number of testing trajectories of a ChunkStore or CompactTrajectories that are decoded to evaluate rollouts
+MAX_IN_MEMORY_TEST_TRAJECTORIES = 1000
+
+
+def get_training_envelope(data, n_species):
+    """
+    Returns the per-species minimum and maximum of the training data (a numpy array, a ChunkStore or CompactTrajectories),
+    i.e. the region of the state space a model trained on it can be trusted in.
+    """
+    if isinstance(data, (ChunkStore, CompactTrajectories)):
+        minimum, maximum = data.get_min_max()
+    else:
+        minimum = data.min(axis=(0, 1))
+        maximum = data.max(axis=(0, 1))
+
+    species_indices = slice(1, n_species + 1)
+    return {
+        "species_min": [float(v) for v in minimum[species_indices]],
+        "species_max": [float(v) for v in maximum[species_indices]],
+    }
+
+
 class MdnManager:
-    def __init__(self, n_species):
+    def __init__(
+        self,
+        n_species,
+        n_parameters=0,
+        prediction_horizon=1,
+        architecture="lstm",
+        hidden_size=50,
+        num_layers=2,
+        time_steps=None,
+    ):
+        """
+        If `n_parameters` is non-zero, the model is conditioned on the reaction rates, which are expected
+        to follow the species concentrations in both the training data and the initial conditions.
+
+        If `prediction_horizon` is greater than 1, the model predicts that many future time steps
+        per forward pass, so that a rollout needs correspondingly fewer calls of the model.
+
+        `architecture` is one of the keys of ARCHITECTURES.
+
+        If `time_steps` are given, the model is conditioned on the time step, which is appended to its inputs.
+        It is trained on the given time steps (multiples of the step size the data was recorded at), and can
+        then be rolled out with any of them.
+        """
+        if architecture not in ARCHITECTURES:
+            raise ValueError(
+                f"Unknown architecture '{architecture}', expected one of {list(ARCHITECTURES)}."
+            )
+
         self.n_species = n_species
-        # self.n_parameters = n_parameters
-
-        self.model = MDN(
-            # input_size=1 + self.n_species + self.n_parameters,
-            input_size=1 + self.n_species,
-            hidden_size=50,
-            num_layers=2,
-            output_size=n_species,
+        self.n_parameters = n_parameters
+        self.prediction_horizon = prediction_horizon
+        self.architecture = architecture
+        self.hidden_size = hidden_size
+        self.num_layers = num_layers
+        self.time_steps = time_steps
+        # variables per time step of the data: time, species, reaction rates
+        self.n_variables = 1 + self.n_species + self.n_parameters
+        self.input_size = self.n_variables + (1 if time_steps else 0)
+
+        self.model = ARCHITECTURES[architecture](
+            input_size=self.input_size,
+            hidden_size=hidden_size,
+            num_layers=num_layers,
+            output_size=n_species * prediction_horizon,
         ).to(device)
 
+        # see enable_tracing
+        self.trace_path = None
+        self.trace_steps = 0
+
+    def enable_tracing(self, trace_path, n_steps=10):
+        """
+        Records the first `n_steps` steps of the next training or simulation with the PyTorch profiler,
+        and exports them as a Chrome trace to `trace_path`.
+        """
+        self.trace_path = trace_path
+        self.trace_steps = n_steps
+
+    def get_trace(self):
+        if self.trace_path is None:
+            return None
+        trace = TorchTrace(self.trace_path, self.trace_steps)
+        # every trace is only recorded once
+        self.trace_path = None
+        return trace
+
+    @classmethod
+    def from_configuration(cls, model_configuration):
+        return cls(**model_configuration)
+
+    def get_model_configuration(self):
+        """
+        Returns the arguments required to reconstruct the model with `from_configuration`.
+        """
+        return {
+            "n_species": self.n_species,
+            "n_parameters": self.n_parameters,
+            "prediction_horizon": self.prediction_horizon,
+            "architecture": self.architecture,
+            "hidden_size": self.hidden_size,
+            "num_layers": self.num_layers,
+            "time_steps": self.time_steps,
+        }
+
     def load_data(self, data):
+        """
+        Loads the training data, either a numpy array, CompactTrajectories which are decoded on the fly,
+        or a ChunkStore which is streamed from disk.
+        """
+        if data.shape[2] != self.n_variables:
+            raise ValueError(
+                f"The data has {data.shape[2]} variables per time step, but the model expects {self.n_variables} (time, {self.n_species} species and {self.n_parameters} parameters)."
+            )
         self.simulation_data = data
 
-    def prepare_data_loaders(self, batch_size=64, split=0.8):
+    def prepare_data_loaders(
+        self,
+        batch_size=64,
+        split=0.8,
+        replay_data=None,
+        base_step_size=None,
+        n_workers=0,
+        test_data=None,
+    ):
+        """
+        Splits the loaded data into training and testing sets, unless a fixed `test_data` set is given,
+        in which case all loaded data is used for training. If `replay_data` is provided
+        (e.g. a sample of the data an existing model was trained on), it is mixed into the
+        training set only, so that the testing set keeps measuring performance on the new data.
+
+        Models conditioned on the time step require the `base_step_size` the data was recorded at.
+
+        Data in a ChunkStore is split by index range and streamed, using `n_workers` worker processes
+        to read and prepare the batches in the background.
+        """
+        if isinstance(self.simulation_data, ChunkStore):
+            self.prepare_streaming_data_loaders(
+                batch_size, split, replay_data, base_step_size, n_workers
+            )
+            return
+
         split_index = int(len(self.simulation_data) * split)
-        train_data = self.simulation_data[:split_index]
-        test_data = self.simulation_data[split_index:]
+        if test_data is not None:
+            train_data = self.simulation_data
+        elif isinstance(self.simulation_data, CompactTrajectories):
+            train_data = self.simulation_data.subset(slice(None, split_index))
+            test_data = self.simulation_data.subset(slice(split_index, None))
+        else:
+            train_data = self.simulation_data[:split_index]
+            test_data = self.simulation_data[split_index:]
+
+        if replay_data is not None and len(replay_data) > 0:
+            if replay_data.shape[1:] != train_data.shape[1:]:
+                raise ValueError(
+                    f"Replay data of shape {replay_data.shape[1:]} does not match the training data of shape {train_data.shape[1:]}."
+                )
+            if isinstance(train_data, CompactTrajectories):
+                train_data = train_data.concatenate(replay_data)
+            else:
+                train_data = np.concatenate([train_data, replay_data], axis=0)
+
+        if isinstance(test_data, CompactTrajectories):
+            self.test_data = test_data.decode(slice(MAX_IN_MEMORY_TEST_TRAJECTORIES))
+        else:
+            self.test_data = test_data
+
+        strides = None
+        if self.time_steps:
+            strides = self.get_strides(base_step_size)
 
-        train_dataset = DataWrapper(train_data, self.n_species)
-        test_dataset = DataWrapper(test_data, self.n_species)
+        train_dataset = DataWrapper(
+            train_data, self.n_species, self.prediction_horizon, strides, base_step_size
+        )
+        test_dataset = DataWrapper(
+            test_data, self.n_species, self.prediction_horizon, strides, base_step_size
+        )
 
         self.train_loader = DataLoader(
             train_dataset, batch_size=batch_size, shuffle=True
@@ -129,6 +494,102 @@ class MdnManager:
             test_dataset, batch_size=batch_size, shuffle=False
         )
 
+    def prepare_streaming_data_loaders(
+        self, batch_size, split, replay_data, base_step_size, n_workers
+    ):
+        if replay_data is not None and len(replay_data) > 0:
+            raise ValueError("Replay data cannot be mixed into streamed training data.")
+
+        store = self.simulation_data
+        split_index = int(len(store) * split)
+        # only a bounded sample of the testing set is kept in memory for evaluating rollouts
+        self.test_data = store.read(
+            split_index, split_index + MAX_IN_MEMORY_TEST_TRAJECTORIES
+        )
+
+        strides = None
+        if self.time_steps:
+            strides = self.get_strides(base_step_size)
+
+        loader_kwargs = {"batch_size": batch_size, "num_workers": n_workers}
+        if n_workers > 0:
+            loader_kwargs.update(persistent_workers=True, prefetch_factor=4)
+
+        wrapper_args = (self.n_species, self.prediction_horizon, strides, base_step_size)
+        self.train_loader = DataLoader(
+            StreamingDataWrapper(store, 0, split_index, *wrapper_args),
+            **loader_kwargs,
+        )
+        self.test_loader = DataLoader(
+            StreamingDataWrapper(
+                store, split_index, len(store), *wrapper_args, shuffle=False
+            ),
+            **loader_kwargs,
+        )
+
+    def fit_normalization(self, split=0.8, min_std=1e-6):
+        """
+        Computes the per-feature mean and standard deviation of the training set of the loaded data, i.e. the
+        first `split` of it (the same as in `prepare_data_loaders`), and stores them in the model, which then
+        normalizes its inputs and predicts normalized outputs. The outputs are denormalized during the rollout.
+        """
+        split_index = int(len(self.simulation_data) * split)
+        if isinstance(self.simulation_data, ChunkStore):
+            mean, std = self.simulation_data.get_mean_std(stop=split_index)
+        elif isinstance(self.simulation_data, CompactTrajectories):
+            mean, std = self.simulation_data.subset(slice(None, split_index)).get_mean_std()
+        else:
+            # reducing over both leading axes avoids copying strided views of the data
+            train_data = self.simulation_data[:split_index]
+            mean = train_data.mean(axis=(0, 1))
+            std = train_data.std(axis=(0, 1))
+        # constant features (e.g. species that never change) are only centered
+        std[std < min_std] = 1.0
+
+        if self.time_steps:
+            time_step_std = np.std(self.time_steps)
+            mean = np.append(mean, np.mean(self.time_steps))
+            std = np.append(std, time_step_std if time_step_std >= min_std else 1.0)
+
+        species_indices = slice(1, self.n_species + 1)
+        output_mean = np.tile(mean[species_indices], self.prediction_horizon)
+        output_std = np.tile(std[species_indices], self.prediction_horizon)
+
+        for name, values in (
+            ("input_mean", mean),
+            ("input_std", std),
+            ("output_mean", output_mean),
+            ("output_std", output_std),
+        ):
+            getattr(self.model, name).copy_(torch.from_numpy(values))
+
+    def get_training_envelope(self):
+        return get_training_envelope(self.simulation_data, self.n_species)
+
+    def get_strides(self, base_step_size):
+        strides = [int(round(time_step / base_step_size)) for time_step in self.time_steps]
+        for stride, time_step in zip(strides, self.time_steps):
+            if stride < 1 or not np.isclose(stride * base_step_size, time_step):
+                raise ValueError(
+                    f"The time step {time_step} is not a multiple of the step size of the data ({base_step_size})."
+                )
+        return strides
+
+    def get_replay_sample(self, n_samples):
+        """
+        Returns a random subset of the loaded trajectories, which can be stored alongside
+        the trained model and replayed when the model is later fine-tuned on new data.
+        """
+        n_samples = min(n_samples, len(self.simulation_data))
+        indices = np.sort(
+            np.random.choice(len(self.simulation_data), n_samples, replace=False)
+        )
+        if isinstance(self.simulation_data, ChunkStore):
+            return self.simulation_data.take(indices)
+        if isinstance(self.simulation_data, CompactTrajectories):
+            return self.simulation_data.decode(indices)
+        return self.simulation_data[indices]
+
     def save_model(self, filepath):
         torch.save(self.model.state_dict(), filepath)
         print(f"Model saved to {filepath}")
@@ -143,7 +604,7 @@ class MdnManager:
         return self.model.state_dict()
 
     def save_model_to_onnx(self, destination):
-        dummy_input = torch.randn(1, 1, 1 + self.n_species).to(device)
+        dummy_input = torch.randn(1, 1, self.input_size).to(device)
         torch.onnx.export(self.model, dummy_input, destination, verbose=True)
         print("Model exported to model.onnx")
 
@@ -152,7 +613,14 @@ class MdnManager:
         self.model.to(device)
 
     def set_model_weights(self, weights):
-        self.model.load_state_dict(weights)
+        # models trained before normalization was introduced lack the scaling statistics,
+        # which then keep their identity defaults
+        missing_keys, unexpected_keys = self.model.load_state_dict(weights, strict=False)
+        missing_keys = [key for key in missing_keys if key not in NORMALIZATION_BUFFERS]
+        if missing_keys or unexpected_keys:
+            raise RuntimeError(
+                f"The model weights do not match the model: missing {missing_keys}, unexpected {unexpected_keys}."
+            )
 
     def train(
         self,
@@ -161,66 +629,157 @@ class MdnManager:
         # loss_criterion=nn.MSELoss(),
         loss_criterion=GaussianNLLLoss(),
         patience=5,
+        learning_rate=1e-3,
+        use_autocast=False,
+        compile_model=False,
+        n_threads=0,
+        epoch_callback=None,
+        checkpoint_path="model_best_state_dict.pth",
     ):
-        optimizer = torch.optim.Adam(self.model.parameters())
+        """
+        The weights of the epoch with the lowest training loss are saved to `checkpoint_path`, unless it is None.
+
+        Optionally trains with bf16 autocast, a `torch.compile`d model and a fixed number of intra-op threads.
+        Unsupported options are disabled with a message instead of failing the training.
+
+        The optional `epoch_callback` is called with the index of every finished epoch, and stops the training
+        if it returns False (e.g. to prune unpromising trials during hyperparameter search).
+
+        Returns: a dict with the training throughput in samples per second and the options that were used.
+        """
+        optimizer = torch.optim.Adam(self.model.parameters(), lr=learning_rate)
+        self.model.train()
+
+        previous_n_threads = torch.get_num_threads()
+        if n_threads > 0:
+            torch.set_num_threads(n_threads)
+
+        model = self.model
+        if compile_model:
+            try:
+                model = torch.compile(self.model)
+            except Exception as e:
+                print(f"torch.compile is not supported, using eager mode: {e}")
+                compile_model = False
 
         # train model
         best_loss = float("inf")
         epochs_no_improve = 0
+        n_samples = 0
+        samples_per_second = 0.0
 
         # progress visualisation
         progress = 0
         progress_step = 100 / n_epochs / 100
 
-        for epoch in range(n_epochs):
-            if exec_context.is_canceled():
-                print("Execution cancelled.")
-                break
-
-            exec_context.set_progress(progress)
-            for i, (inputs, targets) in enumerate(self.train_loader):
-                inputs = inputs.to(device)
-                targets = targets.to(device)
-
-                mu, sigma = self.model(inputs)  # Get mu and sigma
-                loss = loss_criterion(mu, sigma, targets)  # Compute Gaussian NLL
-
-                optimizer.zero_grad()
-                loss.backward()
-                optimizer.step()
-
-            progress += progress_step
+        trace = self.get_trace()
+        try:
+            with trace if trace is not None else contextlib.nullcontext():
+                for epoch in range(n_epochs):
+                    if exec_context.is_canceled():
+                        print("Execution cancelled.")
+                        break
+
+                    exec_context.set_progress(progress)
+                    self.model.train()
+                    epoch_start = time.perf_counter()
+                    epoch_samples = n_samples
+                    for i, (inputs, targets) in enumerate(self.train_loader):
+                        inputs = inputs.to(device)
+                        targets = targets.to(device)
+
+                        try:
+                            loss = self._training_step(
+                                model, inputs, targets, optimizer, loss_criterion, use_autocast
+                            )
+                        except Exception as e:
+                            # compilation and autocast failures only surface at the first step
+                            if not (compile_model or use_autocast) or n_samples > 0:
+                                raise
+                            print(f"Falling back to eager float32 training: {e}")
+                            model, compile_model, use_autocast = self.model, False, False
+                            loss = self._training_step(
+                                model, inputs, targets, optimizer, loss_criterion, use_autocast
+                            )
+
+                        n_samples += len(inputs)
+                        if trace is not None:
+                            trace.step()
+
+                    # the throughput of the last epoch excludes the warm-up (e.g. compilation)
+                    epoch_time = time.perf_counter() - epoch_start
+                    samples_per_second = (n_samples - epoch_samples) / epoch_time
+                    progress += progress_step
+
+                    print(f"Epoch [{epoch+1}/{n_epochs}], Loss: {loss.item():.4f}")
+
+                    if loss.item() < best_loss:
+                        best_loss = loss.item()
+                        epochs_no_improve = 0
+                        if checkpoint_path is not None:
+                            torch.save(self.model.state_dict(), checkpoint_path)
+                    else:
+                        epochs_no_improve += 1
+
+                    if epochs_no_improve == patience:
+                        print("Early stopping due to no improvement in loss.")
+                        break
+
+                    if epoch_callback is not None and epoch_callback(epoch) is False:
+                        print("Training stopped by the epoch callback.")
+                        break
+        finally:
+            torch.set_num_threads(previous_n_threads)
+
+        print(f"Training throughput: {samples_per_second:.1f} samples/s")
+
+        return {
+            "samples_per_second": samples_per_second,
+            "autocast": use_autocast,
+            "compiled": compile_model,
+            "n_threads": n_threads if n_threads > 0 else previous_n_threads,
+        }
+
+    def _training_step(
+        self, model, inputs, targets, optimizer, loss_criterion, use_autocast
+    ):
+        with torch.autocast(
+            device_type=device.type, dtype=torch.bfloat16, enabled=use_autocast
+        ):
+            mu, sigma = model(inputs)  # Get mu and sigma
 
-            print(f"Epoch [{epoch+1}/{n_epochs}], Loss: {loss.item():.4f}")
+        targets = self.model.normalize_targets(targets)
+        # the loss is always computed in float32
+        loss = loss_criterion(mu.float(), sigma.float(), targets)  # Compute Gaussian NLL
 
-            if loss.item() < best_loss:
-                best_loss = loss.item()
-                epochs_no_improve = 0
-                torch.save(self.model.state_dict(), "model_best_state_dict.pth")
-            else:
-                epochs_no_improve += 1
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
 
-            if epochs_no_improve == patience:
-                print("Early stopping due to no improvement in loss.")
-                break
+        return loss
 
     def validate(self):
         self.model.eval()
         running_loss = 0.0
+        n_batches = 0
         criterion = GaussianNLLLoss()
         with torch.no_grad():
-            for i, (inputs, targets) in enumerate(self.test_loader):
+            for inputs, targets in self.test_loader:
                 inputs = inputs.float().to(device)
                 targets = targets.float().to(device)
 
                 mu, sigma = self.model(inputs)  # Get mu and sigma
+                targets = self.model.normalize_targets(targets)
 
                 loss = criterion(mu, sigma, targets)
                 running_loss += loss.item()
+                n_batches += 1
 
-        average_loss = running_loss / len(self.test_loader)
+        average_loss = running_loss / max(n_batches, 1)
         print(f"Validation Loss of the model on test data : {average_loss}")
 
+        return average_loss
+
     def simulate(
         self,
         init_conditions,
@@ -228,48 +787,208 @@ class MdnManager:
         time_step,
         n_steps=10,
         n_sims_per_condition=1,
+        sample=False,
     ):
-        self.model.eval()
-        all_trajectories = []
+        """
+        If `sample` is set, the trajectories are sampled from the predicted distributions (see `rollout`),
+        otherwise the `n_sims_per_condition` trajectories of every initial condition are identical.
 
-        progress = 0
-        progress_step = 100 / len(init_conditions) / n_sims_per_condition / 100
+        Returns: a numpy array of generated trajectories of shape
+        (n_init_conditions * n_sims_per_condition, n_steps + 1, n_species + 1)
+        """
+        print(
+            f"Generating {n_sims_per_condition} trajectories for each of the {len(init_conditions)} initial conditions"
+        )
+        progress_step = 1 / n_steps
+
+        def report_progress(step):
+            if exec_context.is_canceled():
+                print("Execution cancelled.")
+                return False
+            exec_context.set_progress(step * progress_step)
+
+        # all trajectories are simulated as a single batch
+        states = np.repeat(init_conditions, n_sims_per_condition, axis=0)
+        trace = self.get_trace()
+        if trace is None:
+            return self.rollout(
+                states, time_step, n_steps, callback=report_progress, sample=sample
+            )
+
+        def report_and_trace(step):
+            trace.step()
+            return report_progress(step)
 
-        for i, init_condition in enumerate(init_conditions):
-            print(
-                f"Generating trajectories for init_condition {i+1} / {len(init_conditions)}"
+        with trace:
+            return self.rollout(
+                states, time_step, n_steps, callback=report_and_trace, sample=sample
             )
 
-            for sim in range(n_sims_per_condition):
-                if exec_context.is_canceled():
-                    print("Execution cancelled.")
+    def rollout(
+        self,
+        states,
+        time_step,
+        n_steps,
+        callback=None,
+        steps_per_call=None,
+        return_sigma=False,
+        sample=False,
+    ):
+        """
+        Simulates a batch of trajectories from the given states of shape (n_trajectories, 1 + n_species + n_parameters).
+        The optional callback is called with the index of the step before every call of the model,
+        and stops the rollout if it returns False.
+
+        Every call of the model advances the trajectories by `steps_per_call` time steps, which defaults
+        to (and cannot exceed) the prediction horizon of the model.
+
+        By default the trajectories follow the predicted means, so all trajectories from the same state are
+        identical. If `sample` is set, every next state is instead sampled from the predicted normal
+        distribution N(mu, sigma), so that the trajectories form a stochastic ensemble.
+
+        Returns: a numpy array of shape (n_trajectories, n_steps + 1, n_species + 1), and if `return_sigma`
+        is set, the predicted standard deviations of the species of shape (n_trajectories, n_steps, n_species)
+        """
+        self.model.eval()
+
+        if steps_per_call is None:
+            steps_per_call = self.prediction_horizon
+        steps_per_call = min(steps_per_call, self.prediction_horizon)
+
+        states = np.asarray(states, dtype=np.float32)
+        n_trajectories = len(states)
+
+        trajectories = np.empty((n_trajectories, n_steps + 1, self.n_species + 1))
+        trajectories[:, 0, :] = states[:, : self.n_species + 1]
+        sigmas = np.empty((n_trajectories, n_steps, self.n_species))
+
+        current_state = torch.from_numpy(states).to(device)
+        # the reaction rates (and the time step) stay constant throughout the trajectory
+        parameters = current_state[:, self.n_species + 1 :]
+        if self.time_steps:
+            time_step_column = torch.full((n_trajectories, 1), time_step, device=device)
+            parameters = torch.cat((parameters, time_step_column), dim=1)
+            current_state = torch.cat((current_state, time_step_column), dim=1)
+        time_column = torch.empty((n_trajectories, 1), device=device)
+
+        with torch.no_grad():
+            for j in range(0, n_steps, steps_per_call):
+                if callback is not None and callback(j) is False:
+                    trajectories, sigmas = trajectories[:, : j + 1], sigmas[:, :j]
                     break
 
-                print(f"  Simulating trajectory {sim+1} / {n_sims_per_condition}")
-                exec_context.set_progress(progress)
+                mu, sigma = self.model(current_state.unsqueeze(1))
+                mu, sigma = self.model.denormalize_outputs(mu, sigma)
+                next_states = mu[:, -1, :]
+                if sample:
+                    # the species are molecule counts, which cannot become negative
+                    next_states = torch.clamp(
+                        torch.normal(next_states, sigma[:, -1, :]), min=0.0
+                    )
+                next_states = next_states.reshape(
+                    n_trajectories, self.prediction_horizon, self.n_species
+                )
+                n_new = min(steps_per_call, n_steps - j)
+                next_states = next_states[:, :n_new]
+                sigmas[:, j : j + n_new] = (
+                    sigma[:, -1, :]
+                    .reshape(n_trajectories, self.prediction_horizon, self.n_species)[
+                        :, :n_new
+                    ]
+                    .cpu()
+                    .numpy()
+                )
+
+                timestamps = (j + 1 + np.arange(n_new)) * time_step
+                trajectories[:, j + 1 : j + 1 + n_new, 0] = timestamps
+                trajectories[:, j + 1 : j + 1 + n_new, 1:] = np.round(
+                    next_states.cpu().numpy()
+                )
+
+                time_column.fill_(timestamps[-1])
+                current_state = torch.cat(
+                    (time_column, next_states[:, -1], parameters), dim=1
+                )
+
+        if return_sigma:
+            return trajectories, sigmas
+        return trajectories
+
+    def adaptive_rollout(self, states, end_time, tolerance=0.1, callback=None):
+        """
+        Simulates a batch of trajectories until `end_time` with a model conditioned on the time step.
+        Every step starts with the largest time step the model was trained on, and falls back to the next smaller
+        one as long as the predicted mean relative change of any trajectory exceeds `tolerance`. Only the trained time
+        steps are taken, so the rollout stops at the last point before the remaining time falls below the smallest
+        one, which may be before `end_time`. All trajectories share the resulting (irregular) time grid.
+        The optional callback is called with the current time before every step, and stops the rollout if it returns False.
+
+        Returns: a numpy array of shape (n_trajectories, n_steps + 1, n_species + 1)
+        """
+        if not self.time_steps:
+            raise ValueError("Adaptive time steps require a model conditioned on the time step.")
+        self.model.eval()
+
+        time_steps = sorted(self.time_steps, reverse=True)
+        states = np.array(states, dtype=np.float32)
+        n_trajectories = len(states)
+        trajectories = [states[:, : self.n_species + 1].astype(np.float64)]
 
-                trajectory = [init_condition[: self.n_species + 1]]
-                current_state = self.convert_numpy_to_torch(init_condition)
-                timestamp = 0.0
+        def predict(time_step):
+            inputs = np.hstack(
+                (states, np.full((n_trajectories, 1), time_step, dtype=np.float32))
+            )
+            with torch.no_grad():
+                mu, sigma = self.model(torch.from_numpy(inputs).to(device).unsqueeze(1))
+                mu, _ = self.model.denormalize_outputs(mu, sigma)
+            # only the first step of the prediction horizon is used
+            return mu[:, -1, : self.n_species].cpu().numpy()
+
+        current_time = float(states[0, 0])
+        while current_time < end_time and not np.isclose(current_time, end_time):
+            if callback is not None and callback(current_time) is False:
+                break
 
-                for j in range(n_steps):
-                    mu, sigma = self.model(current_state)  # Get mu and sigma
-                    next_state_array = (
-                        mu.squeeze().detach().cpu().numpy()
-                    )  # Use mu as the next state
+            # only trained time steps are taken, the largest ones that do not pass the end time
+            remaining = end_time - current_time
+            fitting = [
+                time_step
+                for time_step in time_steps
+                if time_step <= remaining or np.isclose(time_step, remaining)
+            ]
+            if not fitting:
+                break
 
-                    timestamp += time_step
-                    next_state_array = np.concatenate(([timestamp], next_state_array))
-                    trajectory.append(np.round(next_state_array))
+            species = states[:, 1 : self.n_species + 1]
+            for time_step in fitting:
+                next_species = predict(time_step)
+                relative_change = np.abs(next_species - species) / (np.abs(species) + 1.0)
+                if relative_change.mean(axis=1).max() <= tolerance:
+                    break
 
-                    current_state = self.convert_numpy_to_torch(next_state_array)
+            current_time += time_step
+            states[:, 0] = current_time
+            states[:, 1 : self.n_species + 1] = np.round(next_species)
+            trajectory_states = states[:, : self.n_species + 1].astype(np.float64)
+            trajectory_states[:, 0] = current_time
+            trajectories.append(trajectory_states)
 
-                trajectory = np.array(trajectory)
-                all_trajectories.append(trajectory)
+        return np.stack(trajectories, axis=1)
 
-                progress += progress_step
+    def evaluate_rollout(self, data, time_step, steps_per_call=None):
+        """
+        Rolls out the model from the initial states of the given SSA trajectories, and compares the result
+        against them. Returns the mean absolute error of the species and the wall time of the rollout in seconds.
+        """
+        n_steps = data.shape[1] - 1
+        start = time.perf_counter()
+        trajectories = self.rollout(
+            data[:, 0, :], time_step, n_steps, steps_per_call=steps_per_call
+        )
+        seconds = time.perf_counter() - start
 
-        return np.array(all_trajectories)
+        mae = np.abs(trajectories[..., 1:] - data[..., 1 : self.n_species + 1]).mean()
+        return float(mae), seconds
 
     def convert_numpy_to_torch(self, state):
         i = torch.from_numpy(state).float().to(device)
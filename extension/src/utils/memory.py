@@ -0,0 +1,123 @@
+"""
+Estimates of the memory footprint of simulation nodes.
+
+A node holding n_trajectories trajectories of n_points time points and n_variables variables passes through
+several stages. The simulation always produces dense float64 trajectories, which are then either written to a
+KNIME table or stored in a port object, possibly in a narrower (e.g. compact integer) representation:
+- simulation: the per-trajectory results, and their concatenation,
+- table: the trajectories, the pandas DataFrame they are converted to, and its Arrow copy,
+- encoding: the dense trajectories, and their stored representation,
+- serialization: the stored representation, its pickle, and the compressed payload (which is at most as large
+  as the pickle).
+The projected peak is the largest of the stages. If it exceeds the memory budget, nodes process the trajectories
+in chunks that fit into the budget instead.
+"""
+import os
+
+MEMORY_BUDGET_ENV_VARIABLE = "DEEP_ABSTRACTIONS_MEMORY_BUDGET_MB"
+# fraction of the physical memory used as the budget if none is configured
+DEFAULT_BUDGET_FRACTION = 0.5
+# bytes of a dense float64 value, as produced by RoadRunner and pandas
+VALUE_SIZE = 8
+# bytes of a compactly encoded molecule count (see CompactTrajectories), assuming that the counts fit into int32
+COMPACT_VALUE_SIZE = 4
+# outputs of the nodes, see estimate_footprint
+TABLE_OUTPUT = "table"
+PORT_OUTPUT = "port"
+CHUNKED_MESSAGE = "The trajectories are processed in chunks."
+
+
+def get_physical_memory():
+    """
+    Returns the physical memory in bytes, or None if it cannot be determined on this platform.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_memory_budget(budget_mb=0):
+    """
+    Returns the memory budget in bytes: the given budget if positive, otherwise the one configured via
+    the environment, otherwise a fraction of the physical memory (or None if unknown).
+    """
+    if budget_mb <= 0:
+        budget_mb = float(os.environ.get(MEMORY_BUDGET_ENV_VARIABLE, 0))
+    if budget_mb > 0:
+        return int(budget_mb * 2**20)
+
+    physical_memory = get_physical_memory()
+    if physical_memory is None:
+        return None
+    return int(physical_memory * DEFAULT_BUDGET_FRACTION)
+
+
+def estimate_footprint(
+    n_trajectories,
+    n_points,
+    n_variables,
+    output=TABLE_OUTPUT,
+    stored_value_size=VALUE_SIZE,
+):
+    """
+    Returns the projected footprint in bytes of every stage, and the peak.
+
+    `output` is TABLE_OUTPUT for trajectories written to a KNIME table, or PORT_OUTPUT for trajectories stored
+    in a port object with `stored_value_size` bytes per value.
+    """
+    n_values = n_trajectories * n_points * n_variables
+    dense = n_values * VALUE_SIZE
+    stages = {"simulation": 2 * dense}
+    if output == TABLE_OUTPUT:
+        stages["table"] = 3 * dense
+    elif output == PORT_OUTPUT:
+        stored = n_values * stored_value_size
+        stages["encoding"] = dense + stored if stored_value_size != VALUE_SIZE else dense
+        stages["serialization"] = 3 * stored
+    else:
+        raise ValueError(f"Unknown output '{output}'.")
+    return stages, max(stages.values())
+
+
+def get_trajectories_per_chunk(budget, n_points, n_variables, **kwargs):
+    """
+    Returns the number of trajectories whose processing fits into the budget.
+    """
+    _, peak_per_trajectory = estimate_footprint(1, n_points, n_variables, **kwargs)
+    return max(int(budget // peak_per_trajectory), 1)
+
+
+def format_bytes(n_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n_bytes < 1024:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TB"
+
+
+def check_footprint(n_trajectories, n_points, n_variables, budget_mb=0, **kwargs):
+    """
+    Compares the projected peak footprint (see `estimate_footprint` for the keyword arguments) against the memory
+    budget and the physical memory.
+
+    Returns: whether the trajectories have to be processed in chunks, and a message describing the footprint
+    if they do (otherwise None). Raises a MemoryError if even a single trajectory exceeds the physical memory.
+    """
+    stages, peak = estimate_footprint(n_trajectories, n_points, n_variables, **kwargs)
+    budget = get_memory_budget(budget_mb)
+    if budget is None or peak <= budget:
+        return False, None
+
+    physical_memory = get_physical_memory()
+    _, peak_per_trajectory = estimate_footprint(1, n_points, n_variables, **kwargs)
+    if physical_memory is not None and peak_per_trajectory > physical_memory:
+        raise MemoryError(
+            f"A single trajectory requires {format_bytes(peak_per_trajectory)}, more than the physical memory ({format_bytes(physical_memory)})."
+        )
+
+    details = ", ".join(f"{stage}: {format_bytes(size)}" for stage, size in stages.items())
+    return (
+        True,
+        f"The projected peak memory of {format_bytes(peak)} ({details}) exceeds the memory budget of {format_bytes(budget)}.",
+    )
@@ -0,0 +1,63 @@
+"""
+Statistical distances between ensembles of trajectories, e.g. SSA and deep abstraction simulations.
+
+All functions are vectorised over any leading dimensions (typically initial conditions, time points
+and species), with the ensemble samples along the last axis.
+"""
+import numpy as np
+
+
+def wasserstein_1(a, b):
+    """
+    Wasserstein-1 distance between the empirical distributions along the last axis.
+    Both ensembles must contain the same number of samples, in which case the distance is
+    the mean absolute difference of the sorted samples.
+    """
+    if a.shape[-1] != b.shape[-1]:
+        raise ValueError(
+            f"Both ensembles must have the same size, got {a.shape[-1]} and {b.shape[-1]}."
+        )
+    return np.abs(np.sort(a, axis=-1) - np.sort(b, axis=-1)).mean(axis=-1)
+
+
+def ks_statistic(a, b):
+    """
+    Two-sample Kolmogorov-Smirnov statistic along the last axis.
+
+    The samples of both ensembles are sorted jointly, and the difference of the empirical CDFs is
+    accumulated as a running sum, evaluated only where the sorted values change (to handle ties
+    of the integer molecule counts correctly).
+    """
+    n_a, n_b = a.shape[-1], b.shape[-1]
+    values = np.concatenate([a, b], axis=-1)
+    steps = np.concatenate(
+        [np.full(a.shape, 1.0 / n_a), np.full(b.shape, -1.0 / n_b)], axis=-1
+    )
+
+    order = np.argsort(values, axis=-1, kind="stable")
+    values = np.take_along_axis(values, order, axis=-1)
+    cdf_difference = np.cumsum(np.take_along_axis(steps, order, axis=-1), axis=-1)
+
+    value_changes = np.ones(values.shape, dtype=bool)
+    value_changes[..., :-1] = values[..., 1:] != values[..., :-1]
+
+    return np.max(np.abs(cdf_difference) * value_changes, axis=-1)
+
+
+def compare_ensembles(reference, candidate):
+    """
+    Compares two ensembles of shape (n_init_conditions, n_sims_per_init_condition, n_steps, n_species).
+
+    Returns: a dict of arrays of shape (n_init_conditions, n_steps, n_species) with the Wasserstein-1 distance,
+    the KS statistic, and the absolute errors of the mean and the variance of every time point and species.
+    """
+    # move the ensemble dimension last
+    reference = np.moveaxis(reference, 1, -1)
+    candidate = np.moveaxis(candidate, 1, -1)
+
+    return {
+        "wasserstein_1": wasserstein_1(reference, candidate),
+        "ks_statistic": ks_statistic(reference, candidate),
+        "mean_error": np.abs(reference.mean(axis=-1) - candidate.mean(axis=-1)),
+        "variance_error": np.abs(reference.var(axis=-1) - candidate.var(axis=-1)),
+    }
@@ -0,0 +1,109 @@
+"""
+Process-level cache of ready-to-run deep abstract models.
+
+Building an `MdnManager` and loading its weights is repeated every time a node is executed, e.g. in every
+iteration of a KNIME loop. The cache keeps the most recently used models, keyed by a hash of their
+configuration and weights, and evicts the least recently used ones once the memory budget is exceeded.
+
+Cached managers are shared between nodes, so they must only be used for inference, never trained.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import threading
+
+from utils.mdn_manager import MdnManager
+
+DEFAULT_MEMORY_BUDGET = 512 * 1024**2  # bytes
+
+
+def get_model_key(model_configuration, model_weights):
+    """
+    Returns a hash identifying the model architecture and its weights.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps(model_configuration, sort_keys=True).encode("utf-8"))
+    for name in sorted(model_weights):
+        array = model_weights[name].detach().cpu().contiguous().numpy()
+        h.update(name.encode("utf-8"))
+        h.update(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+        h.update(array.tobytes())
+    return h.hexdigest()
+
+
+def get_model_size(mm):
+    """
+    Returns the memory occupied by the weights and buffers of the manager's model, in bytes.
+    """
+    tensors = list(mm.model.parameters()) + list(mm.model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelCache:
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()  # key -> (manager, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, model_configuration, model_weights):
+        """
+        Returns an `MdnManager` with the given configuration and weights, building it only on a cache miss.
+        """
+        key = get_model_key(model_configuration, model_weights)
+
+        mm = self.lookup(key)
+        if mm is None:
+            mm = self.add(key, model_configuration, model_weights)
+
+        return mm
+
+    def lookup(self, key):
+        """
+        Returns the cached `MdnManager` for the given key, or None on a cache miss.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+
+    def add(self, key, model_configuration, model_weights):
+        """
+        Builds an `MdnManager` and caches it under the given key.
+        """
+        mm = MdnManager.from_configuration(model_configuration)
+        mm.set_model_weights(model_weights)
+        mm.model.eval()
+        self._insert(key, mm)
+
+        return mm
+
+    def _insert(self, key, mm):
+        size = get_model_size(mm)
+        if size > self.memory_budget:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (mm, size)
+            self._size += size
+
+            while self._size > self.memory_budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+MODEL_CACHE = ModelCache()
+
+
+def get_mdn_manager(model_configuration, model_weights):
+    return MODEL_CACHE.get(model_configuration, model_weights)
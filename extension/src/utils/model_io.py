@@ -0,0 +1,154 @@
+"""
+Reading and writing of deep abstract model files.
+
+A model file consists of a small JSON header followed by a flat blob of raw arrays:
+- 8 bytes: the magic string identifying the file format
+- 8 bytes: the length of the JSON header (little-endian unsigned integer)
+- the JSON header, containing the model spec (species, parameters, step size, architecture, ...)
+  and the name, dtype, shape and offset of every array in the blob
+- padding up to the next multiple of ALIGNMENT bytes
+- the array blob, with every array starting at a multiple of ALIGNMENT bytes
+
+Unlike pickle, reading a model file does not execute any code, and the arrays are memory-mapped
+instead of being copied, which makes loading fast even for large model stores.
+
+Model files written by earlier versions of the Writer node are pickled dicts, which can still be read with
+`read_legacy_model_file`. The Reader node only does so if explicitly allowed, since unpickling executes code.
+"""
+import json
+import pickle
+import struct
+
+import numpy as np
+import torch
+
+MODEL_FILE_EXTENSION = ".dam"
+MAGIC = b"DAMODEL1"
+ALIGNMENT = 64
+
+_HEADER_LENGTH_FORMAT = "<Q"
+_PREFIX_SIZE = len(MAGIC) + struct.calcsize(_HEADER_LENGTH_FORMAT)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _to_json(value):
+    """
+    Converts the NumPy values that may occur in a model spec to JSON.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_model_file(path, spec_data, model_weights, extra_arrays=None):
+    """
+    Writes the model spec, the model weights (a PyTorch state dict) and any extra named NumPy arrays
+    (e.g. a replay sample of the training data) to a single model file.
+    """
+    arrays = [
+        ("model_weights", name, tensor.detach().cpu().contiguous().numpy())
+        for name, tensor in model_weights.items()
+    ]
+    for name, array in (extra_arrays or {}).items():
+        arrays.append(("extra_arrays", name, np.ascontiguousarray(array)))
+
+    entries = []
+    offset = 0
+    for group, name, array in arrays:
+        offset = _align(offset)
+        entries.append(
+            {
+                "group": group,
+                "name": name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+        )
+        offset += array.nbytes
+
+    header = json.dumps(
+        {"spec_data": spec_data, "arrays": entries}, default=_to_json
+    ).encode("utf-8")
+    blob_start = _align(_PREFIX_SIZE + len(header))
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack(_HEADER_LENGTH_FORMAT, len(header)))
+        f.write(header)
+        for entry, (_, _, array) in zip(entries, arrays):
+            f.write(b"\0" * (blob_start + entry["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+def is_model_file(path):
+    """
+    Returns whether the file is a model file written by `write_model_file` (rather than a legacy one).
+    """
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_legacy_model_file(path):
+    """
+    Reads a model file written by earlier versions of the Writer node, i.e. a pickled dict with the
+    Antimony definition, the simulation configuration and the model weights.
+    Unpickling can execute arbitrary code, so only trusted files should be read.
+    """
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def read_model_header(path):
+    """
+    Reads only the JSON header of a model file, without touching the array blob.
+    Returns the header and the position of the array blob within the file.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a deep abstract model file.")
+        (header_length,) = struct.unpack(
+            _HEADER_LENGTH_FORMAT, f.read(struct.calcsize(_HEADER_LENGTH_FORMAT))
+        )
+        header = json.loads(f.read(header_length).decode("utf-8"))
+
+    return header, _align(_PREFIX_SIZE + header_length)
+
+
+def read_model_file(path):
+    """
+    Reads a model file written by `write_model_file`.
+    Returns the model spec, the model weights as a PyTorch state dict, and the extra arrays.
+
+    The arrays are memory-mapped copy-on-write, so they are only read from disk when accessed,
+    and modifying them never alters the file.
+    """
+    header, blob_start = read_model_header(path)
+
+    blob = None
+    if header["arrays"]:
+        blob = np.memmap(path, dtype=np.uint8, mode="c", offset=blob_start)
+
+    model_weights = {}
+    extra_arrays = {}
+    for entry in header["arrays"]:
+        dtype = np.dtype(entry["dtype"])
+        n_bytes = dtype.itemsize * int(np.prod(entry["shape"]))
+        array = (
+            blob[entry["offset"] : entry["offset"] + n_bytes]
+            .view(dtype)
+            .reshape(entry["shape"])
+        )
+
+        if entry["group"] == "model_weights":
+            model_weights[entry["name"]] = torch.from_numpy(array)
+        else:
+            extra_arrays[entry["name"]] = array
+
+    return header["spec_data"], model_weights, extra_arrays
@@ -0,0 +1,142 @@
+"""
+Headless plotting of trajectory ensembles.
+
+The figures are rendered with the Agg backend directly into PNG bytes, without pyplot, so no window or global
+figure state is involved. Plotting thousands of trajectories as individual lines takes longer than simulating
+them, so the ensemble is summarized first:
+- the mean and a quantile band of every species, computed with numpy,
+- for large ensembles, additionally the density of the trajectories per species, rendered as a single image.
+Both are computed from at most MAX_TRAJECTORIES trajectories and drawn with a fixed number of artists, so the
+plotting time does not grow with the size of the ensemble.
+"""
+import functools
+import io
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+# the number of trajectories the statistics and densities are computed from
+MAX_TRAJECTORIES = 5000
+# ensembles with more trajectories are shown as densities
+DENSITY_THRESHOLD = 100
+# the resolution of the density images
+N_TIME_BINS = 200
+N_VALUE_BINS = 100
+# the number of species shown as densities, the others are only shown in the bands
+MAX_DENSITY_PANELS = 12
+DPI = 100
+
+
+def subsample(trajectories, max_trajectories=MAX_TRAJECTORIES, random_seed=0):
+    """
+    Returns at most `max_trajectories` of the trajectories, drawn without replacement.
+    """
+    if len(trajectories) <= max_trajectories:
+        return trajectories
+    rng = np.random.default_rng(random_seed)
+    indices = np.sort(rng.choice(len(trajectories), max_trajectories, replace=False))
+    return trajectories[indices]
+
+
+def get_quantile_bands(trajectories, quantiles=(0.05, 0.95)):
+    """
+    Returns the mean and the lower and upper quantiles of every variable per time point,
+    each of shape (n_steps + 1, n_variables).
+    """
+    lower, upper = np.quantile(trajectories, quantiles, axis=0)
+    return np.mean(trajectories, axis=0), lower, upper
+
+
+def get_density(time, values, n_time_bins=N_TIME_BINS, n_value_bins=N_VALUE_BINS):
+    """
+    Returns the log-scaled histogram of shape (n_value_bins, n_time_bins) of the values of shape
+    (n_trajectories, n_steps + 1) over time, and its extent.
+    """
+    n_time_bins = min(n_time_bins, len(time))
+    minimum, maximum = values.min(), values.max()
+    if maximum <= minimum:
+        maximum = minimum + 1.0
+    histogram, _, _ = np.histogram2d(
+        np.broadcast_to(time, values.shape).ravel(),
+        values.ravel(),
+        bins=(n_time_bins, n_value_bins),
+        range=((time[0], time[-1]), (minimum, maximum)),
+    )
+    return np.log1p(histogram.T), (time[0], time[-1], minimum, maximum)
+
+
+def render_png(fig):
+    png_bytes = io.BytesIO()
+    FigureCanvasAgg(fig).print_png(png_bytes)
+    return png_bytes
+
+
+def plot_ensemble(
+    trajectories,
+    column_names,
+    quantiles=(0.05, 0.95),
+    density_threshold=DENSITY_THRESHOLD,
+    title=None,
+):
+    """
+    Plots an ensemble of trajectories of shape (n_trajectories, n_steps + 1, n_variables), whose first
+    variable is the time. Returns the PNG bytes.
+    """
+    n_trajectories = len(trajectories)
+    trajectories = subsample(np.asarray(trajectories))
+    time = trajectories[0, :, 0]
+    mean, lower, upper = get_quantile_bands(trajectories[:, :, 1:], quantiles)
+    names = column_names[1:]
+    band_label = f"{quantiles[0]:.0%}-{quantiles[1]:.0%}"
+
+    if n_trajectories <= density_threshold:
+        fig = Figure(figsize=(6.4, 4.8), dpi=DPI)
+        ax = fig.add_subplot()
+        for j, name in enumerate(names):
+            (line,) = ax.plot(time, mean[:, j], label=name)
+            ax.fill_between(
+                time, lower[:, j], upper[:, j], color=line.get_color(), alpha=0.2
+            )
+        ax.set_xlabel(column_names[0])
+        ax.set_title(title or f"Mean and {band_label} band of {n_trajectories} trajectories")
+        ax.legend()
+        return render_png(fig)
+
+    n_panels = min(len(names), MAX_DENSITY_PANELS)
+    n_cols = min(n_panels, 3)
+    n_rows = -(-n_panels // n_cols)
+    fig = Figure(figsize=(4 * n_cols, 3 * n_rows), dpi=DPI)
+    axes = fig.subplots(n_rows, n_cols, squeeze=False, sharex=True)
+    for j, ax in enumerate(axes.ravel()):
+        if j >= n_panels:
+            ax.set_visible(False)
+            continue
+        density, extent = get_density(time, trajectories[:, :, j + 1])
+        ax.imshow(
+            density,
+            origin="lower",
+            aspect="auto",
+            extent=extent,
+            cmap="Greys",
+            interpolation="nearest",
+        )
+        ax.plot(time, mean[:, j], color="tab:red", label="mean")
+        ax.plot(time, lower[:, j], color="tab:red", linestyle="--", label=band_label)
+        ax.plot(time, upper[:, j], color="tab:red", linestyle="--")
+        ax.set_title(names[j])
+        if j == 0:
+            ax.legend(loc="upper right")
+    fig.suptitle(title or f"Density of {n_trajectories} trajectories")
+    fig.tight_layout()
+    return render_png(fig)
+
+
+@functools.lru_cache(maxsize=1)
+def get_placeholder_png():
+    """
+    Returns the PNG bytes shown instead of the plot if plotting is disabled.
+    """
+    fig = Figure(figsize=(3.2, 1.2), dpi=DPI)
+    fig.text(0.5, 0.5, "Plotting disabled", ha="center", va="center")
+    return render_png(fig).getvalue()
@@ -5,43 +5,70 @@ Contains definitions of custom node port objects:
 - Deep Abstraction model
 """
 import knime.extension as knext
+import lzma
+import os
 import pickle
+import zlib
 
+# Port object payloads start with the magic bytes and the name of the codec, padded to CODEC_NAME_LENGTH bytes.
+# Payloads without the magic bytes are plain pickles, as written by earlier versions of the extension.
+PAYLOAD_MAGIC = b"DAPO"
+CODEC_NAME_LENGTH = 8
 
-########## CRN DEFINITION ##########
-class CrnDefinitionSpec(knext.PortObjectSpec):
-    def __init__(self, spec_data: str) -> None:
-        self._spec_data = spec_data
+CODECS = {
+    "none": (lambda payload: payload, lambda payload: payload),
+    "zlib": (lambda payload: zlib.compress(payload, 1), zlib.decompress),
+    "lzma": (lambda payload: lzma.compress(payload, preset=1), lzma.decompress),
+}
+DEFAULT_CODEC = os.environ.get("DEEP_ABSTRACTIONS_PORT_CODEC", "zlib")
 
-    def serialize(self) -> dict:
-        return {"spec_data": self._spec_data}
 
-    @classmethod
-    def deserialize(cls, data: dict) -> "CrnDefinitionSpec":
-        return cls(data["spec_data"])
+def encode_payload(data, codec=DEFAULT_CODEC):
+    compress, _ = CODECS[codec]
+    payload = compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    return PAYLOAD_MAGIC + codec.encode().ljust(CODEC_NAME_LENGTH) + payload
 
-    @property
-    def spec_data(self):
-        return self._spec_data
 
+def decode_payload(payload):
+    if not payload.startswith(PAYLOAD_MAGIC):
+        return pickle.loads(payload)
 
-class CrnDefinitionPortObject(knext.PortObject):
-    def __init__(self, spec: CrnDefinitionSpec, data) -> None:
+    header_length = len(PAYLOAD_MAGIC) + CODEC_NAME_LENGTH
+    codec = payload[len(PAYLOAD_MAGIC) : header_length].decode().strip()
+    _, decompress = CODECS[codec]
+    return pickle.loads(decompress(payload[header_length:]))
+
+
+class LazyPortObject(knext.PortObject):
+    """
+    Port object whose data is compressed when it is serialized, and only deserialized on the first access
+    of `data`, so that the spec is available immediately when a workflow is loaded. Data that is never
+    accessed is written back unchanged.
+    """
+
+    def __init__(self, spec, data, codec=DEFAULT_CODEC) -> None:
         super().__init__(spec)
         self._data = data
         self._spec = spec
+        self._codec = codec
+        self._payload = None
 
     def serialize(self):
-        return pickle.dumps(self._data)
+        if self._payload is not None:
+            return self._payload
+        return encode_payload(self._data, self._codec)
 
     @classmethod
-    def deserialize(
-        cls, spec: CrnDefinitionSpec, data: bytes
-    ) -> "CrnDefinitionPortObject":
-        return cls(spec, pickle.loads(data))
+    def deserialize(cls, spec, data: bytes):
+        port_object = cls(spec, None)
+        port_object._payload = data
+        return port_object
 
     @property
     def data(self):
+        if self._payload is not None:
+            self._data = decode_payload(self._payload)
+            self._payload = None
         return self._data
 
     @property
@@ -49,6 +76,28 @@ class CrnDefinitionPortObject(knext.PortObject):
         return self._spec
 
 
+########## CRN DEFINITION ##########
+class CrnDefinitionSpec(knext.PortObjectSpec):
+    def __init__(self, spec_data: str) -> None:
+        self._spec_data = spec_data
+
+    def serialize(self) -> dict:
+        return {"spec_data": self._spec_data}
+
+    @classmethod
+    def deserialize(cls, data: dict) -> "CrnDefinitionSpec":
+        return cls(data["spec_data"])
+
+    @property
+    def spec_data(self):
+        return self._spec_data
+
+
+class CrnDefinitionPortObject(LazyPortObject):
+    def __init__(self, spec: CrnDefinitionSpec, data, codec=DEFAULT_CODEC) -> None:
+        super().__init__(spec, data, codec)
+
+
 crn_definition_port_type = knext.port_type(
     name="CRN Definition",
     object_class=CrnDefinitionPortObject,
@@ -73,28 +122,9 @@ class SimulationDataSpec(knext.PortObjectSpec):
         return self._spec_data
 
 
-class SimulationDataPortObject(knext.PortObject):
-    def __init__(self, spec: SimulationDataSpec, data) -> None:
-        super().__init__(spec)
-        self._data = data
-        self._spec = spec
-
-    def serialize(self):
-        return pickle.dumps(self._data)
-
-    @classmethod
-    def deserialize(
-        cls, spec: SimulationDataSpec, data: bytes
-    ) -> "SimulationDataPortObject":
-        return cls(spec, pickle.loads(data))
-
-    @property
-    def data(self):
-        return self._data
-
-    @property
-    def spec(self):
-        return self._spec
+class SimulationDataPortObject(LazyPortObject):
+    def __init__(self, spec: SimulationDataSpec, data, codec=DEFAULT_CODEC) -> None:
+        super().__init__(spec, data, codec)
 
 
 simulation_data_port_type = knext.port_type(
@@ -120,29 +150,20 @@ class DeepAbstractionModelSpec(knext.PortObjectSpec):
     def spec_data(self):
         return self._spec_data
 
-
-class DeepAbstractionModelPortObject(knext.PortObject):
-    def __init__(self, spec: DeepAbstractionModelSpec, data) -> None:
-        super().__init__(spec)
-        self._data = data
-        self._spec = spec
-
-    def serialize(self):
-        return pickle.dumps(self._data)
-
-    @classmethod
-    def deserialize(
-        cls, spec: DeepAbstractionModelSpec, data: bytes
-    ) -> "DeepAbstractionModelPortObject":
-        return cls(spec, pickle.loads(data))
-
-    @property
-    def data(self):
-        return self._data
-
     @property
-    def spec(self):
-        return self._spec
+    def model_configuration(self):
+        """
+        The arguments required to reconstruct the model, see `MdnManager.from_configuration`.
+        Models created before the configuration was recorded are only conditioned on the species.
+        """
+        if "model_configuration" in self._spec_data:
+            return self._spec_data["model_configuration"]
+        return {"n_species": len(self._spec_data["species"])}
+
+
+class DeepAbstractionModelPortObject(LazyPortObject):
+    def __init__(self, spec: DeepAbstractionModelSpec, data, codec=DEFAULT_CODEC) -> None:
+        super().__init__(spec, data, codec)
 
 
 deep_abstraction_model_port_type = knext.port_type(
@@ -0,0 +1,113 @@
+"""
+Opt-in profiling of node executions.
+
+Every node has an advanced profiling option (see `profiling_parameter`). If it is set, `profile_execute` runs the
+node's `execute` under cProfile and writes the statistics, sorted by cumulative time, to the given file. Nodes that
+train or simulate deep abstract models additionally record a `torch.profiler` trace of the first training or
+simulation steps, which can be opened in chrome://tracing or Perfetto.
+
+If the option is not set, `execute` is called directly and no profiler is created.
+"""
+import cProfile
+import functools
+import io
+import logging
+import pstats
+
+LOGGER = logging.getLogger(__name__)
+
+# the number of lines of the sorted statistics written to the text file
+N_STATS_LINES = 100
+
+
+def profiling_parameter():
+    """
+    Returns the profiling option of a node, which is created per node class.
+    """
+    # imported here, since the torch trace is also used outside of KNIME (e.g. by the inference server)
+    import knime.extension as knext
+
+    return knext.StringParameter(
+        label="Profiling output file",
+        description="""
+        If set, the execution of the node is profiled with cProfile, and the statistics are written to this file,
+        sorted by cumulative time. The raw statistics are written next to it with the `.prof` suffix, e.g. for snakeviz.
+        Nodes that train or simulate deep abstract models also write a PyTorch profiler trace with the `.trace.json` suffix.
+        Leave empty to disable profiling.""",
+        default_value="",
+        is_advanced=True,
+    )
+
+
+def trace_steps_parameter():
+    import knime.extension as knext
+
+    return knext.IntParameter(
+        label="Profiled PyTorch steps",
+        description="The number of training or simulation steps recorded in the PyTorch profiler trace.",
+        default_value=10,
+        min_value=1,
+        is_advanced=True,
+    )
+
+
+def get_trace_path(profile_path):
+    return f"{profile_path}.trace.json"
+
+
+def profile_execute(execute):
+    """
+    Decorates the `execute` method of a node, which has a `profile_path` parameter.
+    """
+
+    @functools.wraps(execute)
+    def wrapper(self, exec_context, *inputs):
+        profile_path = self.profile_path.strip()
+        if not profile_path:
+            return execute(self, exec_context, *inputs)
+
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(execute, self, exec_context, *inputs)
+        finally:
+            profiler.dump_stats(f"{profile_path}.prof")
+            stats_text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stats_text)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(N_STATS_LINES)
+            with open(profile_path, "w") as f:
+                f.write(stats_text.getvalue())
+            LOGGER.info(f"Profiling statistics written to {profile_path}.")
+
+    return wrapper
+
+
+class TorchTrace:
+    """
+    Records the first `n_steps` steps (after one warm-up step) with `torch.profiler`, and exports them as a Chrome trace.
+    Use as a context manager, and call `step` after every training or simulation step.
+    """
+
+    def __init__(self, trace_path, n_steps):
+        import torch.profiler
+
+        self.trace_path = trace_path
+        self.profiler = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            schedule=torch.profiler.schedule(wait=0, warmup=1, active=n_steps, repeat=1),
+            on_trace_ready=self.export,
+            record_shapes=True,
+        )
+
+    def export(self, profiler):
+        profiler.export_chrome_trace(self.trace_path)
+        LOGGER.info(f"PyTorch profiler trace written to {self.trace_path}.")
+
+    def step(self):
+        self.profiler.step()
+
+    def __enter__(self):
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,237 @@
+"""
+Sparse representation of the structure of a CRN.
+
+Large CRNs have hundreds of species and reactions, but every reaction only changes and depends on a few species.
+The network is therefore stored as sparse CSR matrices:
+- the stoichiometry of shape (n_reactions, n_species), whose row r is the state change caused by reaction r,
+- the propensity dependencies of shape (n_reactions, n_species), whose row r marks the species the propensity
+  of reaction r depends on,
+- the dependency graph of shape (n_reactions, n_reactions), whose row r marks the reactions whose propensities
+  change when reaction r fires, i.e. the only propensities a simulation algorithm needs to update,
+- the reactant orders of shape (n_reactions, n_species), whose row r holds the exponents of the species in the
+  propensity of reaction r under mass-action kinetics.
+
+`simulate_direct` uses them for Gillespie's direct method, which updates only the propensities of the reactions
+affected by the reaction that fired.
+
+The structure is parsed from the SBML of the CRN using libsbml. If libsbml is not available, it is derived from
+the stoichiometry matrix of RoadRunner, assuming that every propensity depends on the reactants of its reaction
+(as for mass-action kinetics).
+"""
+import numpy as np
+from scipy import sparse
+
+try:
+    import libsbml
+except ImportError:
+    libsbml = None
+
+
+def get_ast_names(node):
+    """
+    Returns the names of all variables in the math AST of an SBML kinetic law.
+    """
+    names = set()
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if node is None:
+            continue
+        if node.isName():
+            names.add(node.getName())
+        nodes.extend(node.getChild(i) for i in range(node.getNumChildren()))
+    return names
+
+
+class ReactionNetwork:
+    def __init__(
+        self,
+        species,
+        parameters,
+        reactions,
+        stoichiometry,
+        dependencies,
+        reactant_orders=None,
+    ):
+        """
+        If the `reactant_orders` are not given, they are the consumed amounts of the stoichiometry.
+        """
+        self.species = list(species)
+        self.parameters = list(parameters)
+        self.reactions = list(reactions)
+        if reactant_orders is None:
+            reactant_orders = -sparse.csr_matrix(stoichiometry).minimum(0)
+        self.reactant_orders = sparse.csr_matrix(reactant_orders, dtype=float)
+        self.reactant_orders.eliminate_zeros()
+        self.stoichiometry = sparse.csr_matrix(stoichiometry)
+        # species that are both consumed and produced by a reaction are not changed by it
+        self.stoichiometry.eliminate_zeros()
+        self.dependencies = sparse.csr_matrix(dependencies, dtype=bool)
+
+        # reaction r affects reaction s if r changes a species the propensity of s depends on
+        changes = (self.stoichiometry != 0).astype(np.int32)
+        self.dependency_graph = sparse.csr_matrix(
+            changes @ self.dependencies.astype(np.int32).T, dtype=bool
+        )
+
+    @property
+    def n_species(self):
+        return len(self.species)
+
+    @property
+    def n_reactions(self):
+        return len(self.reactions)
+
+    @classmethod
+    def from_roadrunner(cls, model):
+        """
+        Builds the network of a loaded RoadRunner model.
+        """
+        species = list(model.getFloatingSpeciesIds())
+        parameters = list(model.getGlobalParameterIds())
+        if libsbml is not None:
+            return cls.from_sbml(model.getSBML(), species, parameters)
+
+        matrix = model.getFullStoichiometryMatrix()
+        row_indices = [list(matrix.rownames).index(name) for name in species]
+        stoichiometry = np.asarray(matrix)[row_indices].T
+        reactions = list(matrix.colnames)
+        return cls(
+            species, parameters, reactions, stoichiometry, stoichiometry < 0
+        )
+
+    @classmethod
+    def from_sbml(cls, sbml, species=None, parameters=None):
+        """
+        Parses the network from an SBML string. The order of the species (e.g. the one RoadRunner uses) can be given,
+        otherwise all non-boundary species are used in the order of the SBML. Other species are treated as constant.
+        """
+        if libsbml is None:
+            raise ImportError("Parsing SBML requires libsbml.")
+
+        model = libsbml.readSBMLFromString(sbml).getModel()
+        if species is None:
+            species = [
+                s.getId() for s in model.getListOfSpecies() if not s.getBoundaryCondition()
+            ]
+        if parameters is None:
+            parameters = [p.getId() for p in model.getListOfParameters()]
+        species_indices = {name: i for i, name in enumerate(species)}
+
+        reactions = []
+        stoichiometry = ([], [], [])
+        reactant_orders = ([], [], [])
+        dependencies = ([], [])
+        for r, reaction in enumerate(model.getListOfReactions()):
+            reactions.append(reaction.getId())
+            for references, sign in (
+                (reaction.getListOfReactants(), -1.0),
+                (reaction.getListOfProducts(), 1.0),
+            ):
+                for reference in references:
+                    if reference.getSpecies() in species_indices:
+                        stoichiometry[0].append(sign * reference.getStoichiometry())
+                        stoichiometry[1].append(r)
+                        stoichiometry[2].append(species_indices[reference.getSpecies()])
+                        if sign < 0:
+                            reactant_orders[0].append(reference.getStoichiometry())
+                            reactant_orders[1].append(r)
+                            reactant_orders[2].append(species_indices[reference.getSpecies()])
+
+            kinetic_law = reaction.getKineticLaw()
+            names = set()
+            if kinetic_law is not None:
+                names = get_ast_names(kinetic_law.getMath())
+            for name in names & species_indices.keys():
+                dependencies[0].append(r)
+                dependencies[1].append(species_indices[name])
+
+        shape = (len(reactions), len(species))
+        # duplicate entries (a species on both sides of a reaction) are summed
+        stoichiometry = sparse.coo_matrix(
+            (stoichiometry[0], (stoichiometry[1], stoichiometry[2])), shape=shape
+        )
+        reactant_orders = sparse.coo_matrix(
+            (reactant_orders[0], (reactant_orders[1], reactant_orders[2])), shape=shape
+        )
+        dependencies = sparse.coo_matrix(
+            (np.ones(len(dependencies[0]), dtype=bool), dependencies), shape=shape
+        )
+        return cls(
+            species, parameters, reactions, stoichiometry, dependencies, reactant_orders
+        )
+
+    def get_state_change(self, reaction):
+        """
+        Returns the indices of the species changed by the reaction, and the changes.
+        """
+        start, stop = self.stoichiometry.indptr[reaction : reaction + 2]
+        return self.stoichiometry.indices[start:stop], self.stoichiometry.data[start:stop]
+
+    def get_affected_reactions(self, reaction):
+        """
+        Returns the indices of the reactions whose propensities change when the reaction fires.
+        """
+        start, stop = self.dependency_graph.indptr[reaction : reaction + 2]
+        return self.dependency_graph.indices[start:stop]
+
+    def get_propensities(self, state, rate_constants, reactions=None):
+        """
+        Returns the mass-action propensities k_r * prod_i x_i^o_ri of the given reactions (by default all).
+        """
+        if reactions is None:
+            reactions = range(self.n_reactions)
+        indptr, indices, orders = (
+            self.reactant_orders.indptr,
+            self.reactant_orders.indices,
+            self.reactant_orders.data,
+        )
+        propensities = np.empty(len(reactions))
+        for j, r in enumerate(reactions):
+            start, stop = indptr[r], indptr[r + 1]
+            propensities[j] = rate_constants[r] * np.prod(
+                state[indices[start:stop]] ** orders[start:stop]
+            )
+        return propensities
+
+    def simulate_direct(self, state, rate_constants, times, rng):
+        """
+        Simulates a trajectory from the species values `state` with Gillespie's direct method, assuming
+        mass-action kinetics with the given rate constants. After every reaction, only the propensities of
+        the reactions in its row of the dependency graph are recomputed.
+
+        Returns: a numpy array of shape (len(times), n_species + 1) of the state at each of the (sorted) times
+        """
+        state = np.array(state, dtype=float)
+        rate_constants = np.asarray(rate_constants, dtype=float)
+        propensities = self.get_propensities(state, rate_constants)
+        trajectory = np.empty((len(times), self.n_species + 1))
+        trajectory[:, 0] = times
+
+        current_time = times[0]
+        i = 0
+        while i < len(times):
+            total = propensities.sum()
+            next_time = np.inf
+            if total > 0:
+                next_time = current_time + rng.exponential(1 / total)
+            # the state is constant until the next reaction fires
+            while i < len(times) and times[i] < next_time:
+                trajectory[i, 1:] = state
+                i += 1
+            if i == len(times):
+                break
+
+            reaction = np.searchsorted(
+                np.cumsum(propensities), rng.random() * total, side="right"
+            )
+            reaction = min(reaction, self.n_reactions - 1)
+            indices, changes = self.get_state_change(reaction)
+            state[indices] += changes
+            affected = self.get_affected_reactions(reaction)
+            propensities[affected] = self.get_propensities(
+                state, rate_constants, affected
+            )
+            current_time = next_time
+
+        return trajectory
@@ -0,0 +1,91 @@
+"""
+Vectorised samplers used to perturb initial conditions and reaction rates.
+
+All samplers first draw a design in the unit hypercube, which is then scaled to the perturbation ranges.
+Space-filling designs (Latin hypercube, Sobol) cover the input space more evenly than independent
+uniform sampling, so fewer initial conditions are needed to train an equally accurate model.
+"""
+import numpy as np
+from scipy.stats import qmc
+
+SAMPLING_METHODS = ("uniform", "lhs", "sobol")
+
+
+def sample_unit_hypercube(n_samples, n_dims, method="uniform", seed=None):
+    """
+    Returns an array of shape (n_samples, n_dims) with values in [0, 1).
+    """
+    if n_dims == 0:
+        return np.zeros((n_samples, 0))
+
+    if method == "uniform":
+        if seed is None:
+            return np.random.random_sample((n_samples, n_dims))
+        return np.random.default_rng(seed).random((n_samples, n_dims))
+    elif method == "lhs":
+        return qmc.LatinHypercube(d=n_dims, seed=seed).random(n_samples)
+    elif method == "sobol":
+        # scrambled Sobol sequences are only balanced for powers of 2, so the
+        # surplus points are drawn and discarded
+        n_power = int(np.ceil(np.log2(max(n_samples, 1))))
+        return qmc.Sobol(d=n_dims, scramble=True, seed=seed).random_base2(n_power)[
+            :n_samples
+        ]
+
+    raise ValueError(
+        f"Unknown sampling method '{method}', expected one of {SAMPLING_METHODS}."
+    )
+
+
+def randomize_initial_conditions(
+    species_values,
+    n_conditions,
+    range_percentage=0.1,
+    zero_perturb_prob=0.5,
+    zero_perturb_range=(0, 10),
+    method="uniform",
+    seed=None,
+):
+    """
+    Non-zero species are perturbed within +/- `range_percentage` of their value. Zero species are
+    perturbed within `zero_perturb_range` with probability `zero_perturb_prob`, and left at zero otherwise.
+    Both cases use a single dimension of the design, so zero species are covered evenly as well.
+    """
+    species_values = np.asarray(species_values, dtype=float)
+    u = sample_unit_hypercube(n_conditions, len(species_values), method, seed)
+
+    lower = species_values * (1 - range_percentage)
+    upper = species_values * (1 + range_percentage)
+    perturbed = lower + u * (upper - lower)
+
+    # zero species: the lower (1 - p) part of the unit interval maps to zero,
+    # the upper p part is stretched over the zero perturbation range
+    if zero_perturb_prob > 0:
+        zero_u = np.clip((u - (1 - zero_perturb_prob)) / zero_perturb_prob, 0, None)
+        zero_lower, zero_upper = zero_perturb_range
+        zero_perturbed = np.where(
+            zero_u > 0, zero_lower + zero_u * (zero_upper - zero_lower), 0.0
+        )
+    else:
+        zero_perturbed = np.zeros_like(u)
+
+    return np.round(np.where(species_values == 0, zero_perturbed, perturbed))
+
+
+def randomize_reaction_rates(
+    parameter_values,
+    n_conditions,
+    range_percentage=0.1,
+    method="uniform",
+    seed=None,
+):
+    """
+    All reaction rates are jointly perturbed within +/- `range_percentage` of their value.
+    """
+    parameter_values = np.asarray(parameter_values, dtype=float)
+    u = sample_unit_hypercube(n_conditions, len(parameter_values), method, seed)
+
+    lower = parameter_values * (1 - range_percentage)
+    upper = parameter_values * (1 + range_percentage)
+
+    return lower + u * (upper - lower)
@@ -1,8 +1,11 @@
 import tellurium as te
 import numpy as np
-import io
 import random
-import matplotlib.pyplot as plt
+
+from utils.plotting import plot_ensemble
+from utils.reaction_network import ReactionNetwork
+from utils.trajectory_encoding import CompactTrajectories
+from utils.sampling import randomize_initial_conditions, randomize_reaction_rates
 
 
 class SimulationManager:
@@ -13,9 +16,12 @@ class SimulationManager:
             self.model = te.loada(path_to_sbml)
 
         self.model.integrator = "gillespie"
+        # see enable_sparse_ssa
+        self.reaction_network = None
 
     def load_model(self, model):
         self.model = model
+        self.reaction_network = None
 
     def set_model_parameters(
         self,
@@ -31,6 +37,10 @@ class SimulationManager:
         self.start_time = start_time
         self.end_time = end_time
         self.n_steps = n_steps
+        # draws the seeds of the replicas that branch from a burn-in snapshot
+        self.replica_rng = np.random.default_rng(
+            random_seed if random_seed != 0 else None
+        )
 
         if random_seed != 0:
             self.model.integrator.seed = random_seed
@@ -58,17 +68,96 @@ class SimulationManager:
     def get_num_parameters(self):
         return len(self.get_parameter_names())
 
-    def assign_custom_values_to_model(self, names: list, values: list):
-        for prop_name, prop_value in zip(names, values):
-            self.model[prop_name] = prop_value
+    def get_reaction_network(self):
+        return ReactionNetwork.from_roadrunner(self.model)
+
+    def get_rate_constants(self):
+        """
+        Returns the mass-action rate constants of the reactions (in the order of the reaction network), i.e. their
+        rates at unit concentrations of all species with the current parameter values.
+        """
+        state = self.model.getFloatingSpeciesConcentrations()
+        self.set_species_values(np.ones(len(state)))
+        rates = np.asarray(self.model.getReactionRates())[self.reaction_order]
+        self.set_species_values(state)
+        return rates
+
+    def enable_sparse_ssa(self, random_seed=0):
+        """
+        Simulates with the direct method of the sparse reaction network instead of RoadRunner's Gillespie integrator,
+        which only recomputes the propensities affected by every reaction. Raises a ValueError if the CRN does not
+        follow mass-action kinetics in compartments of unit volume, which the direct method assumes.
+        """
+        network = self.get_reaction_network()
+        reaction_ids = list(self.model.getReactionIds())
+        self.reaction_order = [reaction_ids.index(name) for name in network.reactions]
+
+        if not np.allclose(self.model.model.getCompartmentVolumes(), 1.0):
+            raise ValueError("The sparse SSA requires compartments of unit volume.")
+
+        self.model.reset()
+        state = np.linspace(2.0, 3.0, network.n_species)
+        rate_constants = self.get_rate_constants()
+        self.set_species_values(state)
+        rates = np.asarray(self.model.getReactionRates())[self.reaction_order]
+        self.model.reset()
+        if not np.allclose(network.get_propensities(state, rate_constants), rates):
+            raise ValueError(
+                "The sparse SSA requires mass-action kinetics, which the rate laws of the CRN do not follow."
+            )
+
+        self.reaction_network = network
+        self.sparse_rng = np.random.default_rng(random_seed if random_seed != 0 else None)
+
+    def simulate_replica(self, start_time, end_time, n_points):
+        """
+        Simulates the CRN from its current state, with RoadRunner or the sparse SSA (see `enable_sparse_ssa`).
+        The sparse SSA writes the final state back to RoadRunner, so that a following simulation continues it.
+
+        Returns: an array of shape (n_points, n_species + 1)
+        """
+        if self.reaction_network is None:
+            return self.model.simulate(start_time, end_time, n_points)
+
+        trajectory = self.reaction_network.simulate_direct(
+            self.model.getFloatingSpeciesConcentrations(),
+            self.get_rate_constants(),
+            np.linspace(start_time, end_time, n_points),
+            self.sparse_rng,
+        )
+        self.set_species_values(trajectory[-1, 1:])
+        return trajectory
+
+    def set_species_values(self, values):
+        """
+        Assigns the concentrations of all floating species (in the order of `get_species_names`) at once.
+        """
+        self.model.model.setFloatingSpeciesConcentrations(np.asarray(values, dtype=float))
+
+    def set_parameter_values(self, values):
+        """
+        Assigns the values of all global parameters (in the order of `get_parameter_names`) at once.
+        """
+        self.model.model.setGlobalParameterValues(np.asarray(values, dtype=float))
 
     def concatenate_arrays(self, arrays):
         return np.hstack(arrays)
 
-    def add_time_column(self, arr):
+    @staticmethod
+    def add_time_column(arr):
         zeros = np.zeros((arr.shape[0], 1))
         return np.hstack((zeros, arr))
 
+    @staticmethod
+    def get_strided_dataset(data, stride):
+        """
+        Returns a view of the dataset containing every `stride`-th time point, i.e. the dataset
+        recorded at a `stride` times coarser step size, without copying or re-simulating.
+        """
+        if isinstance(data, CompactTrajectories):
+            return data.strided(stride)
+        return data[:, ::stride, :]
+
     def extract_initial_conditions_from_dataset(self, data, n_init_conditions):
         n_sims_per_init_condition = data.shape[0] // n_init_conditions
         return data[::n_sims_per_init_condition, 0, 1:]  # excluding time
@@ -88,124 +177,81 @@ class SimulationManager:
         zero_perturb_range=(0, 10),
         n_conditions=None,
         set_to_zero=True,
+        sampling_method="uniform",
     ):
         if n_conditions is None:
             n_conditions = self.n_init_conditions
 
         species_values = self.get_original_species_values()
-        n_species = len(species_values)
 
         if set_to_zero:
-            species_values = np.zeros((n_species))
-
-        randomized_conditions = np.zeros((n_conditions, n_species))
-
-        for i, concentration in enumerate(species_values):
-            if concentration == 0:
-                perturb_zero = np.random.choice(
-                    [True, False],
-                    size=n_conditions,
-                    p=[zero_perturb_prob, 1 - zero_perturb_prob],
-                )
-                randomized_conditions[perturb_zero, i] = np.round(
-                    np.random.uniform(*zero_perturb_range, np.sum(perturb_zero))
-                )
-            else:
-                lower_bound = concentration * (1 - range_percentage)
-                upper_bound = concentration * (1 + range_percentage)
-
-                randomized_conditions[:, i] = np.round(
-                    np.random.uniform(lower_bound, upper_bound, n_conditions)
-                )
-
-        return randomized_conditions
+            species_values = np.zeros((len(species_values)))
+
+        return randomize_initial_conditions(
+            species_values,
+            n_conditions,
+            range_percentage=range_percentage,
+            zero_perturb_prob=zero_perturb_prob,
+            zero_perturb_range=zero_perturb_range,
+            method=sampling_method,
+        )
 
-    def get_randomized_reaction_rates(self, range_percentage=0.1, n_conditions=None):
+    def get_randomized_reaction_rates(
+        self, range_percentage=0.1, n_conditions=None, sampling_method="uniform"
+    ):
         if n_conditions is None:
             n_conditions = self.n_init_conditions
 
-        parameter_values = self.get_original_parameter_values()
-
-        n_parameters = len(parameter_values)
-        randomized_parameters = np.tile(parameter_values, (n_conditions, 1))
-
-        # Determine number of times each parameter should be randomized
-        n_times_each_param = n_conditions // n_parameters
-
-        for i, parameter in enumerate(parameter_values):
-            for j in range(n_times_each_param):
-                # Calculate perturbation range
-                lower_bound = parameter * (1 - range_percentage)
-                upper_bound = parameter * (1 + range_percentage)
-
-                # Randomly sample within the range for each initial condition
-                randomized_parameters[i + j * n_parameters, i] = np.random.uniform(
-                    lower_bound, upper_bound
-                )
-
-        return randomized_parameters
+        return randomize_reaction_rates(
+            self.get_original_parameter_values(),
+            n_conditions,
+            range_percentage=range_percentage,
+            method=sampling_method,
+        )
 
     def simulate_and_plot(self, exec_context):
         """
         Used to enable rapid exploration of the CRN. Generates trajectories for a single initial condition,
-        and provides a plot of the mean trajectories.
+        and provides a plot of their mean and quantiles.
         """
         species_names = self.get_species_names()
-        col_names = ["time"] + species_names
-        selections = [
-            "time"
-        ] + species_names  # currently same as col_names, but should allow selecting specific species
-
-        n_cols = len(col_names)
-        s_sum = np.zeros(shape=[self.n_steps, n_cols])
-        stacked_sum = np.zeros(
-            shape=[self.n_sims_per_init_condition, self.n_steps, n_cols]
-        )
+        selections = ["time"] + species_names
 
         init_condition = self.get_randomized_initial_conditions(
             zero_perturb_prob=1.0, n_conditions=1
-        )
-        print("Initial condition:", init_condition)
-        self.model.reset()
-        self.assign_custom_values_to_model(species_names, init_condition)
-
-        progress = 0
-        progress_step = 100 / self.n_sims_per_init_condition / 100
+        )[0]
 
+        trajectories = np.zeros(
+            shape=[self.n_sims_per_init_condition, self.n_steps + 1, len(selections)]
+        )
+        progress_step = 1 / self.n_sims_per_init_condition
         for i in range(self.n_sims_per_init_condition):
-            exec_context.set_progress(progress)
-            # self.model.reset()
-            # self.assign_custom_values_to_model(species_names, init_condition)
-
-            s = self.model.simulate(
-                self.start_time, self.end_time, self.n_steps + 1, selections=selections
+            exec_context.set_progress(i * progress_step)
+            self.reset_to_condition(init_condition)
+            trajectories[i] = self.simulate_replica(
+                self.start_time, self.end_time, self.n_steps + 1
             )
-            print(s)
-            s_sum += s
-            stacked_sum[i] = s
-            progress += progress_step
-            self.model.plot(s, alpha=0.5, show=False)
-
-        te.plot(
-            s[:, 0],
-            s_sum[:, 1:] / self.n_sims_per_init_condition,
-            names=[x + " (mean)" for x in selections[1:]],
-            title="Stochastic simulation",
-            xtitle="time",
-            ytitle="concentration",
-        )
-        te.show()
-
-        fig = plt.gcf()
-        png_bytes = io.BytesIO()
-        fig.savefig(png_bytes, format="png")
 
-        return stacked_sum, png_bytes
+        return trajectories, plot_ensemble(
+            trajectories, selections, title="Stochastic simulation"
+        )
 
     def simulate(
-        self, randomized_init_conditions, exec_context, randomized_reaction_rates=None
+        self,
+        randomized_init_conditions,
+        exec_context,
+        randomized_reaction_rates=None,
+        burn_in_time=0.0,
+        decorrelation_time=None,
     ):
         """
+        If `burn_in_time` is positive, the recorded trajectories start after a burn-in period, e.g. to study
+        the stationary behaviour of the CRN. The burn-in is simulated only once per initial condition, and every
+        replica branches from a snapshot of the final state with its own seed.
+
+        If `decorrelation_time` is given, the replicas are instead consecutive segments of a single long run after
+        the burn-in, separated by `decorrelation_time` (rounded to a multiple of the step size, at least one step).
+
         Returns: a numpy array of generated trajectories of shape
         (n_init_conditions * n_sims_per_init_condition, n_steps, n_variables)
         """
@@ -222,22 +268,33 @@ class SimulationManager:
                 f"Performing stochastic simulation for initial condition {i + 1} / {self.n_init_conditions}."
             )
             exec_context.set_progress(progress)
-            for j in range(self.n_sims_per_init_condition):
-                self.model.reset()
-
-                init_condition = randomized_init_conditions[i]
-                species_names = self.get_species_names()
-                self.assign_custom_values_to_model(species_names, init_condition)
-
-                if randomized_reaction_rates is not None:
-                    reaction_rates = randomized_reaction_rates[i]
-                    parameter_names = self.get_parameter_names()
-                    self.assign_custom_values_to_model(parameter_names, reaction_rates)
 
-                trajectory = self.model.simulate(0.0, self.end_time, self.n_steps + 1)
+            reaction_rates = None
+            if randomized_reaction_rates is not None:
+                reaction_rates = randomized_reaction_rates[i]
 
+            if decorrelation_time is not None:
+                trajectories = self.simulate_long_run(
+                    randomized_init_conditions[i],
+                    reaction_rates,
+                    burn_in_time,
+                    decorrelation_time,
+                )
+            elif burn_in_time > 0:
+                trajectories = self.simulate_from_snapshot(
+                    randomized_init_conditions[i], reaction_rates, burn_in_time
+                )
+            else:
+                trajectories = []
+                for j in range(self.n_sims_per_init_condition):
+                    self.reset_to_condition(randomized_init_conditions[i], reaction_rates)
+                    trajectories.append(
+                        self.simulate_replica(0.0, self.end_time, self.n_steps + 1)
+                    )
+
+            for trajectory in trajectories:
                 # append the randomized reaction rates to the trajectory (if initially provided)
-                if randomized_reaction_rates is not None:
+                if reaction_rates is not None:
                     for param_value in reaction_rates:
                         param_column = np.full((trajectory.shape[0], 1), param_value)
                         trajectory = np.hstack((trajectory, param_column))
@@ -248,14 +305,91 @@ class SimulationManager:
 
         return np.concatenate([np.expand_dims(a, axis=0) for a in results], axis=0)
 
+    def reset_to_condition(self, init_condition, reaction_rates=None):
+        self.model.reset()
+        self.set_species_values(init_condition)
+        if reaction_rates is not None:
+            self.set_parameter_values(reaction_rates)
+
+    def simulate_from_snapshot(self, init_condition, reaction_rates, burn_in_time):
+        """
+        Simulates the burn-in once, and every replica from a snapshot of the RoadRunner state after it.
+        The returned trajectories start at time 0.
+        """
+        self.reset_to_condition(init_condition, reaction_rates)
+        self.simulate_replica(0.0, burn_in_time, 2)
+        snapshot = self.model.saveStateS()
+
+        trajectories = []
+        seeds = self.replica_rng.integers(
+            1, 2**31 - 1, size=self.n_sims_per_init_condition
+        )
+        for j, seed in enumerate(seeds):
+            if j > 0:
+                self.model.loadStateS(snapshot)
+            self.model.integrator.seed = int(seed)
+            trajectories.append(
+                self.simulate_replica(0.0, self.end_time, self.n_steps + 1)
+            )
+        return trajectories
+
+    def simulate_long_run(
+        self, init_condition, reaction_rates, burn_in_time, decorrelation_time
+    ):
+        """
+        Simulates a single long run after the burn-in, and cuts it into `n_sims_per_init_condition` segments
+        of `n_steps` steps, separated by `decorrelation_time`, but at least one step, so that consecutive segments
+        do not share their boundary point. The returned trajectories start at time 0.
+        """
+        step_size = self.end_time / self.n_steps
+        n_gap_steps = max(int(round(decorrelation_time / step_size)), 1)
+        n_segment_steps = self.n_steps + n_gap_steps
+        n_total_steps = (self.n_sims_per_init_condition - 1) * n_segment_steps + self.n_steps
+
+        self.reset_to_condition(init_condition, reaction_rates)
+        if burn_in_time > 0:
+            self.simulate_replica(0.0, burn_in_time, 2)
+        run = np.array(
+            self.simulate_replica(0.0, n_total_steps * step_size, n_total_steps + 1)
+        )
+
+        trajectories = []
+        for j in range(self.n_sims_per_init_condition):
+            start = j * n_segment_steps
+            trajectory = run[start : start + self.n_steps + 1].copy()
+            trajectory[:, 0] = run[: self.n_steps + 1, 0]
+            trajectories.append(trajectory)
+        return trajectories
+
+    def simulate_from_states(self, states, time_step, n_steps, reaction_rates=None):
+        """
+        Simulates one trajectory from each of the given states of shape (n_states, n_species + 1), whose first
+        column is the time to start at. If given, `reaction_rates` of shape (n_states, n_parameters) are assigned
+        to the CRN before every simulation.
+
+        Returns: a numpy array of trajectories of shape (n_states, n_steps + 1, n_species + 1)
+        """
+        trajectories = np.empty((len(states), n_steps + 1, states.shape[1]))
+        for i, state in enumerate(states):
+            self.reset_to_condition(
+                state[1:], None if reaction_rates is None else reaction_rates[i]
+            )
+            trajectories[i] = self.simulate_replica(
+                state[0], state[0] + n_steps * time_step, n_steps + 1
+            )
+        return trajectories
+
+    @staticmethod
     def plot_simulations(
-        self,
-        # folder_name,
         data,
         n_init_conditions,
         n_sims_per_init_condition,
         column_names,
     ):
+        """
+        Plots the trajectories of a random initial condition, see `utils.plotting.plot_ensemble`.
+        Returns: the PNG bytes
+        """
         i = random.randint(0, n_init_conditions - 1)
 
         sims = data[
@@ -263,29 +397,7 @@ class SimulationManager:
             :,
             :,
         ]
-
-        means = np.mean(sims, axis=0)
-        stds = np.std(sims, axis=0)
-        plt.figure()
-
-        # plot the mean and standard deviation for each species
-        for j in range(1, sims.shape[2]):
-            plt.plot(means[:, 0], means[:, j], label=column_names[j])
-            plt.fill_between(
-                means[:, 0],
-                means[:, j] - stds[:, j],
-                means[:, j] + stds[:, j],
-                alpha=0.2,
-            )
-
-        plt.legend()
-        plt.show()
-
-        fig = plt.gcf()
-        png_bytes = io.BytesIO()
-        fig.savefig(png_bytes, format="png")
-
-        return png_bytes
+        return plot_ensemble(sims, column_names)
 
     def truncate_columns(self, data, n_cols):
         return data[..., :-n_cols]
@@ -0,0 +1,162 @@
+"""
+Compact encoding of SSA trajectory datasets.
+
+SSA trajectories consist of integer molecule counts on a time grid that is shared by all trajectories, and of
+reaction rates that are constant along every trajectory. Stored densely as float64 arrays of shape
+(n_trajectories, n_steps + 1, 1 + n_species + n_parameters), most of the memory holds redundant information.
+CompactTrajectories instead stores:
+- the counts as the narrowest integer type that fits them, optionally as differences between consecutive
+  time points (which are small for fine time grids),
+- the time grid once,
+- the reaction rates once per trajectory.
+"""
+import numpy as np
+
+INTEGER_TYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def get_narrowest_integer_type(minimum, maximum):
+    for dtype in INTEGER_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= minimum and maximum <= info.max:
+            return dtype
+    raise ValueError(f"The values in [{minimum}, {maximum}] do not fit into 64 bits.")
+
+
+class CompactTrajectories:
+    """
+    Behaves like the dense array of shape (n_trajectories, n_steps + 1, 1 + n_species + n_parameters) for indexing
+    with a single trajectory index, e.g. `data[i, ::stride, :]`, which decodes only the indexed trajectory.
+    """
+
+    def __init__(self, counts, time_grid, parameters, delta_encoded=False):
+        self.counts = counts
+        self.time_grid = time_grid
+        self.parameters = parameters
+        self.delta_encoded = delta_encoded
+
+    @classmethod
+    def encode(cls, data, n_species, delta_encoded=False):
+        """
+        Encodes the dense trajectories, which must share their time grid and contain integer counts.
+        """
+        time_grid = data[0, :, 0].copy()
+        if not np.allclose(data[:, :, 0], time_grid):
+            raise ValueError("The trajectories do not share the same time grid.")
+
+        species = data[:, :, 1 : n_species + 1]
+        if not np.array_equal(species, np.round(species)):
+            raise ValueError("The trajectories do not contain integer molecule counts.")
+
+        parameters = data[:, 0, n_species + 1 :].copy()
+        if not np.all(data[:, :, n_species + 1 :] == parameters[:, None, :]):
+            raise ValueError("The reaction rates are not constant along the trajectories.")
+
+        counts = species.astype(np.int64)
+        if delta_encoded:
+            counts[:, 1:] = np.diff(counts, axis=1)
+        dtype = get_narrowest_integer_type(counts.min(initial=0), counts.max(initial=0))
+
+        return cls(counts.astype(dtype), time_grid, parameters, delta_encoded)
+
+    @property
+    def shape(self):
+        n_trajectories, n_steps, n_species = self.counts.shape
+        return (n_trajectories, n_steps, 1 + n_species + self.parameters.shape[1])
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + self.time_grid.nbytes + self.parameters.nbytes
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if not isinstance(key[0], (int, np.integer)):
+            raise IndexError(
+                "CompactTrajectories only support indexing a single trajectory, use `decode` or `subset` instead."
+            )
+        return self.decode(key[0])[key[1:]]
+
+    def decode(self, index=slice(None), dtype=np.float64):
+        """
+        Returns the dense trajectories selected by `index` (an integer, a slice or an array of indices).
+        """
+        species = self.counts[index].astype(dtype)
+        if self.delta_encoded:
+            species = np.cumsum(species, axis=-2)
+
+        time = np.broadcast_to(self.time_grid[:, None], species.shape[:-1] + (1,))
+        parameters = np.expand_dims(self.parameters[index], axis=-2)
+        parameters = np.broadcast_to(
+            parameters, species.shape[:-1] + (parameters.shape[-1],)
+        )
+        return np.concatenate((time, species, parameters), axis=-1).astype(dtype)
+
+    def subset(self, index):
+        """
+        Returns the trajectories selected by `index` (a slice or an array of indices), without decoding them.
+        """
+        return CompactTrajectories(
+            self.counts[index], self.time_grid, self.parameters[index], self.delta_encoded
+        )
+
+    def strided(self, stride):
+        """
+        Returns the trajectories at every `stride`-th time point.
+        """
+        counts = self.counts
+        if self.delta_encoded:
+            counts = np.cumsum(counts, axis=1, dtype=np.int64)[:, ::stride]
+            counts[:, 1:] = np.diff(counts, axis=1)
+            counts = counts.astype(
+                get_narrowest_integer_type(counts.min(initial=0), counts.max(initial=0))
+            )
+        else:
+            counts = counts[:, ::stride]
+        return CompactTrajectories(
+            counts, self.time_grid[::stride], self.parameters, self.delta_encoded
+        )
+
+    def concatenate(self, data):
+        """
+        Returns the trajectories extended by the given dense trajectories, which are encoded the same way.
+        """
+        other = CompactTrajectories.encode(
+            data, self.counts.shape[2], self.delta_encoded
+        )
+        if not np.allclose(other.time_grid, self.time_grid):
+            raise ValueError("The trajectories do not share the same time grid.")
+        return CompactTrajectories(
+            np.concatenate((self.counts, other.counts)),
+            self.time_grid,
+            np.concatenate((self.parameters, other.parameters)),
+            self.delta_encoded,
+        )
+
+    def get_mean_std(self, batch_size=1024):
+        """
+        Returns the mean and standard deviation of every variable of the dense trajectories, decoded in batches.
+        """
+        total = np.zeros(self.shape[2])
+        total_squares = np.zeros(self.shape[2])
+        for start in range(0, len(self), batch_size):
+            batch = self.decode(slice(start, start + batch_size))
+            total += batch.sum(axis=(0, 1))
+            total_squares += np.square(batch).sum(axis=(0, 1))
+
+        count = self.shape[0] * self.shape[1]
+        mean = total / count
+        std = np.sqrt(np.maximum(total_squares / count - np.square(mean), 0.0))
+        return mean, std
+
+    def get_min_max(self, batch_size=1024):
+        minimum = np.full(self.shape[2], np.inf)
+        maximum = np.full(self.shape[2], -np.inf)
+        for start in range(0, len(self), batch_size):
+            batch = self.decode(slice(start, start + batch_size))
+            minimum = np.minimum(minimum, batch.min(axis=(0, 1)))
+            maximum = np.maximum(maximum, batch.max(axis=(0, 1)))
+        return minimum, maximum
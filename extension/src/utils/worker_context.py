@@ -0,0 +1,19 @@
+"""
+Execution context of worker processes, e.g. of batch processing or hyperparameter search.
+"""
+
+
+class WorkerContext:
+    """
+    Stands in for the KNIME execution context, which is not available in worker processes.
+    If a shared `cancel_event` (e.g. of a multiprocessing manager) is given, the workers are cancelled through it.
+    """
+
+    def __init__(self, cancel_event=None):
+        self.cancel_event = cancel_event
+
+    def is_canceled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+    def set_progress(self, progress):
+        pass